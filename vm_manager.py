@@ -1,15 +1,21 @@
 #!/usr/bin/env python3
 """Enhanced single-file libvirtd VM manager with, backups, snapshots, security, and advanced features.
 Supports snapshots, backups, enhanced networking, SSL, authentication, and more.
-All assets inline. Requires python3-libvirt, python3-cryptography (optional for SSL).
+All assets inline. Requires python3-libvirt, python3-cryptography (optional for SSL),
+python3-orjson (optional, faster JSON API responses), python3-numpy and python-isal (optional, faster screenshots),
+python3-lxml (optional, faster XML handling) and python3-markupsafe (optional, faster dashboard rendering).
 """
 from __future__ import annotations
-import os, socket, html, urllib.parse, re, struct, zlib, subprocess, tempfile, shutil, threading, time, json
-import hashlib, hmac, base64, datetime, uuid, pathlib, glob, tarfile, gzip
+import os, socket, html, urllib.parse, re, struct, zlib, subprocess, tempfile, shutil, threading, time, json, shlex
+import hashlib, hmac, base64, datetime, uuid, pathlib, glob, tarfile, gzip, mmap, select, pwd, mimetypes, traceback, string, atexit, copy, errno
+import urllib.request
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-from io import BytesIO, StringIO
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Any, Tuple, Union
 from urllib.parse import urlparse
+from email import message_from_bytes
+from email.policy import default as email_policy
 import ssl
 import logging
 
@@ -18,6 +24,62 @@ try:
 except Exception:  # pragma: no cover
     libvirt = None
 
+try:
+    import libvirt_qemu  # type: ignore
+except Exception:  # pragma: no cover
+    libvirt_qemu = None
+
+# Resolved once; compared against in every per-domain loop
+VIR_DOMAIN_RUNNING = getattr(libvirt, 'VIR_DOMAIN_RUNNING', 1)
+VIR_DOMAIN_AFFECT_LIVE = getattr(libvirt, 'VIR_DOMAIN_AFFECT_LIVE', 0)
+VIR_DOMAIN_AFFECT_CONFIG = getattr(libvirt, 'VIR_DOMAIN_AFFECT_CONFIG', 0)
+# Device hot(un)plug: a running domain gets the change live and persisted, a stopped one only persisted
+DEVICE_FLAGS_RUNNING = VIR_DOMAIN_AFFECT_LIVE | VIR_DOMAIN_AFFECT_CONFIG
+DEVICE_FLAGS_STOPPED = VIR_DOMAIN_AFFECT_CONFIG
+# Full-cleanup undefine; KEEP_NVRAM is left out since libvirt rejects it together with NVRAM
+VIR_DOMAIN_UNDEFINE_NVRAM = getattr(libvirt, 'VIR_DOMAIN_UNDEFINE_NVRAM', 0)
+UNDEFINE_FLAGS = VIR_DOMAIN_UNDEFINE_NVRAM
+for _flag in ('VIR_DOMAIN_UNDEFINE_MANAGED_SAVE', 'VIR_DOMAIN_UNDEFINE_SNAPSHOTS_METADATA',
+              'VIR_DOMAIN_UNDEFINE_CHECKPOINTS_METADATA'):
+    UNDEFINE_FLAGS |= getattr(libvirt, _flag, 0)
+del _flag
+# Live disk migration: a block copy job that need not survive a restart, finished by pivoting onto the copy
+VIR_DOMAIN_BLOCK_COPY_TRANSIENT_JOB = getattr(libvirt, 'VIR_DOMAIN_BLOCK_COPY_TRANSIENT_JOB', 0)
+VIR_DOMAIN_BLOCK_JOB_ABORT_PIVOT = getattr(libvirt, 'VIR_DOMAIN_BLOCK_JOB_ABORT_PIVOT', 0)
+VIR_ERR_BLOCK_COPY_ACTIVE = getattr(libvirt, 'VIR_ERR_BLOCK_COPY_ACTIVE', None)
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:
+    np = None
+
+# C-accelerated HTML escaping for per-row rendering; same entities as html.escape up to spelling
+try:
+    from markupsafe import escape as escape_html  # type: ignore
+except ImportError:
+    escape_html = html.escape
+
+# libxml2-backed ElementTree API when installed: parsing, find/findall and serialisation run in C
+try:
+    from lxml import etree as ET  # type: ignore
+except ImportError:
+    import xml.etree.ElementTree as ET
+# Set only for lxml, which adds compiled XPath on top of the shared API
+fast_etree = ET if hasattr(ET, 'XPath') else None
+
+# Deflate and CRC-32 for screenshot PNGs: ISA-L when installed (levels 0-3), stock zlib otherwise.
+# Screenshots are throwaway live-view frames, so favour encode latency over size: level 1 on both.
+try:
+    from isal import isal_zlib as png_zlib  # type: ignore
+except ImportError:
+    png_zlib = zlib
+PNG_ZLEVEL = 1
+
 try:
     from cryptography.fernet import Fernet
     from cryptography.hazmat.primitives import hashes
@@ -34,12 +96,36 @@ SSL_KEY = os.environ.get('VM_MGR_SSL_KEY', '')
 AUTH_PASSWORD = os.environ.get('VM_MGR_PASSWORD', '')  # Empty = no auth
 LOG_LEVEL = os.environ.get('VM_MGR_LOG_LEVEL', 'INFO')
 BACKUP_DIR = os.environ.get('VM_MGR_BACKUP_DIR', '/')
+# Skip the sudo fork (and its PAM setup) for read-only helpers when already root
+SUDO = [] if os.geteuid() == 0 else ['sudo']
 # Setup logging
 logging.basicConfig(level=getattr(logging, LOG_LEVEL.upper()), 
                    format='%(asctime)s [%(levelname)s] %(message)s',
                    handlers=[logging.StreamHandler()])
 logger = logging.getLogger(__name__)
 
+JSON_OK = b'{"success": true}'
+JSON_STATUS_OK = b'{"status": "success"}'
+
+# Upper bound for one-shot virsh invocations so a wedged libvirtd cannot pin a request thread
+VIRSH_TIMEOUT = 30
+
+def json_error(msg: str) -> bytes:
+    """Serialize a {"success": false, "error": msg} reply, encoding only the message"""
+    return b'{"success": false, "error": ' + json.dumps(msg).encode() + b'}'
+
+def jdumps(obj) -> bytes:
+    """Serialize an API payload to JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj).encode()
+
+def jloads(data: bytes):
+    """Parse JSON bytes straight from a subprocess pipe, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 def human_bytes(v: Union[int, float]) -> str:
     v = float(v)
     for u in ['B', 'KiB', 'MiB', 'GiB', 'TiB']:
@@ -114,6 +200,181 @@ local-hostname: {hostname}
     shutil.rmtree(iso_dir)
     return iso_path
 
+def device_uuid(device_path: str) -> Optional[str]:
+    """Resolve a block device's filesystem UUID via /dev/disk/by-uuid, falling back to blkid"""
+    real = os.path.realpath(device_path)
+    # udev may not have created the symlink yet for a freshly created array
+    for attempt in range(5):
+        try:
+            with os.scandir('/dev/disk/by-uuid') as it:
+                for entry in it:
+                    if os.path.realpath(entry.path) == real:
+                        return entry.name
+        except OSError:
+            break
+        if attempt < 4:
+            time.sleep(0.1)
+    try:
+        return subprocess.check_output(['sudo','blkid','-s','UUID','-o','value',device_path], text=True).strip() or None
+    except Exception:
+        return None
+
+def fstab_append(line: str):
+    """Append one entry to /etc/fstab with a single O_APPEND write (atomic for short lines)"""
+    fd = os.open('/etc/fstab', os.O_WRONLY | os.O_APPEND | os.O_DSYNC | os.O_CLOEXEC)
+    try:
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+def fstab_remove(*tokens: str):
+    """Drop every /etc/fstab line that mentions any of the given tokens"""
+    tokens = [t for t in tokens if t]
+    if not tokens:
+        return
+    pat = re.compile(b'|'.join(re.escape(t.encode()) for t in tokens))
+    with open('/etc/fstab', 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            lines = mm[:].splitlines(keepends=True)
+    kept = b''.join(line for line in lines if not pat.search(line))
+    with open('/etc/fstab', 'wb') as f:
+        f.write(kept)
+
+def data_extents(fd: int, size: int):
+    """(start, end) ranges of fd holding data, skipping holes; the whole file where SEEK_DATA is unsupported"""
+    if not hasattr(os, 'SEEK_DATA'):
+        yield 0, size
+        return
+    pos = 0
+    while pos < size:
+        try:
+            start = os.lseek(fd, pos, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno != errno.ENXIO:  # ENXIO: only a hole is left
+                yield pos, size
+            return
+        end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        yield start, end
+        pos = end
+
+def fast_copy(src: str, dst: str):
+    """Copy a file's data extents with in-kernel copy_file_range, falling back to a 1 MiB buffered copy;
+    holes stay holes, so thin images stay thin, and mode and timestamps follow the source"""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        ifd, ofd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(ifd).st_size
+        use_cfr = hasattr(os, 'copy_file_range')
+        for start, end in data_extents(ifd, size):
+            offset = start
+            if use_cfr:
+                try:
+                    while offset < end:
+                        n = os.copy_file_range(ifd, ofd, end - offset, offset, offset)
+                        if n == 0:
+                            break
+                        offset += n
+                except OSError:
+                    # EXDEV/ENOSYS etc: finish this and later extents in userspace
+                    use_cfr = False
+            while offset < end:
+                buf = os.pread(ifd, min(1 << 20, end - offset), offset)
+                if not buf:
+                    break
+                offset += os.pwrite(ofd, buf, offset)
+        os.ftruncate(ofd, size)
+    shutil.copystat(src, dst)
+
+def dir_is_empty(path: str) -> bool:
+    """True if path has no entries; stops at the first one instead of listing the directory"""
+    with os.scandir(path) as it:
+        return next(it, None) is None
+
+# Sub-cluster allocation (qemu 5.2+): 128k clusters with extended L2 entries keep the
+# L2 tables small while allocating 4k at a time; lazy refcounts skip the refcount
+# flush on cluster allocation (qemu repairs them from the dirty flag after a crash).
+QCOW2_CREATE_OPTS = 'extended_l2=on,cluster_size=128k,lazy_refcounts=on'
+
+def qemu_img_create(disk_path: str, size_gb: int, timeout=None, preallocate_metadata: bool = False):
+    """Create a qcow2 image, retrying with default options on qemu-img without extended_l2.
+    Header-only creation is near instant; preallocated metadata writes every L2 table up
+    front, so it is only worth it for disks created in the background."""
+    opts = QCOW2_CREATE_OPTS + (',preallocation=metadata' if preallocate_metadata else '')
+    try:
+        subprocess.run(['qemu-img', 'create', '-f', 'qcow2', '-o', opts, disk_path, f'{size_gb}G'],
+                       check=True, capture_output=True, timeout=timeout)
+    except subprocess.CalledProcessError:
+        subprocess.run(['qemu-img', 'create', '-f', 'qcow2', disk_path, f'{size_gb}G'],
+                       check=True, capture_output=True, timeout=timeout)
+
+# Background creation of large disks; they contend for the same host disk, so keep it to two at a time
+DISK_CREATE_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix='diskcreate')
+atexit.register(DISK_CREATE_POOL.shutdown, wait=False, cancel_futures=True)
+# Removal of undefined VMs' files, kept apart so it never queues behind a disk creation.
+# Queued removals are not cancelled at exit: they only ever touch tombstoned paths.
+FILE_CLEANUP_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix='filecleanup')
+atexit.register(FILE_CLEANUP_POOL.shutdown, wait=False)
+
+# Live disk migrations (libvirt block copy jobs) are monitored here; further jobs queue as 'starting'
+BLOCKCOPY_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='blockcopy')
+atexit.register(BLOCKCOPY_POOL.shutdown, wait=False, cancel_futures=True)
+BLOCKCOPY_POLL_MIN, BLOCKCOPY_POLL_MAX = 0.5, 5.0  # seconds between blockJobInfo polls
+MIGRATION_JOBS_MAX = 256
+MIGRATION_JOB_TTL = 3600.0  # seconds a finished job stays visible to the status API
+
+def black_png(width: int, height: int) -> bytes:
+    """Build a minimal all-black grayscale PNG"""
+    # PNG signature
+    png_sig = b'\x89PNG\r\n\x1a\n'
+    
+    # IHDR chunk (width, height, bit_depth=8, color_type=0 (grayscale), compression=0, filter=0, interlace=0)
+    ihdr_data = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)
+    ihdr_crc = zlib.crc32(b'IHDR' + ihdr_data) & 0xffffffff
+    ihdr = struct.pack('>I', len(ihdr_data)) + b'IHDR' + ihdr_data + struct.pack('>I', ihdr_crc)
+    
+    # IDAT chunk (compressed black pixels)
+    pixels = b'\x00' * (width + 1) * height  # +1 for filter byte per row
+    idat_data = zlib.compress(pixels)
+    idat_crc = zlib.crc32(b'IDAT' + idat_data) & 0xffffffff
+    idat = struct.pack('>I', len(idat_data)) + b'IDAT' + idat_data + struct.pack('>I', idat_crc)
+    
+    # IEND chunk
+    iend_crc = zlib.crc32(b'IEND') & 0xffffffff
+    iend = struct.pack('>I', 0) + b'IEND' + struct.pack('>I', iend_crc)
+    
+    return png_sig + ihdr + idat + iend
+
+# Screenshot error placeholder; identical for every failure, so build it once
+ERROR_PNG = black_png(320, 240)
+
+# Frames with at least two bands of scanline data are deflated band-by-band on this pool
+PNG_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='png')
+PNG_BAND_SIZE = 1 << 20
+
+def png_idat(scan: memoryview, level: int) -> Tuple[List[bytes], int]:
+    """Deflate PNG scanlines into a zlib stream. Returns its pieces and their CRC-32 seeded
+    with the IDAT chunk type. Large frames are split into bands compressed concurrently
+    (zlib and ISA-L drop the GIL); each band is CRC'd as soon as it is ready while later
+    bands are still compressing, and the Adler-32 of the raw data runs alongside."""
+    crc = png_zlib.crc32(b'IDAT')
+    if len(scan) < 2 * PNG_BAND_SIZE:
+        idat = png_zlib.compress(scan, level)
+        return [idat], png_zlib.crc32(idat, crc)
+    starts = range(0, len(scan), PNG_BAND_SIZE)
+    last = starts[-1]
+    def deflate_band(start):
+        c = png_zlib.compressobj(level, zlib.DEFLATED, -15)  # raw deflate; bands end on a byte boundary
+        return c.compress(scan[start:start + PNG_BAND_SIZE]) + c.flush(zlib.Z_FINISH if start == last else zlib.Z_SYNC_FLUSH)
+    adler = PNG_POOL.submit(png_zlib.adler32, scan)
+    parts = [b'\x78\x01']  # zlib header: deflate, 32K window (the level bits are advisory)
+    crc = png_zlib.crc32(parts[0], crc)
+    for band in PNG_POOL.map(deflate_band, starts):
+        parts.append(band)
+        crc = png_zlib.crc32(band, crc)
+    parts.append(struct.pack('!I', adler.result()))
+    return parts, png_zlib.crc32(parts[-1], crc)
+
 class LV:
     def __init__(self):
         if libvirt is None: raise RuntimeError('libvirt module not available')
@@ -184,7 +445,6 @@ class LV:
     def _get_pci_device_name(self, pci_addr):
         """Get detailed device name from lspci output"""
         try:
-            import subprocess
             result = subprocess.run(['lspci', '-s', pci_addr], capture_output=True, text=True, timeout=5)
             if result.returncode == 0 and result.stdout.strip():
                 output = result.stdout.strip()
@@ -212,6 +472,7 @@ class LV:
         xml=f"<pool type='dir'><name>{name}</name><target><path>{path}</path></target></pool>"
         p=self.conn.storagePoolDefineXML(xml,0); p.build(0); p.create(0)
         if autostart: p.setAutostart(1)
+        POOL_PATH_CACHE.pop(name, None)
         return p
     
     def create_snapshot(self, domain_name: str, snap_name: str, description: str = ""):
@@ -222,15 +483,14 @@ class LV:
         if was_running:
             # For running VMs, use virsh command which can handle disk-only snapshots better
             try:
-                import subprocess
                 cmd = ['virsh', 'snapshot-create-as', domain_name, snap_name, '--disk-only', '--atomic']
                 # Only add description if it's not empty
                 if description and description.strip():
                     cmd.insert(3, description.strip())  # Insert description after snap_name
-                subprocess.check_call(cmd)
+                subprocess.check_call(cmd, timeout=VIRSH_TIMEOUT, close_fds=False)
                 # Return a dummy object since virsh doesn't return the snapshot object
                 return True
-            except subprocess.CalledProcessError as e:
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
                 raise RuntimeError(f"Failed to create snapshot via virsh: {e}")
         else:
             # For stopped VMs, use internal snapshots via libvirt API
@@ -260,6 +520,7 @@ class LV:
         domain = self.get_domain(domain_name)
         snapshot = domain.snapshotLookupByName(snap_name)
         snapshot.delete()
+        SNAPSHOT_CTIME_CACHE.pop((domain.UUIDString(), snap_name), None)
     
     def backup_vm(self, domain_name: str, backup_path: str):
         """Create a full backup of a VM"""
@@ -289,11 +550,10 @@ class LV:
                 f.write(xml)
             
             # Copy disk files
-            import xml.etree.ElementTree as ET
             root = ET.fromstring(xml)
             disk_files = []
             
-            for disk in root.findall('.//devices/disk'):
+            for disk in domain_disks(root):
                 source = disk.find('source')
                 if source is not None and 'file' in source.attrib:
                     disk_path = source.get('file')
@@ -308,12 +568,13 @@ class LV:
                         ])
                         disk_files.append(disk_name)
             
-            # Create backup manifest
+            # Create backup manifest; record the size so the backups page needn't walk the directory
             manifest = {
                 'domain_name': domain_name,
                 'backup_time': datetime.datetime.now().isoformat(),
                 'was_running': was_running,
-                'disk_files': disk_files
+                'disk_files': disk_files,
+                'total_size': backup_dir_size(backup_dir)
             }
             
             with open(os.path.join(backup_dir, 'manifest.json'), 'w') as f:
@@ -327,11 +588,12 @@ class LV:
                 try:
                     if was_running:
                         # For virsh-created snapshots, delete via command
-                        subprocess.check_call(['sudo', 'virsh', 'snapshot-delete', domain_name, snap_name])
+                        subprocess.check_call(['sudo', 'virsh', 'snapshot-delete', domain_name, snap_name], timeout=VIRSH_TIMEOUT, close_fds=False)
                     else:
                         # For libvirt API snapshots, use the object
                         if hasattr(snapshot, 'delete') and callable(snapshot.delete):
                             snapshot.delete()
+                    SNAPSHOT_CTIME_CACHE.pop((domain.UUIDString(), snap_name), None)
                 except Exception:
                     pass
     
@@ -347,7 +609,6 @@ class LV:
         
         # Modify XML if new name provided
         if new_name:
-            import xml.etree.ElementTree as ET
             root = ET.fromstring(xml)
             name_elem = root.find('name')
             if name_elem is not None:
@@ -361,7 +622,6 @@ class LV:
             pools = self.list_pools()
             if pools:
                 pool = pools[0]  # Use first available pool
-                import xml.etree.ElementTree as ET
                 proot = ET.fromstring(pool.XMLDesc(0))
                 pool_path = proot.findtext('.//target/path') or '/var/lib/libvirt/images'
                 
@@ -375,6 +635,189 @@ class LV:
         # Define the domain
         self.conn.defineXML(xml)
 
+SNAPSHOT_CTIME_RE = re.compile(r'<creationTime>(\d+)</creationTime>')
+# (domain uuid, snapshot name) -> formatted creation time; creation times never change once taken
+SNAPSHOT_CTIME_CACHE: Dict[Tuple[str, str], str] = {}
+
+def snapshot_ctime(snap) -> str:
+    """Read a snapshot's creation time from its XML, formatted for display"""
+    m = SNAPSHOT_CTIME_RE.search(snap.getXMLDesc())
+    if not m:
+        return "Unknown"
+    return datetime.datetime.fromtimestamp(int(m.group(1))).strftime('%Y-%m-%d %H:%M:%S')
+
+CDROM_TARGETS = tuple(f'hd{c}' for c in string.ascii_lowercase)  # IDE slots in the order attach_cdrom fills them
+
+DISK_TARGET_RE = {
+    'virtio': re.compile(r'vd[a-z]\Z'),
+    'scsi': re.compile(r'sd[a-z]\Z'),
+    'sata': re.compile(r'hd[a-z]\Z'),
+}
+DISK_TARGET_PREFIX = {'virtio': 'vd', 'scsi': 'sd', 'sata': 'hd'}
+
+def file_disk_xml(path: str, target: str, bus: str, fmt: str = 'qcow2', device: str = 'disk') -> str:
+    """<disk> device XML for a file-backed disk or CD-ROM; ElementTree handles attribute escaping"""
+    disk = ET.Element('disk', type='file', device=device)
+    ET.SubElement(disk, 'driver', name='qemu', type=fmt)
+    ET.SubElement(disk, 'source', file=path)
+    ET.SubElement(disk, 'target', dev=target, bus=bus)
+    if device == 'cdrom':
+        ET.SubElement(disk, 'readonly')
+    return ET.tostring(disk, encoding='unicode')
+
+def detach_disk_xml(disk) -> str:
+    """Serialize a <disk> for detachDeviceFlags without its <address>; libvirt matches disks by target dev"""
+    addr = disk.find('address')
+    if addr is not None:
+        disk = copy.copy(disk)  # leaves the (possibly shared) source tree untouched
+        disk.remove(disk.find('address'))
+    return ET.tostring(disk, encoding='unicode')
+
+def replace_xml_child(root, elem, after: str = 'os'):
+    """Swap root's child with elem's tag for elem in place, or insert elem after the <after> child"""
+    children = list(root)
+    old = root.find(elem.tag)
+    if old is not None:
+        idx = children.index(old)
+        elem.tail = old.tail
+        root.remove(old)
+    else:
+        anchor = root.find(after)
+        idx = len(children)
+        if anchor is not None:
+            idx = children.index(anchor) + 1
+            elem.tail = anchor.tail
+    root.insert(idx, elem)
+
+BACKUP_MANIFEST_CACHE={}  # manifest path -> (mtime_ns, manifest dict)
+
+def backup_dir_size(backup_path: str) -> int:
+    """Total size of all files under a backup directory"""
+    total_size = 0
+    for root, dirs, files in os.walk(backup_path):
+        for file in files:
+            total_size += os.path.getsize(os.path.join(root, file))
+    return total_size
+
+def load_backup_manifest(backup_path: str) -> Optional[dict]:
+    """Load a backup's manifest.json (with total_size filled in), cached until the file changes"""
+    manifest_path = os.path.join(backup_path, 'manifest.json')
+    try:
+        mtime_ns = os.stat(manifest_path).st_mtime_ns
+    except OSError:
+        return None
+    cached = BACKUP_MANIFEST_CACHE.get(manifest_path)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    if 'total_size' not in manifest:
+        # Manifests written before total_size was recorded
+        manifest['total_size'] = backup_dir_size(backup_path)
+    BACKUP_MANIFEST_CACHE[manifest_path] = (mtime_ns, manifest)
+    return manifest
+
+HOST_IP_CACHE={'ip':None,'ts':0.0}
+
+def get_host_ip(ttl: float = 300) -> str:
+    """Primary outbound IPv4 address of this host, cached for ttl seconds"""
+    now = time.monotonic()
+    if HOST_IP_CACHE['ip'] and now - HOST_IP_CACHE['ts'] < ttl:
+        return HOST_IP_CACHE['ip']
+    try:
+        # Connect to a remote address to determine the local IP (UDP: no packets are sent)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.settimeout(0.5)
+            s.connect(("8.8.8.8", 80))
+            host_ip = s.getsockname()[0]
+    except Exception:
+        # Fallback to localhost if unable to determine IP; don't cache the fallback
+        return "127.0.0.1"
+    HOST_IP_CACHE.update(ip=host_ip, ts=now)
+    return host_ip
+
+POOL_PATH_CACHE={}  # pool name -> (fetched_at, target path)
+
+def get_pool_path(lv: LV, pool_name: str, ttl: float = 30) -> str:
+    """Return a pool's target path, caching the XMLDesc parse for ttl seconds"""
+    now = time.monotonic()
+    cached = POOL_PATH_CACHE.get(pool_name)
+    if cached and now - cached[0] < ttl:
+        return cached[1]
+    proot = ET.fromstring(lv.get_pool(pool_name).XMLDesc(0))
+    pool_path = proot.findtext('.//target/path') or ''
+    POOL_PATH_CACHE[pool_name] = (now, pool_path)
+    return pool_path
+
+DOMAIN_CACHE={}  # domain name -> (fetched_at, virDomain); evicted on error or domain edits
+
+def get_domain_cached(lv: LV, name: str, ttl: float = 5.0):
+    """Return a domain handle, reusing a recent lookup to skip the lookupByName RPC"""
+    now = time.monotonic()
+    cached = DOMAIN_CACHE.get(name)
+    if cached and now - cached[0] < ttl:
+        return cached[1]
+    d = lv.get_domain(name)
+    DOMAIN_CACHE[name] = (now, d)
+    return d
+
+# Compiled once; returns every file-backed disk's source path as a string list
+DISK_FILE_XPATH = fast_etree.XPath('.//devices/disk[@type="file" and @device="disk"]/source/@file') if fast_etree is not None else None
+# <disk> children of <devices>, filtered by device kind and/or target dev ("" matches any)
+DISKS_XPATH = fast_etree.XPath('devices/disk[$device="" or @device=$device][$target="" or target/@dev=$target]') if fast_etree is not None else None
+
+def domain_disks(root, device: str = '', target: str = '') -> list:
+    """Disks of a parsed domain, optionally only one device kind (disk/cdrom) or the one at a target dev"""
+    if DISKS_XPATH is not None:
+        return DISKS_XPATH(root, device=device, target=target)
+    disks = root.findall(f"devices/disk[@device='{device}']" if device else 'devices/disk')
+    if target:
+        disks = [disk for disk in disks if disk.find('target') is not None and disk.find('target').get('dev') == target]
+    return disks
+
+DOMAIN_DISKS_CACHE={}  # domain uuid -> (fetched_at, [file-backed disk paths]); evicted on domain edits
+
+def domain_disk_paths(d, ttl: float = 30.0) -> List[str]:
+    """File-backed disk paths from a domain's inactive XML, memoized per domain UUID"""
+    now = time.monotonic()
+    key = d.UUIDString()
+    cached = DOMAIN_DISKS_CACHE.get(key)
+    if cached and now - cached[0] < ttl:
+        return cached[1]
+    xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
+    if DISK_FILE_XPATH is not None:
+        # str() detaches the results from the parsed tree so the cache does not pin it
+        paths = [str(p) for p in DISK_FILE_XPATH(ET.fromstring(xml)) if p]
+    else:
+        paths = []
+        for disk in ET.fromstring(xml).iterfind('.//devices/disk[@type="file"][@device="disk"]'):
+            source = disk.find('source')
+            if source is not None and source.get('file'):
+                paths.append(source.get('file'))
+    DOMAIN_DISKS_CACHE[key] = (now, paths)
+    return paths
+
+def qemu_monitor_command(domain, command: str, hmp: bool = False) -> Tuple[bool, str]:
+    """Run a QEMU monitor command through the domain's libvirt connection; falls back to
+    virsh qemu-monitor-command when the libvirt_qemu binding is missing"""
+    if libvirt_qemu is not None:
+        try:
+            reply = libvirt_qemu.qemuMonitorCommand(domain, command, libvirt_qemu.VIR_DOMAIN_QEMU_MONITOR_COMMAND_HMP if hmp else 0)
+        except libvirt.libvirtError as e:
+            return False, str(e)
+        if not hmp and '"error"' in reply:
+            return False, reply
+        return True, ''
+    cmd = ['virsh', 'qemu-monitor-command', domain.name(), '--hmp' if hmp else '--pretty', command]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=5, close_fds=False)
+    return result.returncode == 0, result.stderr
+
+DASHBOARD_ROW_TEMPLATE="<tr data-vm='{name_esc}'><td><div style='display:flex;align-items:center;gap:8px;'><div style='width:8px;height:8px;border-radius:50%;background:{status_color};'></div><a href='/?domain={name_quoted}' style='font-weight:500;text-decoration:none;color:var(--text);'>{name_esc}</a></div></td><td><span class='badge {status}'>{status}</span></td><td class='cpu'>-</td><td class='mem'>-</td><td class='mem_pct'>-</td><td class='io'>-</td><td class='storage'>{storage}</td><td>{actions}</td></tr>"
+
+DASHBOARD_CACHE=[0.0, None]  # [rendered_at, html]; dropped on any POST so actions show up at once
+DISK_USAGE_CACHE={}  # disk path -> (fetched_at, (used_gb, allocated_gb)) for the dashboard storage column
+DISK_INFO_CACHE={}  # disk path -> (fetched_at, st_mtime_ns, st_size, (used_gb, allocated_gb)); reused while the image is unchanged
+
 PAGE_TEMPLATE="<!DOCTYPE html><html><head><meta charset='utf-8'><title>{title}</title><style>{css}</style><script>{js}</script><script>if(!window.openModal){{window.openModal=function(id){{var m=document.getElementById(id);if(m){{m.hidden=false;m.style.display='flex';}}}};window.closeModal=function(id){{var m=document.getElementById(id);if(m){{m.hidden=true;}}}};}}</script></head><body class='{theme}'><header><h1>🖥️ VM Manager</h1><nav><a href='/'>Dashboard</a> | <a href='/?images=1'>Images</a> | <a href='/?storage=1'>Storage</a> | <a href='/?networks=1'>Networks</a> | <a href='/?hardware=1'>Hardware</a> | <a href='/?backups=1'>Backups</a> | <button class='theme-toggle' onclick='toggleTheme()'>🌙</button></nav></header><main>{body}</main></body></html>"
 
 CSS=r""":root{--bg:#0f1115;--fg:#e6e8ea;--accent:#4da3ff;--danger:#ff4d5d;--ok:#3ecf8e;--warn:#ffb347;--card:#1b1f27;--border:#2a303b;--overlay:#000c;--success:#22c55e;--info:#06b6d4;--muted:#6b7280}
@@ -1003,7 +1446,6 @@ def start_image_ingest(pid:str,pool_name:str,src:str,out:str):
         nfs_mount_point = None  # Track NFS mount outside try block
         temp_dir = None  # Track temp directory
         try:
-            import xml.etree.ElementTree as ET
             lv=LV(); pool=lv.get_pool(pool_name)
             pxml=pool.XMLDesc(0); proot=ET.fromstring(pxml); pool_path=proot.findtext('.//target/path') or '/var/lib/libvirt/images'
             images_dir=os.path.join(pool_path,'images'); os.makedirs(images_dir,exist_ok=True)
@@ -1016,7 +1458,6 @@ def start_image_ingest(pid:str,pool_name:str,src:str,out:str):
             PROGRESS[pid]['msg'] = 'Connecting to source...'
             
             if src.startswith('http://') or src.startswith('https://'):
-                import urllib.request
                 lp=os.path.join(temp_dir,'download')
                 PROGRESS[pid]['msg'] = 'Downloading from URL...'
                 urllib.request.urlretrieve(src, lp)
@@ -1199,7 +1640,6 @@ def start_image_ingest(pid:str,pool_name:str,src:str,out:str):
             # Clean up temporary directory
             if temp_dir and os.path.exists(temp_dir):
                 try:
-                    import shutil
                     shutil.rmtree(temp_dir, ignore_errors=True)
                 except Exception:
                     # If cleanup fails, try to clean up any remaining mount points in /tmp
@@ -1235,19 +1675,24 @@ HOST_PREV={'cpu':None,'ts':0,'disk':{}}  # for host perf deltas
 # Sessions for basic authentication
 SESSIONS = {}  # session_id -> {username, expires}
 
+SESSION_COOKIE_RE = re.compile(r'(?:^|;)\s*vm_session=([^;\s]*)')
+
+def get_session_cookie(handler):
+    """Return the vm_session cookie value, parsed at most once per request"""
+    cached = getattr(handler, '_session_cookie', None)
+    if cached is not None and cached[0] is handler.headers:
+        return cached[1]
+    m = SESSION_COOKIE_RE.search(handler.headers.get('Cookie', ''))
+    session_cookie = m.group(1) if m else None
+    handler._session_cookie = (handler.headers, session_cookie)
+    return session_cookie
+
 def check_auth(handler):
     """Check if request is authenticated"""
     if not AUTH_PASSWORD:
         return True  # No auth required
     
-    session_cookie = None
-    if 'Cookie' in handler.headers:
-        cookies = handler.headers['Cookie']
-        for cookie in cookies.split(';'):
-            if cookie.strip().startswith('vm_session='):
-                session_cookie = cookie.split('=', 1)[1].strip()
-                break
-    
+    session_cookie = get_session_cookie(handler)
     if not session_cookie:
         return False
     
@@ -1270,13 +1715,339 @@ def create_session():
     }
     return session_id
 
+# Static restore dialog for the backups page (no per-request interpolation)
+BACKUP_RESTORE_MODAL = """
+<div class='modal' id='modal_restore_backup' hidden>
+    <div class='panel'>
+        <div style='display:flex;justify-content:space-between;align-items:center'>
+            <h3>🔄 Restore Backup</h3>
+            <button class='close secondary' onclick="closeModal('modal_restore_backup')">×</button>
+        </div>
+        <form method='post'>
+            <input type='hidden' name='restore_backup' value='1'>
+            <input type='hidden' id='restore_backup_path' name='backup_path' value=''>
+
+            <p>Restore backup of: <strong id='restore_original_name'></strong></p>
+
+            <label>New VM Name (leave empty to use original name)
+                <input name='new_name' placeholder='Optional: new-vm-name'>
+            </label>
+
+            <div style='margin-top:16px'>
+                <input type='submit' class='button success' value='Restore Backup'>
+                <button type='button' class='button secondary' onclick="closeModal('modal_restore_backup')">Cancel</button>
+            </div>
+        </form>
+    </div>
+</div>
+
+<script>
+function openRestoreModal(backupPath, originalName) {
+    document.getElementById('restore_backup_path').value = backupPath;
+    document.getElementById('restore_original_name').textContent = originalName;
+    openModal('modal_restore_backup');
+}
+</script>
+"""
+
+# Dashboard behaviour (status refresh, quick actions, live stats). Served once from
+# /static/dashboard.js with a content-hash URL so browsers cache it instead of
+# receiving it inline with every dashboard render.
+DASHBOARD_JS = """
+function refreshVMStatus() {
+    // Refresh VM status on dashboard
+    const isDashboard = window.location.pathname === '/' && !window.location.search.includes('domain=');
+    const isVMDetail = window.location.search.includes('domain=');
+
+    if (isDashboard) {
+        fetch('/')
+            .then(response => response.text())
+            .then(html => {
+                const parser = new DOMParser();
+                const doc = parser.parseFromString(html, 'text/html');
+
+                // Update VM table rows
+                const newTable = doc.querySelector('#vm_table tbody');
+                const currentTable = document.querySelector('#vm_table tbody');
+
+                if (newTable && currentTable) {
+                    const newRows = newTable.querySelectorAll('tr[data-vm]');
+                    const currentRows = currentTable.querySelectorAll('tr[data-vm]');
+
+                    newRows.forEach((newRow) => {
+                        const vmName = newRow.getAttribute('data-vm');
+                        const currentRow = currentTable.querySelector(`tr[data-vm="${vmName}"]`);
+
+                        if (currentRow) {
+                            // Update status badge
+                            const oldBadge = currentRow.querySelector('.badge');
+                            const newBadge = newRow.querySelector('.badge');
+                            if (oldBadge && newBadge && oldBadge.textContent !== newBadge.textContent) {
+                                oldBadge.textContent = newBadge.textContent;
+                                oldBadge.className = newBadge.className;
+                            }
+
+                            // Update status indicator dot
+                            const oldDot = currentRow.querySelector('div[style*="border-radius:50%"]');
+                            const newDot = newRow.querySelector('div[style*="border-radius:50%"]');
+                            if (oldDot && newDot && oldDot.style.background !== newDot.style.background) {
+                                oldDot.style.background = newDot.style.background;
+                            }
+
+                            // Update action buttons (last td)
+                            const oldActions = currentRow.querySelector('td:last-child');
+                            const newActions = newRow.querySelector('td:last-child');
+                            if (oldActions && newActions) {
+                                oldActions.innerHTML = newActions.innerHTML;
+                            }
+                        }
+                    });
+                }
+            })
+            .catch(err => console.warn('Status refresh failed:', err));
+    } else if (isVMDetail) {
+        fetch(window.location.href)
+            .then(response => response.text())
+            .then(html => {
+                const parser = new DOMParser();
+                const doc = parser.parseFromString(html, 'text/html');
+
+                // Update action buttons
+                const newActions = doc.querySelector('.action-buttons');
+                const currentActions = document.querySelector('.action-buttons');
+                if (newActions && currentActions) {
+                    currentActions.innerHTML = newActions.innerHTML;
+                }
+            })
+            .catch(err => console.warn('Status refresh failed:', err));
+    }
+}
+
+function takeSnapshot(vmName) {
+    // Auto-generate snapshot name: vmname-YYYYMMDD-HHMMSS
+    const now = new Date();
+    const timestamp = now.getFullYear() + 
+        String(now.getMonth() + 1).padStart(2, '0') + 
+        String(now.getDate()).padStart(2, '0') + '-' +
+        String(now.getHours()).padStart(2, '0') + 
+        String(now.getMinutes()).padStart(2, '0') + 
+        String(now.getSeconds()).padStart(2, '0');
+    const snapName = vmName + '-' + timestamp;
+
+    // Show loading indicator
+    const button = event.target;
+    const originalText = button.innerHTML;
+    button.innerHTML = '⏳ Creating...';
+    button.disabled = true;
+
+    const params = new URLSearchParams();
+    params.append('domain', vmName);
+    params.append('snap_name', snapName);
+
+    fetch('/api/snapshot/create', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/x-www-form-urlencoded'},
+        body: params.toString()
+    }).then(response => response.json()).then(data => {
+        button.innerHTML = originalText;
+        button.disabled = false;
+        if (data.status === 'success') {
+            // Show success message briefly
+            button.innerHTML = '✅ Done';
+            setTimeout(() => {
+                button.innerHTML = originalText;
+            }, 2000);
+        } else {
+            alert('Snapshot creation failed: ' + (data.message || 'Unknown error'));
+        }
+    }).catch(error => {
+        button.innerHTML = originalText;
+        button.disabled = false;
+        alert('Network error. Please try again.');
+    });
+}
+
+function vmAction(domain, action, needsConfirm = false) {
+    // Show loading indicator
+    const button = event.target;
+    const originalText = button.innerHTML;
+    button.innerHTML = '⏳ Working...';
+    button.disabled = true;
+
+    const params = new URLSearchParams();
+    params.append('domain', domain);
+    params.append('op', action);
+    if (needsConfirm) params.append('confirm', '1');
+
+    fetch('/?' + params.toString(), {
+        method: 'POST',
+        headers: {'Content-Type': 'application/x-www-form-urlencoded'},
+        body: ''
+    }).then(response => {
+        if (response.ok) {
+            // Success - restore button and trigger immediate status refresh
+            button.innerHTML = originalText;
+            button.disabled = false;
+
+            // Trigger immediate status update
+            refreshVMStatus();
+
+            // For shutdown/destroy actions, check more frequently for a few seconds
+            if (action === 'shutdown' || action === 'destroy') {
+                let checks = 0;
+                const quickRefresh = setInterval(() => {
+                    refreshVMStatus();
+                    checks++;
+                    if (checks >= 6) { // Check 6 times (3 seconds at 500ms intervals)
+                        clearInterval(quickRefresh);
+                    }
+                }, 500);
+            }
+        } else {
+            // Error - restore button and show message
+            button.innerHTML = originalText;
+            button.disabled = false;
+            alert('Action failed. Please try again.');
+        }
+    }).catch(error => {
+        // Network error - restore button
+        button.innerHTML = originalText;
+        button.disabled = false;
+        alert('Network error. Please try again.');
+    });
+}
+
+// Auto-refresh performance data every 5 seconds
+setInterval(function() {
+    fetch('/api/host-stats')
+        .then(response => response.json())
+        .then(data => {
+            // Update CPU
+            document.querySelector('.stats-grid .stat-card:nth-child(1) .stat-value').textContent = data.cpu_pct.toFixed(1) + '%';
+            // Update Memory
+            document.querySelector('.stats-grid .stat-card:nth-child(2) .stat-value').textContent = data.mem_used_h + ' / ' + data.mem_total_h;
+            document.querySelector('.stats-grid .stat-card:nth-child(2) .stat-label').textContent = 'Memory (' + data.mem_pct.toFixed(1) + '%)';
+
+            // Update Filesystem I/O
+            if (data.phys_rd_kbps !== undefined && data.phys_wr_kbps !== undefined) {
+
+                // Format with unit conversion (KB/s to B/s, MB/s, or GB/s without decimals)
+                function formatRate(kbps) {
+                    const bytesPerSec = kbps * 1024;
+                    if (bytesPerSec >= 1024 * 1024 * 1024) {
+                        return Math.floor(bytesPerSec / (1024 * 1024 * 1024)) + 'GB/s';
+                    } else if (bytesPerSec >= 1024 * 1024) {
+                        return Math.floor(bytesPerSec / (1024 * 1024)) + 'MB/s';
+                    } else if (bytesPerSec >= 1024) {
+                        return Math.floor(bytesPerSec / 1024) + 'KB/s';
+                    } else {
+                        return Math.floor(bytesPerSec) + 'B/s';
+                    }
+                }
+
+                // Update Filesystem I/O (3rd card)
+                const fsReadDisplay = formatRate(data.phys_rd_kbps);
+                const fsWriteDisplay = formatRate(data.phys_wr_kbps);
+                const fsIo = 'Read: ' + fsReadDisplay + '<br>Write: ' + fsWriteDisplay;
+                document.querySelector('.stats-grid .stat-card:nth-child(3) .stat-value').innerHTML = fsIo;
+            }
+            // Only skip update if data is undefined (no data available)
+        })
+        .catch(error => console.log('Stats update failed:', error));
+}, 1000);
+"""
+DASHBOARD_JS_BYTES = DASHBOARD_JS.encode()
+DASHBOARD_JS_GZ = gzip.compress(DASHBOARD_JS_BYTES, 9)
+DASHBOARD_JS_VERSION = '%08x' % zlib.crc32(DASHBOARD_JS_BYTES)
+DASHBOARD_JS_ETAG = f'"{DASHBOARD_JS_VERSION}"'
+DASHBOARD_JS_TAG = f"<script src='/static/dashboard.js?v={DASHBOARD_JS_VERSION}' defer></script>"
+
+# JavaScript KeyboardEvent.key -> virsh send-key name. Shifted characters map to their
+# base key; the shift handling happens at the endpoint level.
+VIRSH_KEY_MAP = {
+    'Enter': 'KEY_ENTER',
+    'Backspace': 'KEY_BACKSPACE',
+    'Tab': 'KEY_TAB',
+    'Escape': 'KEY_ESC',
+    'Space': 'KEY_SPACE',
+    ' ': 'KEY_SPACE',
+    'ArrowUp': 'KEY_UP',
+    'ArrowDown': 'KEY_DOWN',
+    'ArrowLeft': 'KEY_LEFT',
+    'ArrowRight': 'KEY_RIGHT',
+    'Delete': 'KEY_DELETE',
+    'Home': 'KEY_HOME',
+    'End': 'KEY_END',
+    'PageUp': 'KEY_PAGEUP',
+    'PageDown': 'KEY_PAGEDOWN',
+    'Insert': 'KEY_INSERT',
+    **{f'F{n}': f'KEY_F{n}' for n in range(1, 13)},
+    'Shift': 'KEY_LEFTSHIFT', 'Control': 'KEY_LEFTCTRL', 'Alt': 'KEY_LEFTALT',
+    'Meta': 'KEY_LEFTMETA', 'CapsLock': 'KEY_CAPSLOCK',
+    # Letters always use the base key; digits map to themselves
+    **{c: f'KEY_{c.upper()}' for c in string.ascii_letters},
+    **{c: f'KEY_{c}' for c in string.digits},
+    # Shifted number row
+    '!': 'KEY_1', '@': 'KEY_2', '#': 'KEY_3', '$': 'KEY_4', '%': 'KEY_5',
+    '^': 'KEY_6', '&': 'KEY_7', '*': 'KEY_8', '(': 'KEY_9', ')': 'KEY_0',
+    # Base punctuation
+    '-': 'KEY_MINUS', '_': 'KEY_MINUS',
+    '=': 'KEY_EQUAL', '+': 'KEY_EQUAL',
+    '[': 'KEY_LEFTBRACE', '{': 'KEY_LEFTBRACE',
+    ']': 'KEY_RIGHTBRACE', '}': 'KEY_RIGHTBRACE',
+    '\\': 'KEY_BACKSLASH', '|': 'KEY_BACKSLASH',
+    ';': 'KEY_SEMICOLON', ':': 'KEY_SEMICOLON',
+    "'": 'KEY_APOSTROPHE', '"': 'KEY_APOSTROPHE',
+    '`': 'KEY_GRAVE', '~': 'KEY_GRAVE',
+    ',': 'KEY_COMMA', '<': 'KEY_COMMA',
+    '.': 'KEY_DOT', '>': 'KEY_DOT',
+    '/': 'KEY_SLASH', '?': 'KEY_SLASH',
+}
+
+# send-key names -> Linux input event codes (<linux/input-event-codes.h>) for virDomainSendKey
+LINUX_KEYCODES = {
+    'KEY_ESC': 1, **{f'KEY_{c}': 2 + i for i, c in enumerate('1234567890')},
+    'KEY_MINUS': 12, 'KEY_EQUAL': 13, 'KEY_BACKSPACE': 14, 'KEY_TAB': 15,
+    **{f'KEY_{c}': 16 + i for i, c in enumerate('QWERTYUIOP')},
+    'KEY_LEFTBRACE': 26, 'KEY_RIGHTBRACE': 27, 'KEY_ENTER': 28, 'KEY_LEFTCTRL': 29,
+    **{f'KEY_{c}': 30 + i for i, c in enumerate('ASDFGHJKL')},
+    'KEY_SEMICOLON': 39, 'KEY_APOSTROPHE': 40, 'KEY_GRAVE': 41, 'KEY_LEFTSHIFT': 42, 'KEY_BACKSLASH': 43,
+    **{f'KEY_{c}': 44 + i for i, c in enumerate('ZXCVBNM')},
+    'KEY_COMMA': 51, 'KEY_DOT': 52, 'KEY_SLASH': 53, 'KEY_LEFTALT': 56, 'KEY_SPACE': 57, 'KEY_CAPSLOCK': 58,
+    **{f'KEY_F{n}': 58 + n for n in range(1, 11)}, 'KEY_F11': 87, 'KEY_F12': 88,
+    'KEY_HOME': 102, 'KEY_UP': 103, 'KEY_PAGEUP': 104, 'KEY_LEFT': 105, 'KEY_RIGHT': 106,
+    'KEY_END': 107, 'KEY_DOWN': 108, 'KEY_PAGEDOWN': 109, 'KEY_INSERT': 110, 'KEY_DELETE': 111,
+    'KEY_LEFTMETA': 125,
+}
+
 class Handler(BaseHTTPRequestHandler):
     server_version='Enhanced-VMManager/2.0'
+    # Handlers are created per request, so migration jobs live on the class to be visible across requests
+    migration_jobs: Dict[str, dict] = {}
+    
+    def add_migration_job(self, job_id: str, job: dict):
+        """Register a migration job, dropping finished jobs past MIGRATION_JOB_TTL and, beyond
+        MIGRATION_JOBS_MAX, the longest-finished ones; running jobs are never dropped"""
+        jobs = self.migration_jobs
+        now = time.monotonic()
+        finished = []
+        for jid, info in list(jobs.items()):
+            done = info.get('finished_at')
+            if done is None:
+                continue
+            if now - done > MIGRATION_JOB_TTL:
+                jobs.pop(jid, None)
+            else:
+                finished.append((done, jid))
+        excess = len(jobs) - MIGRATION_JOBS_MAX + 1
+        if excess > 0:
+            for _, jid in sorted(finished)[:excess]:
+                jobs.pop(jid, None)
+        jobs[job_id] = job
     
     def list_iso_images(self, pool):
         """List all ISO images in the given storage pool."""
         try:
-            import xml.etree.ElementTree as ET
             pool_xml = pool.XMLDesc()
             pool_root = ET.fromstring(pool_xml)
             pool_path = pool_root.findtext('.//target/path')
@@ -1351,19 +2122,63 @@ class Handler(BaseHTTPRequestHandler):
             pass
     
     def _send(self, body, status=200, ctype='text/html; charset=utf-8', headers=None):
-        data=body if isinstance(body,(bytes,bytearray)) else body.encode();
-        self.send_response(status)
-        self.send_header('Content-Type',ctype)
-        self.send_header('Content-Length',str(len(data)))
+        data=body if isinstance(body,(bytes,bytearray,memoryview)) else body.encode();
+        # Build the status line and headers here so they go out with the body in a single write/sendall
+        self.log_request(status)
+        reason = self.responses[status][0] if status in self.responses else ''
+        lines = [f"{self.protocol_version} {status} {reason}",
+                 f"Server: {self.version_string()}", f"Date: {self.date_time_string()}",
+                 f"Content-Type: {ctype}", f"Content-Length: {len(data)}"]
         if headers:
             for k, v in headers.items():
-                self.send_header(k, v)
-        self.end_headers()
-        self.wfile.write(data)
+                lines.append(f"{k}: {v}")
+                if k.lower() == 'connection' and v.lower() == 'close':
+                    self.close_connection = True
+        self.wfile.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1', 'strict') + data)
     
     def wrap(self,title,body,theme='dark'):
         return PAGE_TEMPLATE.format(title=html.escape(title), body=body, css=CSS, js=JS, 
                                    hostname=html.escape(socket.gethostname()), theme=theme)
+    
+    def wrap_stream(self, title, chunks, theme='dark'):
+        """Like wrap(), but yields the page head, each body fragment, then the tail"""
+        head, tail = self.wrap(title, '\0', theme).split('\0', 1)
+        yield head
+        yield from chunks
+        yield tail
+    
+    def _send_stream(self, chunks, status=200, ctype='text/html; charset=utf-8', headers=None):
+        """Send a response body as it is generated instead of building it in memory first.
+        Uses chunked transfer encoding on HTTP/1.1 connections; on HTTP/1.0 the body is
+        delimited by closing the connection."""
+        chunked = self.protocol_version >= 'HTTP/1.1' and self.request_version >= 'HTTP/1.1'
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+        if headers:
+            for k, v in headers.items():
+                self.send_header(k, v)
+        self.end_headers()
+        write = self.wfile.write
+        try:
+            for chunk in chunks:
+                data = chunk if isinstance(chunk, (bytes, bytearray)) else chunk.encode()
+                if not data:
+                    continue
+                if chunked:
+                    write(b'%x\r\n%s\r\n' % (len(data), data))
+                else:
+                    write(data)
+        except Exception:
+            # The status line is already out; drop the connection without the final chunk so the
+            # client sees a truncated response rather than a complete-looking partial page
+            self.close_connection = True
+            raise
+        if chunked:
+            write(b'0\r\n\r\n')
     def page_novnc(self, domain_name:str):
         """Standalone full-page noVNC console; isolated (doesn't reuse preview JS)."""
         safe = html.escape(domain_name) if domain_name else ''
@@ -1928,7 +2743,6 @@ class Handler(BaseHTTPRequestHandler):
                 raise RuntimeError('Domain not running')
 
             xml = d.XMLDesc(0)
-            import xml.etree.ElementTree as ET
             root = ET.fromstring(xml)
             graphics = root.find('.//devices/graphics[@type="vnc"]')
             
@@ -2054,7 +2868,6 @@ class Handler(BaseHTTPRequestHandler):
                 raise RuntimeError('Domain not running')
 
             xml = d.XMLDesc(0)
-            import xml.etree.ElementTree as ET
             root = ET.fromstring(xml)
             graphics = root.find('.//devices/graphics[@type="vnc"]')
             
@@ -2167,9 +2980,6 @@ class Handler(BaseHTTPRequestHandler):
         content_type = self.headers.get('Content-Type', '')
         if 'multipart/form-data' in content_type:
             # Parse multipart form data using email.message (Python 3.13 compatible)
-            from email import message_from_bytes
-            from email.policy import default
-            
             # Extract boundary from content-type
             boundary = None
             for param in content_type.split(';'):
@@ -2180,7 +2990,7 @@ class Handler(BaseHTTPRequestHandler):
             if boundary:
                 # Construct a proper MIME message
                 mime_data = b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + raw
-                msg = message_from_bytes(mime_data, policy=default)
+                msg = message_from_bytes(mime_data, policy=email_policy)
                 
                 form = {}
                 for part in msg.iter_parts():
@@ -2222,6 +3032,8 @@ class Handler(BaseHTTPRequestHandler):
         self.route(form)
     def route(self, form:Optional[Dict[str,List[str]]]=None):
         parsed=urllib.parse.urlparse(self.path); qs=urllib.parse.parse_qs(parsed.query); path=parsed.path
+        if form is not None:
+            DASHBOARD_CACHE[1] = None
 
         # Host power controls - handle with extreme care
         if path == '/api/host/shutdown' and form is not None:
@@ -2254,7 +3066,6 @@ class Handler(BaseHTTPRequestHandler):
                     self._send(b'Forbidden', 403, 'text/plain'); return
                 
                 if os.path.isfile(safe_path):
-                    import mimetypes
                     ctype, _ = mimetypes.guess_type(safe_path)
                     if ctype is None: ctype = 'application/octet-stream'
                     with open(safe_path, 'rb') as f:
@@ -2265,6 +3076,14 @@ class Handler(BaseHTTPRequestHandler):
                 logger.error(f"Failed to serve static file {path}: {e}", exc_info=True)
                 self._send(b'Error', 500, 'text/plain')
             return
+        if path == '/static/dashboard.js':
+            headers = {'ETag': DASHBOARD_JS_ETAG, 'Cache-Control': 'private, max-age=31536000, immutable', 'Vary': 'Accept-Encoding'}
+            if self.headers.get('If-None-Match') == DASHBOARD_JS_ETAG:
+                self._send(b'', 304, 'application/javascript', headers); return
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                headers['Content-Encoding'] = 'gzip'
+                self._send(DASHBOARD_JS_GZ, 200, 'application/javascript', headers); return
+            self._send(DASHBOARD_JS_BYTES, 200, 'application/javascript', headers); return
         if libvirt is None:
             self._send(self.wrap('Error',"<div class='card'><p>libvirt module missing.</p></div>")); return
         lv=LV()
@@ -2300,7 +3119,6 @@ class Handler(BaseHTTPRequestHandler):
                 
                 # Get VNC port from domain XML
                 xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                import xml.etree.ElementTree as ET
                 root = ET.fromstring(xml)
                 graphics = root.find('.//devices/graphics[@type="vnc"]')
                 
@@ -2358,7 +3176,7 @@ class Handler(BaseHTTPRequestHandler):
         if path=='/wipe_disk' and form:
             device = form.get('device', [''])[0]
             if not device:
-                self._send(json.dumps({'success': False, 'error': 'No device specified'}), 400, 'application/json'); return
+                self._send(json_error('No device specified'), 400, 'application/json'); return
             try:
                 # Basic safety checks
                 if not device.startswith('/dev/'):
@@ -2375,13 +3193,13 @@ class Handler(BaseHTTPRequestHandler):
                 # Run wipefs
                 subprocess.run(['sudo', 'wipefs', '-a', device], check=True, timeout=30)
                 logger.info(f"Wiped device {device}")
-                self._send(json.dumps({'success': True}), 200, 'application/json')
+                self._send(JSON_OK, 200, 'application/json')
             except subprocess.TimeoutExpired:
-                self._send(json.dumps({'success': False, 'error': 'Wipe operation timed out'}), 500, 'application/json')
+                self._send(json_error('Wipe operation timed out'), 500, 'application/json')
             except subprocess.CalledProcessError as e:
-                self._send(json.dumps({'success': False, 'error': f'wipefs failed: {e}'}), 500, 'application/json')
+                self._send(json_error(f'wipefs failed: {e}'), 500, 'application/json')
             except Exception as e:
-                self._send(json.dumps({'success': False, 'error': str(e)}), 500, 'application/json')
+                self._send(json_error(str(e)), 500, 'application/json')
             return
         
         # Delete array endpoint
@@ -2389,7 +3207,7 @@ class Handler(BaseHTTPRequestHandler):
             array_type = form.get('type', [''])[0]
             array_name = form.get('name', [''])[0]
             if not array_type or not array_name:
-                self._send(json.dumps({'success': False, 'error': 'Missing type or name'}), 400, 'application/json'); return
+                self._send(json_error('Missing type or name'), 400, 'application/json'); return
             try:
                 if array_type == 'mdadm':
                     # Unmount if mounted
@@ -2404,12 +3222,7 @@ class Handler(BaseHTTPRequestHandler):
                                 subprocess.run(['sudo','umount', mount_point], check=True, timeout=30)
                                 # Remove from fstab
                                 try:
-                                    with open('/etc/fstab', 'r') as f:
-                                        lines = f.readlines()
-                                    with open('/etc/fstab', 'w') as f:
-                                        for line in lines:
-                                            if mount_point not in line:
-                                                f.write(line)
+                                    fstab_remove(mount_point)
                                 except Exception:
                                     pass
                     except subprocess.CalledProcessError:
@@ -2427,31 +3240,26 @@ class Handler(BaseHTTPRequestHandler):
                         pass
                     
                     logger.info(f"Deleted mdadm array {array_name}")
-                    self._send(json.dumps({'success': True}), 200, 'application/json')
+                    self._send(JSON_OK, 200, 'application/json')
                 elif array_type == 'btrfs':
                     # For BTRFS, we need to unmount and remove from fstab
                     # BTRFS arrays are identified by their mount points
                     try:
                         subprocess.run(['sudo','umount', array_name], check=True, timeout=30)
                         # Remove from fstab
-                        with open('/etc/fstab', 'r') as f:
-                            lines = f.readlines()
-                        with open('/etc/fstab', 'w') as f:
-                            for line in lines:
-                                if array_name not in line:
-                                    f.write(line)
+                        fstab_remove(array_name)
                     except Exception as e:
                         pass
                     logger.info(f"Unmounted BTRFS array at {array_name}")
-                    self._send(json.dumps({'success': True}), 200, 'application/json')
+                    self._send(JSON_OK, 200, 'application/json')
                 else:
-                    self._send(json.dumps({'success': False, 'error': 'Unknown array type'}), 400, 'application/json')
+                    self._send(json_error('Unknown array type'), 400, 'application/json')
             except subprocess.TimeoutExpired:
-                self._send(json.dumps({'success': False, 'error': 'Delete operation timed out'}), 500, 'application/json')
+                self._send(json_error('Delete operation timed out'), 500, 'application/json')
             except subprocess.CalledProcessError as e:
-                self._send(json.dumps({'success': False, 'error': f'Delete failed: {e}'}), 500, 'application/json')
+                self._send(json_error(f'Delete failed: {e}'), 500, 'application/json')
             except Exception as e:
-                self._send(json.dumps({'success': False, 'error': str(e)}), 500, 'application/json')
+                self._send(json_error(str(e)), 500, 'application/json')
             return
             
         # Remove array endpoint (wipefs and remove from UI)
@@ -2459,7 +3267,7 @@ class Handler(BaseHTTPRequestHandler):
             array_type = form.get('type', [''])[0]
             array_name = form.get('name', [''])[0]
             if not array_type or not array_name:
-                self._send(json.dumps({'success': False, 'error': 'Missing type or name'}), 400, 'application/json'); return
+                self._send(json_error('Missing type or name'), 400, 'application/json'); return
             try:
                 # First get the device list for this filesystem
                 devices = []
@@ -2520,15 +3328,15 @@ class Handler(BaseHTTPRequestHandler):
                 if wipefs_errors:
                     error_msg = "Some devices could not be wiped: " + ", ".join(wipefs_errors)
                     logger.warning(error_msg)
-                    self._send(json.dumps({'success': False, 'error': error_msg}), 500, 'application/json')
+                    self._send(json_error(error_msg), 500, 'application/json')
                 else:
                     logger.info(f"Successfully removed {array_type} array {array_name} and wiped {len(devices)} devices")
-                    self._send(json.dumps({'success': True}), 200, 'application/json')
+                    self._send(JSON_OK, 200, 'application/json')
                     
             except subprocess.TimeoutExpired:
-                self._send(json.dumps({'success': False, 'error': 'Remove operation timed out'}), 500, 'application/json')
+                self._send(json_error('Remove operation timed out'), 500, 'application/json')
             except Exception as e:
-                self._send(json.dumps({'success': False, 'error': str(e)}), 500, 'application/json')
+                self._send(json_error(str(e)), 500, 'application/json')
             return
         
         # Unmount array endpoint
@@ -2537,7 +3345,7 @@ class Handler(BaseHTTPRequestHandler):
             array_name = form.get('name', [''])[0]
             mount_point = form.get('mount_point', [''])[0]
             if not array_type or not array_name:
-                self._send(json.dumps({'success': False, 'error': 'Missing type or name'}), 400, 'application/json'); return
+                self._send(json_error('Missing type or name'), 400, 'application/json'); return
             try:
                 if array_type == 'mdadm':
                     # Unmount mdadm array
@@ -2546,40 +3354,30 @@ class Handler(BaseHTTPRequestHandler):
                         subprocess.run(['sudo','umount', mount_point], check=True, timeout=30)
                         # Remove from fstab
                         try:
-                            with open('/etc/fstab', 'r') as f:
-                                lines = f.readlines()
-                            with open('/etc/fstab', 'w') as f:
-                                for line in lines:
-                                    if mount_point not in line and array_name not in line:
-                                        f.write(line)
+                            fstab_remove(mount_point, array_name)
                         except Exception:
                             pass
                     logger.info(f"Unmounted mdadm array {array_name}")
-                    self._send(json.dumps({'success': True}), 200, 'application/json')
+                    self._send(JSON_OK, 200, 'application/json')
                 elif array_type == 'btrfs':
                     # Unmount BTRFS filesystem
                     if mount_point:
                         subprocess.run(['sudo','umount', mount_point], check=True, timeout=30)
                         # Remove from fstab
                         try:
-                            with open('/etc/fstab', 'r') as f:
-                                lines = f.readlines()
-                            with open('/etc/fstab', 'w') as f:
-                                for line in lines:
-                                    if mount_point not in line:
-                                        f.write(line)
+                            fstab_remove(mount_point)
                         except Exception:
                             pass
                     logger.info(f"Unmounted BTRFS filesystem {array_name}")
-                    self._send(json.dumps({'success': True}), 200, 'application/json')
+                    self._send(JSON_OK, 200, 'application/json')
                 else:
-                    self._send(json.dumps({'success': False, 'error': 'Unknown array type'}), 400, 'application/json')
+                    self._send(json_error('Unknown array type'), 400, 'application/json')
             except subprocess.TimeoutExpired:
-                self._send(json.dumps({'success': False, 'error': 'Unmount operation timed out'}), 500, 'application/json')
+                self._send(json_error('Unmount operation timed out'), 500, 'application/json')
             except subprocess.CalledProcessError as e:
-                self._send(json.dumps({'success': False, 'error': f'Unmount failed: {e}'}), 500, 'application/json')
+                self._send(json_error(f'Unmount failed: {e}'), 500, 'application/json')
             except Exception as e:
-                self._send(json.dumps({'success': False, 'error': str(e)}), 500, 'application/json')
+                self._send(json_error(str(e)), 500, 'application/json')
             return
         
         # Mount array endpoint
@@ -2588,27 +3386,24 @@ class Handler(BaseHTTPRequestHandler):
             array_name = form.get('name', [''])[0]
             mount_point = form.get('mount_point', [''])[0]
             if not array_type or not array_name or not mount_point:
-                self._send(json.dumps({'success': False, 'error': 'Missing type, name, or mount point'}), 400, 'application/json'); return
+                self._send(json_error('Missing type, name, or mount point'), 400, 'application/json'); return
             try:
-                # Create mount point directory
-                subprocess.check_call(['sudo', 'mkdir', '-p', mount_point])
-                
+                mp_q = shlex.quote(mount_point)
                 if array_type == 'mdadm':
-                    # Mount mdadm array
+                    # Create mount point directory and mount mdadm array in one sudo call
                     device_path = f'/dev/{array_name}'
-                    subprocess.run(['sudo','mount', device_path, mount_point], check=True, timeout=30)
+                    subprocess.run(['sudo', 'sh', '-c', f"mkdir -p {mp_q} && mount {shlex.quote(device_path)} {mp_q}"], check=True, timeout=30)
                     
                     # Add to fstab
                     try:
-                        uuid = subprocess.check_output(['sudo','blkid','-s','UUID','-o','value',device_path], text=True).strip()
-                        if uuid:
-                            with open('/etc/fstab','a') as f:
-                                f.write(f"UUID={uuid} {mount_point} xfs noatime,discard 0 0\n")
+                        fs_uuid = device_uuid(device_path)
+                        if fs_uuid:
+                            fstab_append(f"UUID={fs_uuid} {mount_point} xfs noatime,discard 0 0\n")
                     except Exception:
                         pass
                     
                     logger.info(f"Mounted mdadm array {array_name} at {mount_point}")
-                    self._send(json.dumps({'success': True}), 200, 'application/json')
+                    self._send(JSON_OK, 200, 'application/json')
                 elif array_type == 'btrfs':
                     # Mount BTRFS filesystem - find first device
                     # Get devices from btrfs filesystem show
@@ -2648,33 +3443,32 @@ class Handler(BaseHTTPRequestHandler):
                                         break
                             
                             if target_device:
-                                subprocess.run(['sudo','mount', '-o', 'noatime,ssd,discard,compress=zstd', target_device, mount_point], check=True, timeout=30)
+                                subprocess.run(['sudo', 'sh', '-c', f"mkdir -p {mp_q} && mount -o noatime,ssd,discard,compress=zstd {shlex.quote(target_device)} {mp_q}"], check=True, timeout=30)
                                 
                                 # Add to fstab
                                 try:
-                                    uuid = subprocess.check_output(['sudo','blkid','-s','UUID','-o','value',target_device], text=True).strip()
-                                    if uuid:
-                                        with open('/etc/fstab','a') as f:
-                                            f.write(f"UUID={uuid} {mount_point} btrfs noatime,ssd,discard,compress=zstd 0 0\n")
+                                    fs_uuid = device_uuid(target_device)
+                                    if fs_uuid:
+                                        fstab_append(f"UUID={fs_uuid} {mount_point} btrfs noatime,ssd,discard,compress=zstd 0 0\n")
                                 except Exception:
                                     pass
                                 
                                 logger.info(f"Mounted BTRFS filesystem {array_name} at {mount_point}")
-                                self._send(json.dumps({'success': True}), 200, 'application/json')
+                                self._send(JSON_OK, 200, 'application/json')
                             else:
-                                self._send(json.dumps({'success': False, 'error': 'Could not find device for BTRFS filesystem'}), 500, 'application/json')
+                                self._send(json_error('Could not find device for BTRFS filesystem'), 500, 'application/json')
                         else:
-                            self._send(json.dumps({'success': False, 'error': 'Failed to get BTRFS filesystem info'}), 500, 'application/json')
+                            self._send(json_error('Failed to get BTRFS filesystem info'), 500, 'application/json')
                     except Exception as e:
-                        self._send(json.dumps({'success': False, 'error': f'BTRFS mount failed: {e}'}), 500, 'application/json')
+                        self._send(json_error(f'BTRFS mount failed: {e}'), 500, 'application/json')
                 else:
-                    self._send(json.dumps({'success': False, 'error': 'Unknown array type'}), 400, 'application/json')
+                    self._send(json_error('Unknown array type'), 400, 'application/json')
             except subprocess.TimeoutExpired:
-                self._send(json.dumps({'success': False, 'error': 'Mount operation timed out'}), 500, 'application/json')
+                self._send(json_error('Mount operation timed out'), 500, 'application/json')
             except subprocess.CalledProcessError as e:
-                self._send(json.dumps({'success': False, 'error': f'Mount failed: {e}'}), 500, 'application/json')
+                self._send(json_error(f'Mount failed: {e}'), 500, 'application/json')
             except Exception as e:
-                self._send(json.dumps({'success': False, 'error': str(e)}), 500, 'application/json')
+                self._send(json_error(str(e)), 500, 'application/json')
             return
             
         # VM keyboard input endpoint
@@ -2690,82 +3484,29 @@ class Handler(BaseHTTPRequestHandler):
             
             if domain_name and key:
                 try:
-                    d = lv.get_domain(domain_name)
+                    d = get_domain_cached(lv, domain_name)
                     if d.isActive():
                         # Handle special key combinations
                         if key == 'ctrl_alt_del':
                             # Send Ctrl+Alt+Del sequence
                             domain_name = d.name()
-                            try:
-                                # Use virsh send-key for Ctrl+Alt+Del
-                                cmd = ['virsh', 'send-key', domain_name, 'KEY_LEFTCTRL', 'KEY_LEFTALT', 'KEY_DELETE']
-                                result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-                                if result.returncode == 0:
-                                    logger.info(f"Ctrl+Alt+Del sent to {domain_name}")
-                                    self._send(json.dumps({'success': True}), 200, 'application/json')
-                                    return
-                                else:
-                                    logger.warning(f"Ctrl+Alt+Del failed: {result.stderr}")
-                            except Exception as e:
-                                logger.error(f"Ctrl+Alt+Del error: {e}")
+                            if self.send_qmp_key(d, 'KEY_DELETE', 'KEY_LEFTCTRL', 'KEY_LEFTALT'):
+                                logger.info(f"Ctrl+Alt+Del sent to {domain_name}")
+                                self._send(JSON_OK, 200, 'application/json')
+                                return
                             
-                            self._send(json.dumps({'success': False, 'error': 'Failed to send Ctrl+Alt+Del'}), 500, 'application/json')
+                            self._send(json_error('Failed to send Ctrl+Alt+Del'), 500, 'application/json')
                             return
-                        # Handle key combinations properly using virsh send-key
+                        # Handle key combinations; modifiers are pressed together with the key
                         success = False
                         qmp_key = self.convert_key_to_qmp(key, key_code)
                         
                         if qmp_key:
                             domain_name = d.name()
                             
-                            # For SHIFT combinations, send multiple keys to virsh send-key
+                            # For SHIFT combinations, hold LEFTSHIFT while the key is pressed
                             if shift_key and key != 'Shift':
-                                # Build key sequence for virsh send-key
-                                # virsh send-key can take multiple keys: virsh send-key domain KEY_LEFTSHIFT KEY_A
-                                base_key = qmp_key.replace('KEY_', '').lower()
-                                
-                                # Try the proper virsh syntax for key combinations
-                                key_sequence_formats = [
-                                    ['KEY_LEFTSHIFT', qmp_key],  # Format 1: KEY_LEFTSHIFT KEY_A
-                                    ['shift', base_key],         # Format 2: shift a  
-                                    ['KEY_LEFTSHIFT', base_key], # Format 3: KEY_LEFTSHIFT a
-                                    ['shift', qmp_key],          # Format 4: shift KEY_A
-                                ]
-                                
-                                for key_seq in key_sequence_formats:
-                                    cmd = ['virsh', 'send-key', domain_name] + key_seq
-                                    logger.info(f"Trying SHIFT combination: {' '.join(cmd)}")
-                                    
-                                    try:
-                                        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-                                        if result.returncode == 0:
-                                            success = True
-                                            logger.info(f"SHIFT+{key} sent successfully with format: {key_seq}")
-                                            break
-                                        else:
-                                            logger.warning(f"SHIFT format failed: {result.stderr.strip()}")
-                                    except Exception as e:
-                                        logger.warning(f"SHIFT format error: {e}")
-                                
-                                # If all combination attempts failed, try sending keys separately
-                                if not success:
-                                    logger.info("Trying separate SHIFT key sequence")
-                                    try:
-                                        # Send SHIFT press, key press, SHIFT release sequence
-                                        cmd1 = ['virsh', 'send-key', domain_name, 'KEY_LEFTSHIFT', '--holdtime', '50']
-                                        cmd2 = ['virsh', 'send-key', domain_name, base_key]
-                                        
-                                        result1 = subprocess.run(cmd1, capture_output=True, text=True, timeout=10)
-                                        result2 = subprocess.run(cmd2, capture_output=True, text=True, timeout=10)
-                                        
-                                        if result1.returncode == 0 and result2.returncode == 0:
-                                            success = True
-                                            logger.info(f"SHIFT+{key} sent with separate sequence")
-                                        else:
-                                            logger.error(f"Separate SHIFT sequence failed: {result1.stderr} / {result2.stderr}")
-                                    except Exception as e:
-                                        logger.error(f"Separate SHIFT sequence error: {e}")
-                            
+                                success = self.send_qmp_key(d, qmp_key, 'KEY_LEFTSHIFT')
                             else:
                                 # Regular key without modifiers
                                 if is_keyup:
@@ -2775,19 +3516,20 @@ class Handler(BaseHTTPRequestHandler):
                         
                         if qmp_key and success:
                             logger.info(f"VM {domain_name} key {'released' if is_keyup else 'sent'}: {key} (shift:{shift_key} ctrl:{ctrl_key} alt:{alt_key})")
-                            self._send(json.dumps({'success': True}), 200, 'application/json')
+                            self._send(JSON_OK, 200, 'application/json')
                         elif qmp_key:
-                            self._send(json.dumps({'success': False, 'error': 'Failed to send key'}), 500, 'application/json')
+                            self._send(json_error('Failed to send key'), 500, 'application/json')
                         else:
                             logger.info(f"VM {domain_name} key ignored: {key}")
-                            self._send(json.dumps({'success': True}), 200, 'application/json')
+                            self._send(JSON_OK, 200, 'application/json')
                     else:
-                        self._send(json.dumps({'success': False, 'error': 'VM not running'}), 400, 'application/json')
+                        self._send(json_error('VM not running'), 400, 'application/json')
                 except Exception as e:
+                    DOMAIN_CACHE.pop(domain_name, None)
                     logger.error(f"VM key error: {e}")
-                    self._send(json.dumps({'success': False, 'error': str(e)}), 500, 'application/json')
+                    self._send(json_error(str(e)), 500, 'application/json')
             else:
-                self._send(json.dumps({'success': False, 'error': 'Missing domain or key'}), 400, 'application/json')
+                self._send(json_error('Missing domain or key'), 400, 'application/json')
             return
             
         # VM mouse input endpoint
@@ -2798,33 +3540,28 @@ class Handler(BaseHTTPRequestHandler):
             button = form.get('button', ['1'])[0]
             if domain_name and x and y:
                 try:
-                    d = lv.get_domain(domain_name)
+                    d = get_domain_cached(lv, domain_name)
                     if d.isActive():
                         # Send mouse event via QMP
                         success = self.send_qmp_mouse(d, int(x), int(y), int(button))
                         if success:
                             logger.info(f"VM {domain_name} mouse click: {x},{y} button {button}")
-                            self._send(json.dumps({'success': True}), 200, 'application/json')
+                            self._send(JSON_OK, 200, 'application/json')
                         else:
-                            self._send(json.dumps({'success': False, 'error': 'Failed to send mouse event'}), 500, 'application/json')
+                            self._send(json_error('Failed to send mouse event'), 500, 'application/json')
                     else:
-                        self._send(json.dumps({'success': False, 'error': 'VM not running'}), 400, 'application/json')
+                        self._send(json_error('VM not running'), 400, 'application/json')
                 except Exception as e:
+                    DOMAIN_CACHE.pop(domain_name, None)
                     logger.error(f"VM mouse error: {e}")
-                    self._send(json.dumps({'success': False, 'error': str(e)}), 500, 'application/json')
+                    self._send(json_error(str(e)), 500, 'application/json')
             else:
-                self._send(json.dumps({'success': False, 'error': 'Missing domain or coordinates'}), 400, 'application/json')
+                self._send(json_error('Missing domain or coordinates'), 400, 'application/json')
             return
             
         # Logout endpoint
         if path=='/logout':
-            session_cookie = None
-            if 'Cookie' in self.headers:
-                cookies = self.headers['Cookie']
-                for cookie in cookies.split(';'):
-                    if cookie.strip().startswith('vm_session='):
-                        session_cookie = cookie.split('=', 1)[1].strip()
-                        break
+            session_cookie = get_session_cookie(self)
             if session_cookie and session_cookie in SESSIONS:
                 del SESSIONS[session_cookie]
             headers = {'Set-Cookie': 'vm_session=; Path=/; HttpOnly; Expires=Thu, 01 Jan 1970 00:00:00 GMT'}
@@ -2850,10 +3587,7 @@ class Handler(BaseHTTPRequestHandler):
                     machine=form.get('machine',['pc'])[0]
                     boot_order=form.get('boot_order',['hd,cdrom,network'])[0]
                     if not name: raise RuntimeError('Missing name')
-                    pool=lv.get_pool(pool_name)
-                    import xml.etree.ElementTree as ET
-                    proot=ET.fromstring(pool.XMLDesc(0))
-                    pool_path=proot.findtext('.//target/path') or '/var/lib/libvirt/images'
+                    pool_path=get_pool_path(lv, pool_name) or '/var/lib/libvirt/images'
                     vm_dir=os.path.join(pool_path, name)
                     os.makedirs(vm_dir, exist_ok=True)
                     # Gather disk spec arrays
@@ -2864,6 +3598,8 @@ class Handler(BaseHTTPRequestHandler):
                     targets=form.get('disk_target',[])
                     disks=[]  # (path,bus,target)
                     used_targets=set()
+                    image_copies=[]  # (src,dest) reflinked in one sudo batch after the loop
+                    new_disk_cmds=[]  # qemu-img create commands, also batched under one sudo
                     def next_target(bus:str)->str:
                         base={'virtio':'vd','scsi':'sd','sata':'hd'}.get(bus,'vd')
                         for c in 'abcdefghijklmnopqrstuvwxyz':
@@ -2888,24 +3624,14 @@ class Handler(BaseHTTPRequestHandler):
                                 raise RuntimeError(f'Imported image {image} not found')
                             dest=os.path.join(vm_dir, f"img{i+1}-"+image)
                             if not os.path.exists(dest): 
-                                # Use reflinks for efficient copying on supported filesystems
-                                try:
-                                    subprocess.check_call(['sudo', 'cp', '--reflink=always', src_path, dest])
-                                    logger.info(f"Used reflink copy for {image}")
-                                except subprocess.CalledProcessError:
-                                    # Fallback to regular copy if reflinks not supported
-                                    logger.info(f"Reflink not supported, using regular copy for {image}")
-                                    shutil.copy2(src_path, dest)
+                                image_copies.append((src_path, dest))
                             disk_path=dest
                         else:
                             disk_name=f"disk{i+1}.qcow2"
                             disk_path=os.path.join(vm_dir,disk_name)
-                            subprocess.check_call(['sudo', 'qemu-img','create','-f','qcow2',disk_path,f'{size_gb}G'])
+                            new_disk_cmds.append(f"qemu-img create -f qcow2 -o preallocation=off {shlex.quote(disk_path)} {size_gb}G")
                         # Validate / normalize target; auto-fix duplicates or invalid entries
-                        base_prefix={'virtio':'vd','scsi':'sd','sata':'hd'}.get(bus,'vd')
-                        def valid_format(t):
-                            return t.startswith(base_prefix) and len(t)==3 and t[2].isalpha()
-                        if not valid_format(tgt):
+                        if not DISK_TARGET_RE.get(bus, DISK_TARGET_RE['virtio']).match(tgt):
                             tgt=''
                         # If empty or duplicate, pick next available automatically
                         if not tgt or tgt in used_targets:
@@ -2919,6 +3645,20 @@ class Handler(BaseHTTPRequestHandler):
                         disks.append((disk_path,bus,tgt))
                     if not disks:
                         raise RuntimeError('At least one disk required')
+                    # One sudo round-trip for all image copies and one for all new disks
+                    if image_copies:
+                        # Use reflinks for efficient copying on supported filesystems
+                        try:
+                            subprocess.check_call(['sudo', 'sh', '-c', ' && '.join(
+                                f"cp --reflink=always {shlex.quote(src)} {shlex.quote(dst)}" for src, dst in image_copies)])
+                            logger.info(f"Used reflink copy for {len(image_copies)} image(s)")
+                        except subprocess.CalledProcessError:
+                            # Fallback to regular copy if reflinks not supported
+                            logger.info("Reflink not supported, using regular copy for imported images")
+                            for src, dst in image_copies:
+                                fast_copy(src, dst)
+                    if new_disk_cmds:
+                        subprocess.check_call(['sudo', 'sh', '-c', ' && '.join(new_disk_cmds)])
                     # Auto-detect OVMF firmware paths for cross-distro compatibility
                     ovmf_code_path = None
                     if firmware == 'uefi':
@@ -2974,8 +3714,8 @@ class Handler(BaseHTTPRequestHandler):
             if 'images' in qs: self._send(self.wrap('Images', self.page_images(lv, form, qs))); return
             if 'hardware' in qs: self._send(self.wrap('Hardware', self.page_hardware(lv))); return
             if 'storage' in qs: self._send(self.wrap('Storage', self.page_storage(lv, form))); return
-            if 'networks' in qs: self._send(self.wrap('Networks', self.page_networks(lv, form))); return
-            if 'backups' in qs: self._send(self.wrap('Backups', self.page_backups(lv, form))); return
+            if 'networks' in qs: self._send_stream(self.wrap_stream('Networks', self.page_networks(lv, form))); return
+            if 'backups' in qs: self._send_stream(self.wrap_stream('Backups', self.page_backups(lv, form))); return
             if 'domain' in qs: 
                 name=qs['domain'][0]
                 # Add no-cache headers to prevent VM page caching issues
@@ -2995,7 +3735,7 @@ class Handler(BaseHTTPRequestHandler):
                     if domain_name and snap_name:
                         # Simple virsh command execution
                         cmd = ['virsh', 'snapshot-create-as', domain_name, snap_name, '--disk-only', '--atomic']
-                        result = subprocess.run(cmd, capture_output=True, text=True)
+                        result = subprocess.run(cmd, capture_output=True, text=True, timeout=VIRSH_TIMEOUT, close_fds=False)
                         
                         if result.returncode == 0:
                             logger.info(f"Snapshot {snap_name} created successfully for {domain_name}")
@@ -3013,156 +3753,179 @@ class Handler(BaseHTTPRequestHandler):
                 except Exception as e:
                     logger.error(f"Snapshot creation error: {e}")
             
-            self._send(self.wrap('Dashboard', self.page_dashboard(lv))); return
+            self._send_stream(self.wrap_stream('Dashboard', self.page_dashboard_stream(lv))); return
     def handle_api(self, path: str, qs: dict, form: dict, lv: LV):
         """Handle REST API endpoints"""
         try:
-            if path == '/api/vms':
-                vms = []
-                for d in lv.list_domains():
-                    state, _ = d.state()
-                    vms.append({
-                        'name': d.name(),
-                        'state': 'running' if state == libvirt.VIR_DOMAIN_RUNNING else 'shutoff',
-                        'id': d.ID() if state == libvirt.VIR_DOMAIN_RUNNING else None
-                    })
-                self._send(json.dumps(vms), 200, 'application/json')
-            elif path.startswith('/api/vm/'):
-                vm_name = path.split('/')[-1]
-                if not form:  # GET
-                    try:
-                        d = lv.get_domain(vm_name)
-                        state, _ = d.state()
-                        info = d.info()
-                        vm_data = {
-                            'name': d.name(),
-                            'state': 'running' if state == libvirt.VIR_DOMAIN_RUNNING else 'shutoff',
-                            'memory_kb': info[1] * 1024,
-                            'vcpus': info[3],
-                            'autostart': d.autostart()
-                        }
-                        self._send(json.dumps(vm_data), 200, 'application/json')
-                    except Exception as e:
-                        self._send(json.dumps({'error': str(e)}), 404, 'application/json')
-                else:  # POST - control operations
-                    action = form.get('action', [''])[0]
-                    try:
-                        d = lv.get_domain(vm_name)
-                        if action == 'start':
-                            d.create()
-                        elif action == 'stop':
-                            d.shutdown()
-                        elif action == 'force_stop':
-                            d.destroy()
-                        elif action == 'reboot':
-                            d.reboot()
-                        self._send(json.dumps({'status': 'success'}), 200, 'application/json')
-                    except Exception as e:
-                        self._send(json.dumps({'error': str(e)}), 400, 'application/json')
-            elif path == '/api/host-stats':
-                # Return host performance statistics
-                stats = self.host_stats()
-                self._send(json.dumps(stats), 200, 'application/json')
-            elif path.startswith('/api/migration-status/'):
-                # Return migration job status
-                job_id = path.split('/')[-1]
-                if hasattr(self, 'migration_jobs') and job_id in self.migration_jobs:
-                    status = self.migration_jobs[job_id]
-                    self._send(json.dumps(status), 200, 'application/json')
-                else:
-                    self._send(json.dumps({'error': 'Migration job not found'}), 404, 'application/json')
-            elif path == '/api/active-migrations':
-                # Return list of active migrations
-                active_migrations = []
-                if hasattr(self, 'migration_jobs'):
-                    for job_id, job_info in self.migration_jobs.items():
-                        if job_info['status'] in ['starting', 'copying', 'pivoted']:
-                            active_migrations.append({
-                                'job_id': job_id,
-                                'vm_name': job_info['vm_name'],
-                                'disk_target': job_info['disk_target'],
-                                'status': job_info['status'],
-                                'progress': job_info['progress']
-                            })
-                self._send(json.dumps({'migrations': active_migrations}), 200, 'application/json')
-            elif path.startswith('/api/snapshot/'):
-                # Handle snapshot operations via API
-                action = path.split('/')[-1]  # create, restore, delete
-                
-                if action == 'create' and form:
-                    domain_name = form.get('domain', [''])[0]
-                    snap_name = form.get('snap_name', [''])[0]
-                    
-                    if domain_name and snap_name:
-                        cmd = ['virsh', 'snapshot-create-as', domain_name, snap_name, '--disk-only', '--atomic']
-                        result = subprocess.run(cmd, capture_output=True, text=True)
-                        
-                        if result.returncode == 0:
-                            self._send('{"status": "success"}', 200, 'application/json')
-                        else:
-                            self._send(f'{{"status": "error", "message": "{result.stderr}"}}', 400, 'application/json')
-                    else:
-                        self._send('{"status": "error", "message": "Missing domain or snap_name"}', 400, 'application/json')
-                
-                elif action == 'restore' and form:
-                    domain_name = form.get('domain', [''])[0]
-                    snap_name = form.get('snap_name', [''])[0]
-                    
-                    if domain_name and snap_name:
-                        # Stop VM first if running
-                        try:
-                            d = lv.get_domain(domain_name)
-                            if d.isActive():
-                                d.destroy()
-                        except:
-                            pass
-                        
-                        cmd = ['virsh', 'snapshot-revert', domain_name, snap_name]
-                        result = subprocess.run(cmd, capture_output=True, text=True)
-                        
-                        if result.returncode == 0:
-                            self._send('{"status": "success"}', 200, 'application/json')
-                        else:
-                            self._send(f'{{"status": "error", "message": "{result.stderr}"}}', 400, 'application/json')
-                    else:
-                        self._send('{"status": "error", "message": "Missing domain or snap_name"}', 400, 'application/json')
-                
-                elif action == 'delete' and form:
-                    domain_name = form.get('domain', [''])[0]
-                    snap_name = form.get('snap_name', [''])[0]
-                    
-                    if domain_name and snap_name:
-                        cmd = ['virsh', 'snapshot-delete', domain_name, snap_name]
-                        result = subprocess.run(cmd, capture_output=True, text=True)
-                        
-                        if result.returncode == 0:
-                            self._send('{"status": "success"}', 200, 'application/json')
-                        else:
-                            self._send(f'{{"status": "error", "message": "{result.stderr}"}}', 400, 'application/json')
-                    else:
-                        self._send('{"status": "error", "message": "Missing domain or snap_name"}', 400, 'application/json')
-            
-            elif path == '/api/progress':
-                # Return progress data for active operations
-                pid = qs.get('id', [None])[0]
-                if pid:
-                    data = PROGRESS.get(pid)
-                    if data:
-                        self._send(json.dumps(data), 200, 'application/json')
-                    else:
-                        self._send(json.dumps({'error': 'Progress ID not found'}), 404, 'application/json')
-                else:
-                    # Return all active progress items
-                    self._send(json.dumps(dict(PROGRESS)), 200, 'application/json')
-                
+            # Exact routes first, then '/api/<resource>/<arg>' routes keyed on the resource prefix
+            handler = self.API_ROUTES.get(path) or self.API_PREFIX_ROUTES.get(path.rpartition('/')[0])
+            if handler:
+                handler(self, path, qs, form, lv)
             else:
-                self._send(json.dumps({'error': 'Not found'}), 404, 'application/json')
+                self._send(jdumps({'error': 'Not found'}), 404, 'application/json')
         except Exception as e:
-            self._send(json.dumps({'error': str(e)}), 500, 'application/json')
+            self._send(jdumps({'error': str(e)}), 500, 'application/json')
 
-    def page_snapshots(self, lv: LV, form: Optional[dict] = None):
-        """Snapshots management page"""
-        msg = ""
+    def api_vms(self, path: str, qs: dict, form: dict, lv: LV):
+        """List all domains with their state"""
+        vms = []
+        for d in lv.list_domains():
+            state, _ = d.state()
+            vms.append({
+                'name': d.name(),
+                'state': 'running' if state == VIR_DOMAIN_RUNNING else 'shutoff',
+                'id': d.ID() if state == VIR_DOMAIN_RUNNING else None
+            })
+        self._send(jdumps(vms), 200, 'application/json')
+
+    def api_vm(self, path: str, qs: dict, form: dict, lv: LV):
+        """Get one domain's details (GET) or run a power action on it (POST)"""
+        vm_name = path.split('/')[-1]
+        if not form:  # GET
+            try:
+                d = lv.get_domain(vm_name)
+                state, _ = d.state()
+                info = d.info()
+                vm_data = {
+                    'name': d.name(),
+                    'state': 'running' if state == VIR_DOMAIN_RUNNING else 'shutoff',
+                    'memory_kb': info[1] * 1024,
+                    'vcpus': info[3],
+                    'autostart': d.autostart()
+                }
+                self._send(jdumps(vm_data), 200, 'application/json')
+            except Exception as e:
+                self._send(jdumps({'error': str(e)}), 404, 'application/json')
+        else:  # POST - control operations
+            action = form.get('action', [''])[0]
+            try:
+                d = lv.get_domain(vm_name)
+                if action == 'start':
+                    d.create()
+                elif action == 'stop':
+                    d.shutdown()
+                elif action == 'force_stop':
+                    d.destroy()
+                elif action == 'reboot':
+                    d.reboot()
+                self._send(JSON_STATUS_OK, 200, 'application/json')
+            except Exception as e:
+                self._send(jdumps({'error': str(e)}), 400, 'application/json')
+
+    def api_host_stats(self, path: str, qs: dict, form: dict, lv: LV):
+        """Return host performance statistics"""
+        stats = self.host_stats()
+        self._send(jdumps(stats), 200, 'application/json')
+
+    def api_migration_status(self, path: str, qs: dict, form: dict, lv: LV):
+        """Return migration job status"""
+        job_id = path.split('/')[-1]
+        status = self.migration_jobs.get(job_id)
+        if status is not None:
+            self._send(jdumps(status), 200, 'application/json')
+        else:
+            self._send(jdumps({'error': 'Migration job not found'}), 404, 'application/json')
+
+    def api_active_migrations(self, path: str, qs: dict, form: dict, lv: LV):
+        """Return list of active migrations"""
+        active_migrations = []
+        for job_id, job_info in list(self.migration_jobs.items()):
+            if job_info['status'] in ['starting', 'copying', 'pivoted']:
+                active_migrations.append({
+                    'job_id': job_id,
+                    'vm_name': job_info['vm_name'],
+                    'disk_target': job_info['disk_target'],
+                    'status': job_info['status'],
+                    'progress': job_info['progress']
+                })
+        self._send(jdumps({'migrations': active_migrations}), 200, 'application/json')
+
+    def api_snapshot(self, path: str, qs: dict, form: dict, lv: LV):
+        """Handle snapshot operations via API"""
+        action = path.split('/')[-1]  # create, restore, delete
+
+        if action == 'create' and form:
+            domain_name = form.get('domain', [''])[0]
+            snap_name = form.get('snap_name', [''])[0]
+
+            if domain_name and snap_name:
+                try:
+                    d = lv.get_domain(domain_name)
+                    snap_xml = f"<domainsnapshot><name>{html.escape(snap_name)}</name></domainsnapshot>"
+                    d.snapshotCreateXML(snap_xml, libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_DISK_ONLY | libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_ATOMIC)
+                    self._send(JSON_STATUS_OK, 200, 'application/json')
+                except libvirt.libvirtError as e:
+                    self._send(jdumps({'status': 'error', 'message': str(e)}), 400, 'application/json')
+            else:
+                self._send(b'{"status": "error", "message": "Missing domain or snap_name"}', 400, 'application/json')
+
+        elif action == 'restore' and form:
+            domain_name = form.get('domain', [''])[0]
+            snap_name = form.get('snap_name', [''])[0]
+
+            if domain_name and snap_name:
+                try:
+                    d = lv.get_domain(domain_name)
+                    # Stop VM first if running
+                    try:
+                        if d.isActive():
+                            d.destroy()
+                    except libvirt.libvirtError:
+                        pass
+                    d.revertToSnapshot(d.snapshotLookupByName(snap_name))
+                    self._send(JSON_STATUS_OK, 200, 'application/json')
+                except libvirt.libvirtError as e:
+                    self._send(jdumps({'status': 'error', 'message': str(e)}), 400, 'application/json')
+            else:
+                self._send(b'{"status": "error", "message": "Missing domain or snap_name"}', 400, 'application/json')
+
+        elif action == 'delete' and form:
+            domain_name = form.get('domain', [''])[0]
+            snap_name = form.get('snap_name', [''])[0]
+
+            if domain_name and snap_name:
+                try:
+                    lv.delete_snapshot(domain_name, snap_name)
+                    self._send(JSON_STATUS_OK, 200, 'application/json')
+                except libvirt.libvirtError as e:
+                    self._send(jdumps({'status': 'error', 'message': str(e)}), 400, 'application/json')
+            else:
+                self._send(b'{"status": "error", "message": "Missing domain or snap_name"}', 400, 'application/json')
+
+    def api_progress(self, path: str, qs: dict, form: dict, lv: LV):
+        """Return progress data for active operations"""
+        pid = qs.get('id', [None])[0]
+        if pid:
+            data = PROGRESS.get(pid)
+            if data:
+                self._send(jdumps(data), 200, 'application/json')
+            else:
+                self._send(jdumps({'error': 'Progress ID not found'}), 404, 'application/json')
+        else:
+            # Return all active progress items. Serialize the live dict (the encoder runs under
+            # the GIL, so no snapshot copy is needed) and let unchanged polls short-circuit to 304.
+            body = jdumps(PROGRESS)
+            etag = '"%08x"' % zlib.crc32(body)
+            if self.headers.get('If-None-Match') == etag:
+                self._send(b'', 304, 'application/json', {'ETag': etag})
+            else:
+                self._send(body, 200, 'application/json', {'ETag': etag})
+
+    API_ROUTES = {
+        '/api/vms': api_vms,
+        '/api/host-stats': api_host_stats,
+        '/api/active-migrations': api_active_migrations,
+        '/api/progress': api_progress,
+    }
+    API_PREFIX_ROUTES = {
+        '/api/vm': api_vm,
+        '/api/migration-status': api_migration_status,
+        '/api/snapshot': api_snapshot,
+    }
+
+    def page_snapshots(self, lv: LV, form: Optional[dict] = None):
+        """Snapshots management page; yields HTML fragments so each VM card can be streamed"""
+        msg = ""
         
         if form:
             try:
@@ -3194,42 +3957,67 @@ class Handler(BaseHTTPRequestHandler):
             except Exception as e:
                 msg = f"<div class='alert error'>{html.escape(str(e))}</div>"
         
-        # List all VMs and their snapshots
-        vm_cards = []
-        for domain in lv.list_domains():
-            snapshots = lv.list_snapshots(domain.name())
-            state, _ = domain.state()
-            status = 'running' if state == libvirt.VIR_DOMAIN_RUNNING else 'shutoff'
-            
-            snap_rows = []
+        yield f"""
+        <div class="card">
+            <h3>📸 VM Snapshots</h3>
+            {msg}
+            <p>Create, restore, and manage VM snapshots for quick rollbacks and testing.</p>
+        </div>
+        <div class="card-grid">
+        """
+        
+        # List all VMs and their snapshots; states come from one bulk stats RPC
+        try:
+            domain_states = [(d, st.get('state.state')) for d, st in lv.conn.getAllDomainStats(libvirt.VIR_DOMAIN_STATS_STATE)]
+            domain_states.sort(key=lambda ds: ds[0].name().lower())
+        except Exception:
+            domain_states = [(d, d.state()[0]) for d in lv.list_domains()]
+        
+        def list_snaps(domain):
+            try:
+                return domain.listAllSnapshots()
+            except Exception:
+                return []
+        
+        # Snapshot listing and XML fetches are one RPC each; the binding drops the GIL so run them side by side
+        with ThreadPoolExecutor(max_workers=16) as ex:
+            snaps_per_domain = list(ex.map(list_snaps, [d for d, _ in domain_states]))
+            missing = []
+            for (domain, _), snapshots in zip(domain_states, snaps_per_domain):
+                uuid_str = domain.UUIDString()
+                for snap in snapshots:
+                    key = (uuid_str, snap.getName())
+                    if key not in SNAPSHOT_CTIME_CACHE:
+                        missing.append((key, snap))
+            for (key, _), ctime in zip(missing, ex.map(lambda ks: snapshot_ctime(ks[1]), missing)):
+                SNAPSHOT_CTIME_CACHE[key] = ctime
+        for (domain, state), snapshots in zip(domain_states, snaps_per_domain):
+            status = 'running' if state == VIR_DOMAIN_RUNNING else 'shutoff'
+            dn = html.escape(domain.name())
+            uuid_str = domain.UUIDString()
+            
+            snap_rows = StringIO()
+            append_row = snap_rows.write
             for snap in snapshots:
-                snap_xml = snap.getXMLDesc()
-                # Parse creation time from XML if available
-                creation_time = "Unknown"
-                try:
-                    import xml.etree.ElementTree as ET
-                    root = ET.fromstring(snap_xml)
-                    creation = root.find('creationTime')
-                    if creation is not None:
-                        creation_time = datetime.datetime.fromtimestamp(int(creation.text)).strftime('%Y-%m-%d %H:%M:%S')
-                except:
-                    pass
+                snap_name = snap.getName()
+                sn = html.escape(snap_name)
+                creation_time = SNAPSHOT_CTIME_CACHE.get((uuid_str, snap_name), "Unknown")
                 
-                snap_rows.append(f"""
+                append_row(f"""
                 <tr>
-                    <td>{html.escape(snap.getName())}</td>
+                    <td>{sn}</td>
                     <td>{creation_time}</td>
                     <td>
                         <form method='post' class='inline'>
                             <input type='hidden' name='restore_snapshot' value='1'>
-                            <input type='hidden' name='domain' value='{html.escape(domain.name())}'>
-                            <input type='hidden' name='snap_name' value='{html.escape(snap.getName())}'>
+                            <input type='hidden' name='domain' value='{dn}'>
+                            <input type='hidden' name='snap_name' value='{sn}'>
                             <button class='small secondary' onclick="return confirm('Restore to this snapshot?')">Restore</button>
                         </form>
                         <form method='post' class='inline'>
                             <input type='hidden' name='delete_snapshot' value='1'>
-                            <input type='hidden' name='domain' value='{html.escape(domain.name())}'>
-                            <input type='hidden' name='snap_name' value='{html.escape(snap.getName())}'>
+                            <input type='hidden' name='domain' value='{dn}'>
+                            <input type='hidden' name='snap_name' value='{sn}'>
                             <button class='small danger' onclick="return confirm('Delete this snapshot?')">Delete</button>
                         </form>
                     </td>
@@ -3240,18 +4028,18 @@ class Handler(BaseHTTPRequestHandler):
             <table>
                 <thead><tr><th>Snapshot</th><th>Created</th><th>Actions</th></tr></thead>
                 <tbody>
-                    {''.join(snap_rows) if snap_rows else '<tr><td colspan="3"><em>No snapshots</em></td></tr>'}
+                    {snap_rows.getvalue() if snapshots else '<tr><td colspan="3"><em>No snapshots</em></td></tr>'}
                 </tbody>
             </table>
             """ if snapshots or True else "<p><em>No snapshots</em></p>"
             
-            vm_cards.append(f"""
+            yield f"""
             <div class="card">
-                <h4>{html.escape(domain.name())} <span class="badge {status}">{status}</span></h4>
+                <h4>{dn} <span class="badge {status}">{status}</span></h4>
                 {snap_table}
                 <form method='post' class='inline' style='margin-top:12px'>
                     <input type='hidden' name='create_snapshot' value='1'>
-                    <input type='hidden' name='domain' value='{html.escape(domain.name())}'>
+                    <input type='hidden' name='domain' value='{dn}'>
                     <div style='display:flex;gap:8px;align-items:end'>
                         <label style='flex:1'>Snapshot Name <input name='snap_name' required placeholder='snapshot-{int(time.time())}'></label>
                         <label style='flex:2'>Description <input name='description' placeholder='Description (optional)'></label>
@@ -3260,21 +4048,18 @@ class Handler(BaseHTTPRequestHandler):
                     <div class='inline-note' style='margin-top:4px'>ℹ️ Creates disk-only snapshots (excludes memory state). Uses optimized method for running VMs.</div>
                 </form>
             </div>
-            """)
+            """
         
-        return f"""
-        <div class="card">
-            <h3>📸 VM Snapshots</h3>
-            {msg}
-            <p>Create, restore, and manage VM snapshots for quick rollbacks and testing.</p>
-        </div>
-        <div class="card-grid">
-            {''.join(vm_cards) if vm_cards else '<div class="card"><p><em>No VMs found</em></p></div>'}
+        if not domain_states:
+            yield '<div class="card"><p><em>No VMs found</em></p></div>'
+        yield """
         </div>
         """
 
     def page_backups(self, lv: LV, form: Optional[dict] = None):
-        """Backup management page"""
+        """Backup management page. Form actions and the VM list run here, before any response is
+        sent, so their errors are reported on the page; the returned generator only renders and
+        yields HTML fragments so backup rows can be streamed"""
         msg = ""
         
         # Ensure backup directory exists
@@ -3312,190 +4097,159 @@ class Handler(BaseHTTPRequestHandler):
         # List VMs for backup creation
         vm_options = ''.join(f"<option value='{html.escape(d.name())}'>{html.escape(d.name())}</option>" for d in lv.list_domains())
         
-        # List existing backups
-        backup_rows = []
-        try:
-            for backup_dir in sorted(os.listdir(BACKUP_DIR)):
-                backup_path = os.path.join(BACKUP_DIR, backup_dir)
-                if os.path.isdir(backup_path):
-                    manifest_path = os.path.join(backup_path, 'manifest.json')
-                    if os.path.exists(manifest_path):
-                        try:
-                            with open(manifest_path, 'r') as f:
-                                manifest = json.load(f)
-                            
-                            # Calculate backup size
-                            total_size = 0
-                            for root, dirs, files in os.walk(backup_path):
-                                for file in files:
-                                    total_size += os.path.getsize(os.path.join(root, file))
-                            
-                            backup_rows.append(f"""
-                            <tr>
-                                <td>{html.escape(manifest['domain_name'])}</td>
-                                <td>{manifest['backup_time'][:19].replace('T', ' ')}</td>
-                                <td>{human_bytes(total_size)}</td>
-                                <td>{'Yes' if manifest.get('was_running') else 'No'}</td>
-                                <td>
-                                    <button class='small secondary' onclick="openRestoreModal('{html.escape(backup_path)}', '{html.escape(manifest['domain_name'])}')">Restore</button>
-                                    <form method='post' class='inline'>
-                                        <input type='hidden' name='delete_backup' value='1'>
-                                        <input type='hidden' name='backup_path' value='{html.escape(backup_path)}'>
-                                        <button class='small danger' onclick="return confirm('Delete this backup?')">Delete</button>
-                                    </form>
-                                </td>
-                            </tr>
-                            """)
-                        except:
-                            pass
-        except:
-            pass
-        
-        backup_table = f"""
-        <table>
-            <thead><tr><th>VM Name</th><th>Backup Time</th><th>Size</th><th>Was Running</th><th>Actions</th></tr></thead>
-            <tbody>
-                {''.join(backup_rows) if backup_rows else '<tr><td colspan="5"><em>No backups found</em></td></tr>'}
-            </tbody>
-        </table>
-        """
-        
-        # Restore modal
-        restore_modal = """
-        <div class='modal' id='modal_restore_backup' hidden>
-            <div class='panel'>
-                <div style='display:flex;justify-content:space-between;align-items:center'>
-                    <h3>🔄 Restore Backup</h3>
-                    <button class='close secondary' onclick="closeModal('modal_restore_backup')">×</button>
-                </div>
-                <form method='post'>
-                    <input type='hidden' name='restore_backup' value='1'>
-                    <input type='hidden' id='restore_backup_path' name='backup_path' value=''>
-                    
-                    <p>Restore backup of: <strong id='restore_original_name'></strong></p>
-                    
-                    <label>New VM Name (leave empty to use original name)
-                        <input name='new_name' placeholder='Optional: new-vm-name'>
-                    </label>
-                    
-                    <div style='margin-top:16px'>
-                        <input type='submit' class='button success' value='Restore Backup'>
-                        <button type='button' class='button secondary' onclick="closeModal('modal_restore_backup')">Cancel</button>
+        def render():
+            yield f"""
+            <div class="card">
+                <h3>💾 VM Backups</h3>
+                {msg}
+                <p>Create full VM backups and restore them when needed. Backups are stored in: <code>{BACKUP_DIR}</code></p>
+            
+                <form method='post' class='inline' style='margin-top:16px'>
+                    <input type='hidden' name='create_backup' value='1'>
+                    <div style='display:grid;gap:12px;grid-template-columns:1fr 1fr auto;align-items:end'>
+                        <label>VM to Backup <select name='domain' class='enh'>{vm_options}</select></label>
+                        <label>Backup Directory <input name='backup_dir' value='{BACKUP_DIR}' placeholder='/path/to/backup/dir'></label>
+                        <button class='success'>Create Backup</button>
                     </div>
                 </form>
             </div>
-        </div>
         
-        <script>
-        function openRestoreModal(backupPath, originalName) {
-            document.getElementById('restore_backup_path').value = backupPath;
-            document.getElementById('restore_original_name').textContent = originalName;
-            openModal('modal_restore_backup');
-        }
-        </script>
-        """
+            <div class="card">
+                <h4>📦 Existing Backups</h4>
+            <table>
+                <thead><tr><th>VM Name</th><th>Backup Time</th><th>Size</th><th>Was Running</th><th>Actions</th></tr></thead>
+                <tbody>
+            """
         
-        return f"""
-        <div class="card">
-            <h3>💾 VM Backups</h3>
-            {msg}
-            <p>Create full VM backups and restore them when needed. Backups are stored in: <code>{BACKUP_DIR}</code></p>
-            
-            <form method='post' class='inline' style='margin-top:16px'>
-                <input type='hidden' name='create_backup' value='1'>
-                <div style='display:grid;gap:12px;grid-template-columns:1fr 1fr auto;align-items:end'>
-                    <label>VM to Backup <select name='domain' class='enh'>{vm_options}</select></label>
-                    <label>Backup Directory <input name='backup_dir' value='{BACKUP_DIR}' placeholder='/path/to/backup/dir'></label>
-                    <button class='success'>Create Backup</button>
-                </div>
-            </form>
-        </div>
+            # List existing backups
+            row_count = 0
+            try:
+                for backup_dir in sorted(os.listdir(BACKUP_DIR)):
+                    backup_path = os.path.join(BACKUP_DIR, backup_dir)
+                    if os.path.isdir(backup_path):
+                        if os.path.exists(os.path.join(backup_path, 'manifest.json')):
+                            try:
+                                manifest = load_backup_manifest(backup_path)
+                                total_size = manifest['total_size']
+                                bp = html.escape(backup_path)
+                                dn = html.escape(manifest['domain_name'])
+                            
+                                row = f"""
+                                <tr>
+                                    <td>{dn}</td>
+                                    <td>{manifest['backup_time'][:19].replace('T', ' ')}</td>
+                                    <td>{human_bytes(total_size)}</td>
+                                    <td>{'Yes' if manifest.get('was_running') else 'No'}</td>
+                                    <td>
+                                        <button class='small secondary' onclick="openRestoreModal('{bp}', '{dn}')">Restore</button>
+                                        <form method='post' class='inline'>
+                                            <input type='hidden' name='delete_backup' value='1'>
+                                            <input type='hidden' name='backup_path' value='{bp}'>
+                                            <button class='small danger' onclick="return confirm('Delete this backup?')">Delete</button>
+                                        </form>
+                                    </td>
+                                </tr>
+                                """
+                            except:
+                                continue
+                            row_count += 1
+                            yield row
+            except:
+                pass
         
-        <div class="card">
-            <h4>📦 Existing Backups</h4>
-            {backup_table}
-        </div>
+            if not row_count:
+                yield '<tr><td colspan="5"><em>No backups found</em></td></tr>'
+            yield f"""
+                </tbody>
+            </table>
+            </div>
         
-        {restore_modal}
-        """
+            {BACKUP_RESTORE_MODAL}
+            """
+        return render()
 
     def page_networks(self, lv: LV, form: Optional[dict] = None):
-        """Network management page redirecting to Cockpit"""
+        """Network management page redirecting to Cockpit; the returned generator yields HTML fragments
+        and only does read-only, error-handled lookups, since it runs after the response has started"""
         # Get the host IP address
-        import socket
-        try:
-            # Connect to a remote address to determine the local IP
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            host_ip = s.getsockname()[0]
-            s.close()
-        except Exception:
-            # Fallback to localhost if unable to determine IP
-            host_ip = "127.0.0.1"
+        host_ip = get_host_ip()
         
-        # Get NetworkManager bridges (read-only)
-        bridge_rows = []
-        try:
-            result = subprocess.run(['sudo', 'nmcli', '-t', '-f', 'NAME,TYPE,DEVICE,STATE', 'connection', 'show'], 
-                                  capture_output=True, text=True, timeout=5)
-            if result.returncode == 0:
-                for line in result.stdout.strip().split('\n'):
-                    if line and 'bridge' in line:
-                        parts = line.split(':')
-                        if len(parts) >= 4:
-                            name, conn_type, device, state = parts[:4]
-                            if conn_type == 'bridge':
-                                # Get IP address
-                                ip_result = subprocess.run(['sudo', 'nmcli', '-t', '-f', 'IP4.ADDRESS', 'connection', 'show', name],
-                                                         capture_output=True, text=True, timeout=3)
-                                ip_addr = ip_result.stdout.strip().replace('IP4.ADDRESS:', '') if ip_result.returncode == 0 else 'N/A'
+        def render():
+            # The Cockpit link needs no nmcli data, so send it before querying NetworkManager
+            yield f"""
+            <div class="card">
+                <h3>🌐 Network Configuration</h3>
+                <p>Network configuration is managed through Cockpit's web interface.</p>
+                <p>Click the link below to access the network configuration:</p>
+                <p style="margin: 20px 0;">
+                    <a href="https://{host_ip}:9090/network" target="_blank" class="button" style="font-size: 16px; padding: 12px 24px;">
+                        🌐 Open Cockpit Networks Configuration
+                    </a>
+                </p>
+                <p class="inline-note">
+                    <strong>Note:</strong> This will open Cockpit's network configuration in a new tab. 
+                    You may need to accept the SSL certificate if this is your first time accessing Cockpit.
+                </p>
+            </div>
+            """
+        
+            # Get NetworkManager bridges (read-only)
+            bridge_rows = []
+            try:
+                result = subprocess.run(SUDO + ['nmcli', '-t', '-f', 'NAME,TYPE,DEVICE,STATE', 'connection', 'show'], 
+                                      capture_output=True, text=True, timeout=5, close_fds=False)
+                if result.returncode == 0:
+                    # One 'device show' for every device's addresses instead of an nmcli call per bridge
+                    device_ips = {}
+                    ip_result = subprocess.run(SUDO + ['nmcli', '-t', '-f', 'GENERAL.DEVICE,IP4.ADDRESS', 'device', 'show'],
+                                             capture_output=True, text=True, timeout=5, close_fds=False)
+                    if ip_result.returncode == 0:
+                        current = None
+                        for line in ip_result.stdout.splitlines():
+                            key, _, value = line.partition(':')
+                            if key == 'GENERAL.DEVICE':
+                                current = value
+                                device_ips.setdefault(current, [])
+                            elif key.startswith('IP4.ADDRESS') and current is not None and value:
+                                device_ips[current].append(value)
+                    for line in result.stdout.strip().split('\n'):
+                        if line and 'bridge' in line:
+                            parts = line.split(':')
+                            if len(parts) >= 4:
+                                name, conn_type, device, state = parts[:4]
+                                if conn_type == 'bridge':
+                                    ip_addr = ', '.join(device_ips.get(device, [])) if ip_result.returncode == 0 else 'N/A'
                                 
-                                bridge_rows.append(f"""
-                                <tr>
-                                    <td>{html.escape(name)}</td>
-                                    <td><span class="badge {'running' if state == 'activated' else 'shutoff'}">{html.escape(state)}</span></td>
-                                    <td>{html.escape(device or 'N/A')}</td>
-                                    <td>{html.escape(ip_addr)}</td>
-                                </tr>
-                                """)
-        except Exception as e:
-            bridge_rows.append(f"<tr><td colspan='4'><em>Error listing bridges: {html.escape(str(e))}</em></td></tr>")
-        
-        bridge_table = f"""
-        <table>
-            <thead><tr><th>Name</th><th>Status</th><th>Device</th><th>IP Address</th></tr></thead>
-            <tbody>
-                {''.join(bridge_rows) if bridge_rows else '<tr><td colspan="4"><em>No NetworkManager bridges found</em></td></tr>'}
-            </tbody>
-        </table>
-        """
+                                    bridge_rows.append(f"""
+                                    <tr>
+                                        <td>{html.escape(name)}</td>
+                                        <td><span class="badge {'running' if state == 'activated' else 'shutoff'}">{html.escape(state)}</span></td>
+                                        <td>{html.escape(device or 'N/A')}</td>
+                                        <td>{html.escape(ip_addr)}</td>
+                                    </tr>
+                                    """)
+            except Exception as e:
+                bridge_rows.append(f"<tr><td colspan='4'><em>Error listing bridges: {html.escape(str(e))}</em></td></tr>")
         
-        return f"""
-        <div class="card">
-            <h3>🌐 Network Configuration</h3>
-            <p>Network configuration is managed through Cockpit's web interface.</p>
-            <p>Click the link below to access the network configuration:</p>
-            <p style="margin: 20px 0;">
-                <a href="https://{host_ip}:9090/network" target="_blank" class="button" style="font-size: 16px; padding: 12px 24px;">
-                    🌐 Open Cockpit Networks Configuration
-                </a>
-            </p>
-            <p class="inline-note">
-                <strong>Note:</strong> This will open Cockpit's network configuration in a new tab. 
-                You may need to accept the SSL certificate if this is your first time accessing Cockpit.
-            </p>
-        </div>
+            bridge_table = f"""
+            <table>
+                <thead><tr><th>Name</th><th>Status</th><th>Device</th><th>IP Address</th></tr></thead>
+                <tbody>
+                    {''.join(bridge_rows) if bridge_rows else '<tr><td colspan="4"><em>No NetworkManager bridges found</em></td></tr>'}
+                </tbody>
+            </table>
+            """
         
-        <div class="card">
-            <h4>🌉 Current NetworkManager Bridges</h4>
-            <p class="inline-note">View existing bridges below. Use Cockpit for configuration changes.</p>
-            {bridge_table}
-        </div>
-        """
+            yield f"""
+            <div class="card">
+                <h4>🌉 Current NetworkManager Bridges</h4>
+                <p class="inline-note">View existing bridges below. Use Cockpit for configuration changes.</p>
+                {bridge_table}
+            </div>
+            """
+        return render()
     # Screenshot -> inline console
     def screenshot(self, lv:LV, d):
-        import threading
-        import time
         
         def screenshot_worker(result_container):
             """Worker function to capture screenshot with timeout"""
@@ -3508,25 +4262,27 @@ class Handler(BaseHTTPRequestHandler):
                     # Fallback to basic screenshot
                     fmt = d.screenshot(stream, 0)
                 
-                buf = BytesIO()
-                start_time = time.time()
+                buf = bytearray()
+                buf_extend = buf.extend
+                recv = stream.recv
+                start_time = time.monotonic()
+                i = 0
                 
                 while True:
                     try:
-                        # Check for timeout within the read loop
-                        if time.time() - start_time > 5:  # 5 second timeout
-                            raise TimeoutError("Screenshot read timeout")
+                        # Check for timeout within the read loop (every 16 chunks is plenty)
+                        if (i & 15) == 0 and time.monotonic() - start_time > 5:  # 5 second timeout
+                            break
+                        i += 1
                         
-                        chunk = stream.recv(65536)
+                        chunk = recv(65536)
                         if not chunk: 
                             break
-                        buf.write(chunk)
+                        buf_extend(chunk)
                     except libvirt.libvirtError: 
                         break
-                    except TimeoutError:
-                        break
                 
-                raw = buf.getvalue()
+                raw = memoryview(buf)  # zero-copy view; keeps buf alive until sent
                 
                 if raw:
                     if fmt == 'ppm':
@@ -3581,49 +4337,56 @@ class Handler(BaseHTTPRequestHandler):
             self._send(error_data, 200, 'image/png', cache_headers)
     
     def generate_simple_error_image(self, message):
-        """Generate a simple black PNG with error text"""
-        # Create a minimal 320x240 black PNG
-        width, height = 320, 240
-        
-        # PNG signature
-        png_sig = b'\x89PNG\r\n\x1a\n'
-        
-        # IHDR chunk (width, height, bit_depth=8, color_type=0 (grayscale), compression=0, filter=0, interlace=0)
-        ihdr_data = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)
-        ihdr_crc = zlib.crc32(b'IHDR' + ihdr_data) & 0xffffffff
-        ihdr = struct.pack('>I', len(ihdr_data)) + b'IHDR' + ihdr_data + struct.pack('>I', ihdr_crc)
-        
-        # IDAT chunk (compressed black pixels)
-        pixels = b'\x00' * (width + 1) * height  # +1 for filter byte per row
-        idat_data = zlib.compress(pixels)
-        idat_crc = zlib.crc32(b'IDAT' + idat_data) & 0xffffffff
-        idat = struct.pack('>I', len(idat_data)) + b'IDAT' + idat_data + struct.pack('>I', idat_crc)
-        
-        # IEND chunk
-        iend_crc = zlib.crc32(b'IEND') & 0xffffffff
-        iend = struct.pack('>I', 0) + b'IEND' + struct.pack('>I', iend_crc)
-        
-        return png_sig + ihdr + idat + iend
-    def ppm_to_png(self, ppm:bytes):  # minimalist converter
+        """Return the placeholder black PNG (the message is not rendered into pixels)"""
+        return ERROR_PNG
+    def ppm_to_png(self, ppm:Union[bytes, bytearray, memoryview], level:int=PNG_ZLEVEL):  # minimalist converter
         try:
-            parts=ppm.split(b'\n');
-            if parts[0]!=b'P6': return None
-            i=1
-            while parts[i].startswith(b'#'): i+=1
-            dims=parts[i]; i+=1
-            while parts[i].startswith(b'#'): i+=1
-            maxv=parts[i]; i+=1
-            width,height=map(int,dims.split()); maxval=int(maxv)
-            pixel=b'\n'.join(parts[i:])
-            def chunk(t,d): return struct.pack('!I',len(d))+t+d+struct.pack('!I', zlib.crc32(t+d)&0xffffffff)
+            # Scan only the header tokens (magic, width, height, maxval); never split the pixel data
+            head=bytes(ppm[:1024])
+            tokens=[]; pos=0
+            while len(tokens)<4:
+                while head[pos:pos+1].isspace(): pos+=1
+                if head[pos:pos+1]==b'#':
+                    pos=head.index(b'\n',pos)+1; continue
+                end=pos
+                while end<len(head) and not head[end:end+1].isspace(): end+=1
+                tokens.append(head[pos:end]); pos=end
+            if tokens[0]!=b'P6': return None
+            width,height,maxval=int(tokens[1]),int(tokens[2]),int(tokens[3])
+            pixel=memoryview(ppm)[pos+1:]  # exactly one whitespace byte follows maxval; zero-copy view
+            if len(pixel)<width*height*3: return None  # truncated capture
+            def chunk(t,d): return (struct.pack('!I',len(d)),t,d,struct.pack('!I', png_zlib.crc32(d, png_zlib.crc32(t))))  # seeded CRC, no t+d copy
             sig=b'\x89PNG\r\n\x1a\n'; ihdr=struct.pack('!IIBBBBB',width,height,8,2,0,0,0)
-            stride=width*3; scan=BytesIO()
-            for y in range(height): scan.write(b'\x00'+pixel[y*stride:y*stride+stride])
-            idat=zlib.compress(scan.getvalue(),6)
-            return sig+chunk(b'IHDR',ihdr)+chunk(b'IDAT',idat)+chunk(b'IEND',b'')
+            stride=width*3; row_len=stride+1
+            if np is not None:
+                # Prepend the filter column in one strided copy instead of a row loop
+                scan=np.zeros((height,row_len),dtype=np.uint8)
+                scan[:,1:]=np.frombuffer(pixel,dtype=np.uint8,count=height*stride).reshape(height,stride)
+            else:
+                scan=bytearray(height*row_len)  # zero-filled, so every filter byte is already 0 (None)
+                mv=memoryview(scan)
+                for y in range(height):
+                    off=y*row_len
+                    mv[off+1:off+row_len]=pixel[y*stride:y*stride+stride]
+            idat_parts,idat_crc=png_idat(memoryview(scan).cast('B'),level)
+            idat_len=sum(map(len,idat_parts))
+            return b''.join((sig,*chunk(b'IHDR',ihdr),
+                             struct.pack('!I',idat_len),b'IDAT',*idat_parts,struct.pack('!I',idat_crc),
+                             *chunk(b'IEND',b'')))  # IDAT is copied exactly once
         except: return None
     # Pages
     def page_dashboard(self, lv:LV):
+        return "".join(self.page_dashboard_stream(lv))
+    
+    def page_dashboard_stream(self, lv:LV):
+        """Dashboard page as HTML fragments; the header and stats go out before the VM rows are built"""
+        # The page is polled; live figures come from /api/host-stats, so a 1s-old render is indistinguishable
+        now = time.monotonic()
+        rendered_at, cached = DASHBOARD_CACHE
+        if cached is not None and now - rendered_at < 1.0:
+            yield cached
+            return
+        
         # Get host performance data
         host_perf = self.host_stats()
         
@@ -3661,49 +4424,6 @@ class Handler(BaseHTTPRequestHandler):
         </div>
         """
         
-        rows = []
-        for d in lv.list_domains():
-            state, _ = d.state()
-            # Check if libvirt.VIR_DOMAIN_RUNNING exists, otherwise use numeric value
-            running_state = getattr(libvirt, 'VIR_DOMAIN_RUNNING', 1) if hasattr(libvirt, 'VIR_DOMAIN_RUNNING') else 1
-            status = 'running' if state == running_state else 'shutoff'
-            
-            # Calculate storage information
-            storage_info = "-"
-            try:
-                import xml.etree.ElementTree as ET
-                xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                root = ET.fromstring(xml)
-                total_used = 0
-                total_allocated = 0
-                disk_count = 0
-                
-                for disk in root.findall('.//devices/disk[@type="file"][@device="disk"]'):
-                    source = disk.find('source')
-                    if source is not None and source.get('file'):
-                        disk_path = source.get('file')
-                        used_space, allocated_space = self.get_disk_usage(disk_path)
-                        total_used += used_space
-                        total_allocated += allocated_space
-                        disk_count += 1
-                
-                if disk_count > 0:
-                    storage_info = f"{total_used:.1f}G / {total_allocated:.1f}G"
-            except Exception:
-                storage_info = "-"
-            
-            # Determine status color outside f-string to avoid nested quotes
-            status_color = "#4a9eff" if status == "running" else "#666"
-            
-            rows.append(
-                f"<tr data-vm='{html.escape(d.name())}'><td><div style='display:flex;align-items:center;gap:8px;'><div style='width:8px;height:8px;border-radius:50%;background:{status_color};'></div><a href='/?domain={urllib.parse.quote(d.name())}' style='font-weight:500;text-decoration:none;color:var(--text);'>{html.escape(d.name())}</a></div></td><td><span class='badge {status}'>{status}</span></td><td class='cpu'>-</td><td class='mem'>-</td><td class='mem_pct'>-</td><td class='io'>-</td><td class='storage'>{storage_info}</td><td>{self.row_actions(d,status)}</td></tr>"
-            )
-        tbl = (
-            "<table id='vm_table'><thead><tr><th>Name</th><th>Status</th><th>CPU%</th><th>Memory</th><th>Mem%</th><th>Disk R/W</th><th>Storage</th><th>Actions</th></tr></thead><tbody>"
-            + "".join(rows)
-            + "</tbody></table>"
-        )
-        
         # Quick actions
         quick_actions = """
         <div style="margin: 16px 0; display: flex; gap: 12px; flex-wrap: wrap;">
@@ -3712,309 +4432,80 @@ class Handler(BaseHTTPRequestHandler):
         </div>
         """
         
-        return (
-            f"<div class='card'><h3>🖥️ Virtual Machines Dashboard</h3>{stats_cards}{quick_actions}{tbl}</div>"
-            + self.modal_vm(lv)
-            + """
-            <script>
-            function refreshVMStatus() {
-                // Refresh VM status on dashboard
-                const isDashboard = window.location.pathname === '/' && !window.location.search.includes('domain=');
-                const isVMDetail = window.location.search.includes('domain=');
-                
-                if (isDashboard) {
-                    fetch('/')
-                        .then(response => response.text())
-                        .then(html => {
-                            const parser = new DOMParser();
-                            const doc = parser.parseFromString(html, 'text/html');
-                            
-                            // Update VM table rows
-                            const newTable = doc.querySelector('#vm_table tbody');
-                            const currentTable = document.querySelector('#vm_table tbody');
-                            
-                            if (newTable && currentTable) {
-                                const newRows = newTable.querySelectorAll('tr[data-vm]');
-                                const currentRows = currentTable.querySelectorAll('tr[data-vm]');
-                                
-                                newRows.forEach((newRow) => {
-                                    const vmName = newRow.getAttribute('data-vm');
-                                    const currentRow = currentTable.querySelector(`tr[data-vm="${vmName}"]`);
-                                    
-                                    if (currentRow) {
-                                        // Update status badge
-                                        const oldBadge = currentRow.querySelector('.badge');
-                                        const newBadge = newRow.querySelector('.badge');
-                                        if (oldBadge && newBadge && oldBadge.textContent !== newBadge.textContent) {
-                                            oldBadge.textContent = newBadge.textContent;
-                                            oldBadge.className = newBadge.className;
-                                        }
-                                        
-                                        // Update status indicator dot
-                                        const oldDot = currentRow.querySelector('div[style*="border-radius:50%"]');
-                                        const newDot = newRow.querySelector('div[style*="border-radius:50%"]');
-                                        if (oldDot && newDot && oldDot.style.background !== newDot.style.background) {
-                                            oldDot.style.background = newDot.style.background;
-                                        }
-                                        
-                                        // Update action buttons (last td)
-                                        const oldActions = currentRow.querySelector('td:last-child');
-                                        const newActions = newRow.querySelector('td:last-child');
-                                        if (oldActions && newActions) {
-                                            oldActions.innerHTML = newActions.innerHTML;
-                                        }
-                                    }
-                                });
-                            }
-                        })
-                        .catch(err => console.warn('Status refresh failed:', err));
-                } else if (isVMDetail) {
-                    fetch(window.location.href)
-                        .then(response => response.text())
-                        .then(html => {
-                            const parser = new DOMParser();
-                            const doc = parser.parseFromString(html, 'text/html');
-                            
-                            // Update action buttons
-                            const newActions = doc.querySelector('.action-buttons');
-                            const currentActions = document.querySelector('.action-buttons');
-                            if (newActions && currentActions) {
-                                currentActions.innerHTML = newActions.innerHTML;
-                            }
-                        })
-                        .catch(err => console.warn('Status refresh failed:', err));
-                }
-            }
+        # Fragments are kept so the finished page can be cached for the next poll
+        parts = []
+        head = "".join((
+            "<div class='card'><h3>🖥️ Virtual Machines Dashboard</h3>", stats_cards, quick_actions,
+            "<table id='vm_table'><thead><tr><th>Name</th><th>Status</th><th>CPU%</th><th>Memory</th><th>Mem%</th><th>Disk R/W</th><th>Storage</th><th>Actions</th></tr></thead><tbody>",
+        ))
+        parts.append(head)
+        yield head
+        
+        row_format = DASHBOARD_ROW_TEMPLATE.format
+        domains = []
+        for d in lv.list_domains():
+            state, _ = d.state()
+            status = 'running' if state == VIR_DOMAIN_RUNNING else 'shutoff'
             
-            function takeSnapshot(vmName) {
-                // Auto-generate snapshot name: vmname-YYYYMMDD-HHMMSS
-                const now = new Date();
-                const timestamp = now.getFullYear() + 
-                    String(now.getMonth() + 1).padStart(2, '0') + 
-                    String(now.getDate()).padStart(2, '0') + '-' +
-                    String(now.getHours()).padStart(2, '0') + 
-                    String(now.getMinutes()).padStart(2, '0') + 
-                    String(now.getSeconds()).padStart(2, '0');
-                const snapName = vmName + '-' + timestamp;
-                
-                // Show loading indicator
-                const button = event.target;
-                const originalText = button.innerHTML;
-                button.innerHTML = '⏳ Creating...';
-                button.disabled = true;
-                
-                const params = new URLSearchParams();
-                params.append('domain', vmName);
-                params.append('snap_name', snapName);
-                
-                fetch('/api/snapshot/create', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/x-www-form-urlencoded'},
-                    body: params.toString()
-                }).then(response => response.json()).then(data => {
-                    button.innerHTML = originalText;
-                    button.disabled = false;
-                    if (data.status === 'success') {
-                        // Show success message briefly
-                        button.innerHTML = '✅ Done';
-                        setTimeout(() => {
-                            button.innerHTML = originalText;
-                        }, 2000);
-                    } else {
-                        alert('Snapshot creation failed: ' + (data.message || 'Unknown error'));
-                    }
-                }).catch(error => {
-                    button.innerHTML = originalText;
-                    button.disabled = false;
-                    alert('Network error. Please try again.');
-                });
-            }
+            # Collect file-backed disks; their usage is gathered for every VM at once below
+            try:
+                disk_paths = domain_disk_paths(d)
+            except Exception:
+                disk_paths = []
+            domains.append((d, status, disk_paths))
+        
+        # Each uncached lookup is a libvirt round-trip or a qemu-img subprocess, so fan them out
+        def usage_or_none(path):
+            # A failing disk only blanks its own VM's storage column
+            try:
+                return self.get_disk_usage_cached(path, lv)
+            except Exception as e:
+                logger.warning(f"Disk usage lookup failed for {path}: {e}")
+                return None
+        all_paths = list({p for _, _, paths in domains for p in paths})
+        disk_usage = {}
+        if all_paths:
+            with ThreadPoolExecutor(max_workers=8) as ex:
+                disk_usage = dict(zip(all_paths, ex.map(usage_or_none, all_paths)))
+        
+        for d, status, disk_paths in domains:
+            # Calculate storage information
+            storage_info = "-"
+            if disk_paths and all(disk_usage[p] is not None for p in disk_paths):
+                total_used = sum(disk_usage[p][0] for p in disk_paths)
+                total_allocated = sum(disk_usage[p][1] for p in disk_paths)
+                storage_info = f"{total_used:.1f}G / {total_allocated:.1f}G"
             
-            function vmAction(domain, action, needsConfirm = false) {
-                // Show loading indicator
-                const button = event.target;
-                const originalText = button.innerHTML;
-                button.innerHTML = '⏳ Working...';
-                button.disabled = true;
-                
-                const params = new URLSearchParams();
-                params.append('domain', domain);
-                params.append('op', action);
-                if (needsConfirm) params.append('confirm', '1');
-                
-                fetch('/?' + params.toString(), {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/x-www-form-urlencoded'},
-                    body: ''
-                }).then(response => {
-                    if (response.ok) {
-                        // Success - restore button and trigger immediate status refresh
-                        button.innerHTML = originalText;
-                        button.disabled = false;
-                        
-                        // Trigger immediate status update
-                        refreshVMStatus();
-                        
-                        // For shutdown/destroy actions, check more frequently for a few seconds
-                        if (action === 'shutdown' || action === 'destroy') {
-                            let checks = 0;
-                            const quickRefresh = setInterval(() => {
-                                refreshVMStatus();
-                                checks++;
-                                if (checks >= 6) { // Check 6 times (3 seconds at 500ms intervals)
-                                    clearInterval(quickRefresh);
-                                }
-                            }, 500);
-                        }
-                    } else {
-                        // Error - restore button and show message
-                        button.innerHTML = originalText;
-                        button.disabled = false;
-                        alert('Action failed. Please try again.');
-                    }
-                }).catch(error => {
-                    // Network error - restore button
-                    button.innerHTML = originalText;
-                    button.disabled = false;
-                    alert('Network error. Please try again.');
-                });
-            }
+            # Determine status color outside f-string to avoid nested quotes
+            status_color = "#4a9eff" if status == "running" else "#666"
             
-            // Auto-refresh performance data every 5 seconds
-            setInterval(function() {
-                fetch('/api/host-stats')
-                    .then(response => response.json())
-                    .then(data => {
-                        // Update CPU
-                        document.querySelector('.stats-grid .stat-card:nth-child(1) .stat-value').textContent = data.cpu_pct.toFixed(1) + '%';
-                        // Update Memory
-                        document.querySelector('.stats-grid .stat-card:nth-child(2) .stat-value').textContent = data.mem_used_h + ' / ' + data.mem_total_h;
-                        document.querySelector('.stats-grid .stat-card:nth-child(2) .stat-label').textContent = 'Memory (' + data.mem_pct.toFixed(1) + '%)';
-                        
-                        // Update Filesystem I/O
-                        if (data.phys_rd_kbps !== undefined && data.phys_wr_kbps !== undefined) {
-                            
-                            // Format with unit conversion (KB/s to B/s, MB/s, or GB/s without decimals)
-                            function formatRate(kbps) {
-                                const bytesPerSec = kbps * 1024;
-                                if (bytesPerSec >= 1024 * 1024 * 1024) {
-                                    return Math.floor(bytesPerSec / (1024 * 1024 * 1024)) + 'GB/s';
-                                } else if (bytesPerSec >= 1024 * 1024) {
-                                    return Math.floor(bytesPerSec / (1024 * 1024)) + 'MB/s';
-                                } else if (bytesPerSec >= 1024) {
-                                    return Math.floor(bytesPerSec / 1024) + 'KB/s';
-                                } else {
-                                    return Math.floor(bytesPerSec) + 'B/s';
-                                }
-                            }
-                            
-                            // Update Filesystem I/O (3rd card)
-                            const fsReadDisplay = formatRate(data.phys_rd_kbps);
-                            const fsWriteDisplay = formatRate(data.phys_wr_kbps);
-                            const fsIo = 'Read: ' + fsReadDisplay + '<br>Write: ' + fsWriteDisplay;
-                            document.querySelector('.stats-grid .stat-card:nth-child(3) .stat-value').innerHTML = fsIo;
-                        }
-                        // Only skip update if data is undefined (no data available)
-                    })
-                    .catch(error => console.log('Stats update failed:', error));
-            }, 1000);
-            </script>
-            """
-        )
+            name = d.name()
+            name_esc = escape_html(name)
+            name_quoted = urllib.parse.quote(name)
+            row = row_format(
+                name_esc=name_esc, name_quoted=name_quoted, status_color=status_color,
+                status=status, storage=storage_info, actions=self.row_actions(name_quoted,name_esc,status))
+            parts.append(row)
+            yield row
+        
+        tail = "".join(("</tbody></table></div>", self.modal_vm(lv), DASHBOARD_JS_TAG))
+        parts.append(tail)
+        yield tail
+        DASHBOARD_CACHE[:] = [now, "".join(parts)]
     
     def convert_key_to_qmp(self, key, key_code):
         """Convert JavaScript key to virsh send-key format"""
-        # Map common keys to virsh key names (these are the correct codes for virsh send-key)
-        key_map = {
-            'Enter': 'KEY_ENTER',
-            'Backspace': 'KEY_BACKSPACE', 
-            'Tab': 'KEY_TAB',
-            'Escape': 'KEY_ESC',
-            'Space': 'KEY_SPACE',
-            ' ': 'KEY_SPACE',
-            'ArrowUp': 'KEY_UP',
-            'ArrowDown': 'KEY_DOWN',
-            'ArrowLeft': 'KEY_LEFT',
-            'ArrowRight': 'KEY_RIGHT',
-            'Delete': 'KEY_DELETE',
-            'Home': 'KEY_HOME',
-            'End': 'KEY_END',
-            'PageUp': 'KEY_PAGEUP',
-            'PageDown': 'KEY_PAGEDOWN',
-            'Insert': 'KEY_INSERT',
-            'F1': 'KEY_F1', 'F2': 'KEY_F2', 'F3': 'KEY_F3', 'F4': 'KEY_F4',
-            'F5': 'KEY_F5', 'F6': 'KEY_F6', 'F7': 'KEY_F7', 'F8': 'KEY_F8',
-            'F9': 'KEY_F9', 'F10': 'KEY_F10', 'F11': 'KEY_F11', 'F12': 'KEY_F12',
-            'Shift': 'KEY_LEFTSHIFT', 'Control': 'KEY_LEFTCTRL', 'Alt': 'KEY_LEFTALT',
-            'Meta': 'KEY_LEFTMETA', 'CapsLock': 'KEY_CAPSLOCK',
-        }
-        
-        # Check if it's a mapped key
-        if key in key_map:
-            return key_map[key]
-        
-        # For single characters, convert to KEY_X format
-        if len(key) == 1:
-            if key.isalpha():
-                # For letters, always use the base key (lowercase)
-                return f'KEY_{key.upper()}'
-            elif key.isdigit():
-                return f'KEY_{key}'
-            else:
-                # Special characters - map to their base keys
-                # The shift handling happens at the endpoint level
-                char_map = {
-                    # Shifted number row
-                    '!': 'KEY_1', '@': 'KEY_2', '#': 'KEY_3', '$': 'KEY_4', '%': 'KEY_5',
-                    '^': 'KEY_6', '&': 'KEY_7', '*': 'KEY_8', '(': 'KEY_9', ')': 'KEY_0',
-                    # Base punctuation
-                    '-': 'KEY_MINUS', '_': 'KEY_MINUS',
-                    '=': 'KEY_EQUAL', '+': 'KEY_EQUAL',
-                    '[': 'KEY_LEFTBRACE', '{': 'KEY_LEFTBRACE',
-                    ']': 'KEY_RIGHTBRACE', '}': 'KEY_RIGHTBRACE',
-                    '\\': 'KEY_BACKSLASH', '|': 'KEY_BACKSLASH',
-                    ';': 'KEY_SEMICOLON', ':': 'KEY_SEMICOLON',
-                    "'": 'KEY_APOSTROPHE', '"': 'KEY_APOSTROPHE',
-                    '`': 'KEY_GRAVE', '~': 'KEY_GRAVE',
-                    ',': 'KEY_COMMA', '<': 'KEY_COMMA',
-                    '.': 'KEY_DOT', '>': 'KEY_DOT',
-                    '/': 'KEY_SLASH', '?': 'KEY_SLASH',
-                }
-                return char_map.get(key, None)
-            
-        return None
+        return VIRSH_KEY_MAP.get(key)
     
-    def send_qmp_key(self, domain, qmp_key):
-        """Send key event to VM via virsh send-key"""
+    def send_qmp_key(self, domain, qmp_key, *modifiers):
+        """Send a key press (plus any held modifiers) to the VM via libvirt's sendKey;
+        this goes over the existing connection instead of spawning virsh send-key"""
         try:
-            # Use virsh send-key with the correct key format
-            domain_name = domain.name()
-            
-            # Try multiple approaches as different systems may use different formats
-            key_formats = [
-                qmp_key,  # Try the KEY_ format first
-                qmp_key.replace('KEY_', '').lower(),  # Try without KEY_ prefix, lowercase
-                qmp_key.replace('KEY_', '')  # Try without KEY_ prefix, same case
-            ]
-            
-            for key_format in key_formats:
-                cmd = ['virsh', 'send-key', domain_name, key_format]
-                logger.info(f"Trying key command: {' '.join(cmd)}")
-                
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-                
-                if result.returncode == 0:
-                    logger.info(f"Key sent successfully to {domain_name}: {key_format}")
-                    return True
-                else:
-                    logger.warning(f"Key format '{key_format}' failed: {result.stderr.strip()}")
-            
-            # If all formats failed, log final error
-            logger.error(f"All key format attempts failed for {domain_name}, key: {qmp_key}")
-            return False
-                
-        except subprocess.TimeoutExpired:
-            logger.error("virsh send-key timeout")
+            codes = [LINUX_KEYCODES[k] for k in (*modifiers, qmp_key)]
+            domain.sendKey(libvirt.VIR_KEYCODE_SET_LINUX, 0, codes, len(codes), 0)
+            return True
+        except KeyError:
+            logger.error(f"No keycode for {qmp_key} (modifiers: {modifiers})")
             return False
         except Exception as e:
             logger.error(f"Key send error: {e}")
@@ -4079,35 +4570,31 @@ class Handler(BaseHTTPRequestHandler):
                     }
                 }
                 
-                import json
                 qmp_json = json.dumps(qmp_cmd)
                 
-                # Send via virsh qemu-monitor-command with QMP
-                cmd = ['virsh', 'qemu-monitor-command', domain_name, '--pretty', qmp_json]
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
+                # Send over the existing libvirt connection with QMP
+                ok, err = qemu_monitor_command(domain, qmp_json)
                 
-                if result.returncode == 0:
+                if ok:
                     logger.info(f"Mouse click sent via QMP JSON: {x},{y} button {button}")
                     return True
                 else:
-                    logger.warning(f"QMP mouse command failed: {result.stderr}")
+                    logger.warning(f"QMP mouse command failed: {err}")
                     
                 # Fallback to HMP commands
-                move_cmd = ['virsh', 'qemu-monitor-command', domain_name, '--hmp', f'mouse_move {x} {y}']
-                move_result = subprocess.run(move_cmd, capture_output=True, text=True, timeout=5)
+                ok, err = qemu_monitor_command(domain, f'mouse_move {x} {y}', hmp=True)
                 
-                if move_result.returncode == 0:
+                if ok:
                     # Send mouse button press and release
-                    press_cmd = ['virsh', 'qemu-monitor-command', domain_name, '--hmp', f'mouse_button {button}']
-                    press_result = subprocess.run(press_cmd, capture_output=True, text=True, timeout=5)
+                    ok, err = qemu_monitor_command(domain, f'mouse_button {button}', hmp=True)
                     
-                    if press_result.returncode == 0:
+                    if ok:
                         logger.info(f"Mouse click sent via HMP: {x},{y} button {button}")
                         return True
                     else:
-                        logger.warning(f"HMP mouse button failed: {press_result.stderr}")
+                        logger.warning(f"HMP mouse button failed: {err}")
                 else:
-                    logger.warning(f"HMP mouse move failed: {move_result.stderr}")
+                    logger.warning(f"HMP mouse move failed: {err}")
                     
             except Exception as e:
                 logger.warning(f"QMP mouse command failed: {e}")
@@ -4132,13 +4619,11 @@ class Handler(BaseHTTPRequestHandler):
                     snap_xml = snap.getXMLDesc(0)
                     
                     # Parse snapshot XML for details
-                    import xml.etree.ElementTree as ET
                     root = ET.fromstring(snap_xml)
                     
                     # Get creation time
                     creation_time = root.findtext('creationTime', '0')
                     try:
-                        import datetime
                         dt = datetime.datetime.fromtimestamp(int(creation_time))
                         creation_str = dt.strftime('%Y-%m-%d %H:%M:%S')
                     except:
@@ -4171,86 +4656,84 @@ class Handler(BaseHTTPRequestHandler):
             
         return sorted(snapshots, key=lambda x: x['creation_time'], reverse=True)
 
-    def row_actions(self,d,status):
-        n=urllib.parse.quote(d.name())
+    def row_actions(self,name_quoted,name_esc,status):
         if status=='running':
             return " ".join([
-                f"<a href='/novnc/vnc.html?path=vnc_ws/{n}&autoconnect=true' class='button small secondary' title='Open VNC Console' onclick=\"window.open(this.href, 'vnc_console', 'width=1024,height=768,resizable=yes,scrollbars=yes'); return false;\">🖥️ Console</a>",
-                f"<button type='button' class='button secondary small' onclick=\"vmAction('{html.escape(d.name())}', 'shutdown')\">⏹️ Shutdown</button>",
-                f"<button type='button' class='button small' onclick=\"vmAction('{html.escape(d.name())}', 'reboot')\">🔄 Reboot</button>",
-                f"<button type='button' class='button danger small' onclick=\"if(confirm('Force stop VM?')) vmAction('{html.escape(d.name())}', 'destroy', true)\">⚡ Force</button>",
-                f"<button type='button' class='button small tertiary' onclick=\"takeSnapshot('{html.escape(d.name())}')\">📸 Snapshot</button>"])
+                f"<a href='/novnc/vnc.html?path=vnc_ws/{name_quoted}&autoconnect=true' class='button small secondary' title='Open VNC Console' onclick=\"window.open(this.href, 'vnc_console', 'width=1024,height=768,resizable=yes,scrollbars=yes'); return false;\">🖥️ Console</a>",
+                f"<button type='button' class='button secondary small' onclick=\"vmAction('{name_esc}', 'shutdown')\">⏹️ Shutdown</button>",
+                f"<button type='button' class='button small' onclick=\"vmAction('{name_esc}', 'reboot')\">🔄 Reboot</button>",
+                f"<button type='button' class='button danger small' onclick=\"if(confirm('Force stop VM?')) vmAction('{name_esc}', 'destroy', true)\">⚡ Force</button>",
+                f"<button type='button' class='button small tertiary' onclick=\"takeSnapshot('{name_esc}')\">📸 Snapshot</button>"])
         return " ".join([
-            f"<button type='button' class='button small' onclick=\"vmAction('{html.escape(d.name())}', 'start')\">▶️ Start</button>",
-            f"<button type='button' class='button small tertiary' onclick=\"takeSnapshot('{html.escape(d.name())}')\">📸 Snapshot</button>",
-            f"<button type='button' class='button danger small' onclick=\"if(confirm('Delete domain (files & NVRAM)?')) vmAction('{html.escape(d.name())}', 'undefine', true)\">🗑️ Delete</button>"])
-
-    def get_disk_usage(self, disk_path):
-        """Get actual disk usage using qemu-img info
-        Returns (used_space, allocated_space) where:
-        - used_space = disk size (actual consumed space)
-        - allocated_space = virtual size (file length)
+            f"<button type='button' class='button small' onclick=\"vmAction('{name_esc}', 'start')\">▶️ Start</button>",
+            f"<button type='button' class='button small tertiary' onclick=\"takeSnapshot('{name_esc}')\">📸 Snapshot</button>",
+            f"<button type='button' class='button danger small' onclick=\"if(confirm('Delete domain (files & NVRAM)?')) vmAction('{name_esc}', 'undefine', true)\">🗑️ Delete</button>"])
+
+    def get_disk_usage_cached(self, disk_path, lv: Optional[LV] = None, ttl: float = 30.0):
+        """get_disk_usage with a short per-path cache; unpooled disks cost a qemu-img subprocess"""
+        now = time.monotonic()
+        cached = DISK_USAGE_CACHE.get(disk_path)
+        if cached and now - cached[0] < ttl:
+            return cached[1]
+        usage = self.get_disk_usage(disk_path, lv)
+        DISK_USAGE_CACHE[disk_path] = (now, usage)
+        return usage
+    
+    def get_disk_usage(self, disk_path, lv: Optional[LV] = None):
+        """Get actual disk usage from the libvirt storage volume, or qemu-img info outside any pool
+        Returns (used_space, allocated_space) in GiB where:
+        - used_space = allocation / actual-size (actual consumed space)
+        - allocated_space = capacity / virtual-size (guest-visible length)
         """
-        if not disk_path or not os.path.exists(disk_path):
+        if not disk_path:
             return 0, 0
         try:
-            result = subprocess.run(['sudo','qemu-img', 'info', '--force-share', disk_path], 
-                                  capture_output=True, text=True, timeout=10)
-            if result.returncode == 0:
-                used_space = 0      # disk size = actual consumed space
-                allocated_space = 0 # virtual size = file length (allocated)
-                for line in result.stdout.split('\n'):
-                    if 'disk size:' in line.lower():
-                        # Extract disk size (actual consumed space)
-                        # Format: "disk size: 21 GiB"
-                        size_str = line.split(':')[1].strip()
-                        if 'GiB' in size_str or 'GB' in size_str or 'G' in size_str:
-                            # Extract number before GiB/GB/G
-                            import re
-                            match = re.search(r'(\d+\.?\d*)\s*[GT]i?B?', size_str)
-                            if match:
-                                used_space = float(match.group(1))
-                        elif 'MiB' in size_str or 'MB' in size_str or 'M' in size_str:
-                            import re
-                            match = re.search(r'(\d+\.?\d*)\s*[MT]i?B?', size_str)
-                            if match:
-                                used_space = float(match.group(1)) / 1024
-                        elif 'KiB' in size_str or 'KB' in size_str or 'K' in size_str:
-                            import re
-                            match = re.search(r'(\d+\.?\d*)\s*[KT]i?B?', size_str)
-                            if match:
-                                used_space = float(match.group(1)) / (1024 * 1024)
-                    elif 'virtual size:' in line.lower():
-                        # Extract virtual size (allocated file length)
-                        # Format: "virtual size: 40 GiB (42949672960 bytes)"
-                        size_part = line.split(':')[1].strip()
-                        if 'GiB' in size_part or 'GB' in size_part or 'G' in size_part:
-                            import re
-                            match = re.search(r'(\d+\.?\d*)\s*[GT]i?B?', size_part)
-                            if match:
-                                allocated_space = float(match.group(1))
-                        elif 'MiB' in size_part or 'MB' in size_part or 'M' in size_part:
-                            import re
-                            match = re.search(r'(\d+\.?\d*)\s*[MT]i?B?', size_part)
-                            if match:
-                                allocated_space = float(match.group(1)) / 1024
-                return used_space, allocated_space
-        except Exception as e:
-            # Fallback to file size
-            try:
-                file_size = os.path.getsize(disk_path) / (1024*1024*1024)
-                return file_size, file_size
-            except:
-                return 0, 0
-        return 0, 0
+            st = os.stat(disk_path)
+        except OSError:
+            DISK_INFO_CACHE.pop(disk_path, None)
+            return 0, 0
+        now = time.monotonic()
+        cached = DISK_INFO_CACHE.get(disk_path)
+        if cached and now - cached[0] < 5.0 and cached[1] == st.st_mtime_ns and cached[2] == st.st_size:
+            return cached[3]
+        usage = None
+        try:
+            if lv is not None:
+                try:
+                    _, capacity, allocation = lv.conn.storageVolLookupByPath(disk_path).info()
+                    usage = (allocation / (1024**3), capacity / (1024**3))
+                except Exception:
+                    pass  # not in any storage pool, or the pool lookup failed; ask qemu-img instead
+            if usage is None:
+                # stderr is never read, so only stdout gets a pipe
+                result = subprocess.run(['sudo','qemu-img', 'info', '--force-share', '--output=json', disk_path],
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=10)
+                if result.returncode != 0:
+                    return 0, 0
+                info = jloads(result.stdout)
+                usage = (info.get('actual-size', 0) / (1024**3), info.get('virtual-size', 0) / (1024**3))
+            DISK_INFO_CACHE[disk_path] = (now, st.st_mtime_ns, st.st_size, usage)
+            return usage
+        except Exception:
+            # Fallback to file size from the stat we already have
+            file_size = st.st_size / (1024**3)
+            return file_size, file_size
 
     def page_domain(self, lv:LV, name:str, qs, form):
         try:
             d=lv.get_domain(name)
         except Exception:
             return "<div class='card'>Domain not found.</div>"
-        msg = ""
+        notes: List[str] = []  # inline status notes, joined once into the page
+        def note(text: str, kind: str = ''):
+            # text is escaped here, so callers pass raw values; kind is error/warning/success or empty
+            notes.append(f"<div class='inline-note{' ' + kind if kind else ''}'>{html.escape(text)}</div>")
         op = qs.get('op', [None])[0]
+        if op or form:
+            # Lifecycle and config changes may undefine/redefine the domain
+            DOMAIN_CACHE.pop(name, None)
+            DOMAIN_DISKS_CACHE.pop(d.UUIDString(), None)
+            DASHBOARD_CACHE[1] = None
         if op:
             try:
                 if op == 'start': 
@@ -4261,7 +4744,6 @@ class Handler(BaseHTTPRequestHandler):
                 elif op == 'undefine' and qs.get('confirm', ['0'])[0] == '1':
                     # Attempt full cleanup: domain undefine + nvram + per-VM directory
                     xml=d.XMLDesc(0)
-                    import xml.etree.ElementTree as ET
                     root=ET.fromstring(xml)
                     nvram_path=None
                     nvnode=root.find('.//os/nvram')
@@ -4269,7 +4751,7 @@ class Handler(BaseHTTPRequestHandler):
                         nvram_path=nvnode.text.strip()
                     # Identify first disk file path to infer VM directory (we stored as pool_path/name/...)
                     disk_file=None
-                    for disk in root.findall('.//devices/disk'):
+                    for disk in domain_disks(root):
                         src=disk.find('source')
                         if src is not None and 'file' in src.attrib:
                             disk_file=src.get('file'); break
@@ -4280,18 +4762,13 @@ class Handler(BaseHTTPRequestHandler):
                     # Force shutdown if running before undefine
                     try:
                         state, _ = d.state()
-                        if state == libvirt.VIR_DOMAIN_RUNNING:
+                        if state == VIR_DOMAIN_RUNNING:
                             d.destroy()  # Force stop
                     except Exception:
                         pass
                     
                     # Undefine with comprehensive NVRAM cleanup flags
-                    flags=0
-                    if hasattr(libvirt,'VIR_DOMAIN_UNDEFINE_NVRAM'): flags|=libvirt.VIR_DOMAIN_UNDEFINE_NVRAM
-                    if hasattr(libvirt,'VIR_DOMAIN_UNDEFINE_MANAGED_SAVE'): flags|=libvirt.VIR_DOMAIN_UNDEFINE_MANAGED_SAVE
-                    if hasattr(libvirt,'VIR_DOMAIN_UNDEFINE_SNAPSHOTS_METADATA'): flags|=libvirt.VIR_DOMAIN_UNDEFINE_SNAPSHOTS_METADATA
-                    if hasattr(libvirt,'VIR_DOMAIN_UNDEFINE_CHECKPOINTS_METADATA'): flags|=libvirt.VIR_DOMAIN_UNDEFINE_CHECKPOINTS_METADATA
-                    if hasattr(libvirt,'VIR_DOMAIN_UNDEFINE_KEEP_NVRAM'): flags|=libvirt.VIR_DOMAIN_UNDEFINE_KEEP_NVRAM
+                    flags=UNDEFINE_FLAGS
                     
                     # Try multiple approaches for NVRAM cleanup
                     undefine_success = False
@@ -4303,7 +4780,7 @@ class Handler(BaseHTTPRequestHandler):
                     except Exception as e1:
                         # Second try: undefine without NVRAM flag, then manually remove NVRAM
                         try:
-                            flags_no_nvram = flags & ~getattr(libvirt, 'VIR_DOMAIN_UNDEFINE_NVRAM', 0)
+                            flags_no_nvram = flags & ~VIR_DOMAIN_UNDEFINE_NVRAM
                             d.undefineFlags(flags_no_nvram)
                             undefine_success = True
                         except Exception as e2:
@@ -4316,14 +4793,33 @@ class Handler(BaseHTTPRequestHandler):
                     
                     if not undefine_success:
                         raise RuntimeError('Failed to undefine domain with all methods')
-                    # Remove nvram file explicitly if still exists
+                    # File cleanup can take seconds for large images; redirect now and free them in the background.
+                    # Move the files aside first, so a VM re-created under the same name right away
+                    # gets a fresh directory that the delayed removal cannot touch.
+                    tomb = f".deleted-{uuid.uuid4().hex}"
                     if nvram_path and os.path.isfile(nvram_path):
-                        try: os.remove(nvram_path)
-                        except Exception: pass
-                    # Remove vm dir
+                        try:
+                            os.rename(nvram_path, nvram_path + tomb)
+                            nvram_path += tomb
+                        except OSError:
+                            pass
                     if vm_dir and os.path.isdir(vm_dir):
-                        try: shutil.rmtree(vm_dir)
-                        except Exception: pass
+                        try:
+                            os.rename(vm_dir, vm_dir + tomb)
+                            vm_dir += tomb
+                        except OSError:
+                            # Cannot move it aside: remove it now rather than race a re-create later
+                            shutil.rmtree(vm_dir, onerror=lambda func, path, exc: logger.warning(f'Failed to remove {path}: {exc[1]}'))
+                            vm_dir = None
+                    def cleanup_files(nvram_path=nvram_path, vm_dir=vm_dir):
+                        # Remove nvram file explicitly if still exists
+                        if nvram_path and os.path.isfile(nvram_path):
+                            try: os.remove(nvram_path)
+                            except Exception: pass
+                        # Remove vm dir
+                        if vm_dir and os.path.isdir(vm_dir):
+                            shutil.rmtree(vm_dir, onerror=lambda func, path, exc: logger.warning(f'Failed to remove {path}: {exc[1]}'))
+                    FILE_CLEANUP_POOL.submit(cleanup_files)
                 elif op == 'autostart': d.setAutostart(1)
                 elif op == 'noautostart': d.setAutostart(0)
                 # immediate redirect to avoid double-click perception
@@ -4331,8 +4827,44 @@ class Handler(BaseHTTPRequestHandler):
                 redirect_url = "/" if op == 'undefine' else f"/?domain={html.escape(name)}"
                 return f"<div class='card'><p>Operation done...</p><meta http-equiv='refresh' content='0;url={redirect_url}'></div>"
             except Exception as e:
-                msg += f"<div class='inline-note'>{html.escape(str(e))}</div>"
+                note(str(e))
         if form:
+            # Inactive XML is fetched at most once per submission and dropped after each config change
+            inactive_xml_cache = []  # [xml], [xml, parsed root] or [xml, parsed root, disks by target dev]
+            def inactive_xml():
+                if not inactive_xml_cache:
+                    inactive_xml_cache.append(d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE))
+                return inactive_xml_cache[0]
+            def inactive_tree():
+                # Shared by the read-only branches; branches that edit the tree parse their own copy
+                if len(inactive_xml_cache) < 2:
+                    inactive_xml_cache.append(ET.fromstring(inactive_xml()))
+                return inactive_xml_cache[1]
+            def inactive_disk(tgt: str, device: str = ''):
+                # <disk> at target dev tgt in the shared tree (optionally only of one device kind), or None
+                if len(inactive_xml_cache) < 3:
+                    by_target = {}
+                    for disk in domain_disks(inactive_tree()):
+                        t = disk.find('target')
+                        if t is not None:
+                            by_target.setdefault(t.get('dev'), disk)
+                    inactive_xml_cache.append(by_target)
+                disk = inactive_xml_cache[2].get(tgt)
+                if disk is not None and device and disk.get('device', 'disk') != device:
+                    return None
+                return disk
+            # Running/active state likewise; no form branch starts or stops the domain before another reads it
+            running_cache = []
+            def domain_running():
+                if not running_cache:
+                    running_cache.append(d.state()[0] == VIR_DOMAIN_RUNNING)
+                return running_cache[0]
+            active_cache = []
+            def domain_active():
+                # Active also covers paused domains; a running one is active without asking libvirt again
+                if not active_cache:
+                    active_cache.append(bool(running_cache and running_cache[0]) or bool(d.isActive()))
+                return active_cache[0]
             try:
                 if 'update_cpu_mem' in form:
                     # Convert GiB to MiB for memory
@@ -4356,40 +4888,65 @@ class Handler(BaseHTTPRequestHandler):
                         cur_mem = d.maxMemory() // 1024
                     except Exception:
                         cur_mem = new_m
-                    if d.isActive():
+                    if domain_active():
                         # Hot increase only (OS type changes require VM shutdown)
                         if new_v > cur_v:
                             try:
-                                d.setVcpusFlags(new_v, libvirt.VIR_DOMAIN_AFFECT_LIVE | getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0))
-                                msg += f"<div class='inline-note'>CPU topology updated: {new_sockets}S/{new_cores}C/{new_threads}T = {new_v} vCPUs.</div>"
+                                d.setVcpusFlags(new_v, DEVICE_FLAGS_RUNNING)
+                                inactive_xml_cache.clear()
+                                note(f"CPU topology updated: {new_sockets}S/{new_cores}C/{new_threads}T = {new_v} vCPUs.")
                             except Exception as e:
-                                msg += f"<div class='inline-note'>CPU hotplug failed: {html.escape(str(e))}</div>"
+                                note(f"CPU hotplug failed: {e}")
                         if new_m > cur_mem:
                             try:
                                 # Memory in KiB
-                                d.setMemoryFlags(new_m*1024, libvirt.VIR_DOMAIN_AFFECT_LIVE | getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0))
-                                msg += f"<div class='inline-note'>Memory increased to {new_m} MiB.</div>"
+                                d.setMemoryFlags(new_m*1024, DEVICE_FLAGS_RUNNING)
+                                inactive_xml_cache.clear()
+                                note(f"Memory increased to {new_m} MiB.")
                             except Exception as e:
-                                msg += f"<div class='inline-note'>Memory hotplug failed: {html.escape(str(e))}</div>"
+                                note(f"Memory hotplug failed: {e}")
                         # Check if OS type change was requested
-                        current_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                        import xml.etree.ElementTree as ET
+                        current_xml = inactive_xml()
                         current_root = ET.fromstring(current_xml)
                         current_hyperv = current_root.find('.//features/hyperv')
                         current_is_windows = current_hyperv is not None
                         if (new_os_type == 'windows' and not current_is_windows) or (new_os_type == 'linux' and current_is_windows):
-                            msg += f"<div class='inline-note'>OS type change to {new_os_type} requires VM shutdown.</div>"
+                            note(f"OS type change to {new_os_type} requires VM shutdown.")
                     else:
                         # Redefine when powered off (can also decrease and change OS type)
-                        xml_cfg = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                        xml_cfg = re.sub(r'<vcpu.*?>.*?</vcpu>', f'<vcpu placement="static">{new_v}</vcpu>', xml_cfg)
-                        xml_cfg = re.sub(r'<memory.*?>.*?</memory>', f'<memory unit="KiB">{new_m*1024}</memory>', xml_cfg)
-                        xml_cfg = re.sub(r'<currentMemory.*?>.*?</currentMemory>', f'<currentMemory unit="KiB">{new_m*1024}</currentMemory>', xml_cfg)
-                        
-                        # Update OS-specific features
-                        if new_os_type == 'windows':
-                            # Always use Hyper-V features for Windows
-                            features_replacement = '''<features>
+                        current_root = ET.fromstring(inactive_xml())
+                        # Compare what the form asks for with the stored config; a no-op edit skips the redefine
+                        cur_cpu = current_root.find('cpu')
+                        cur_topo = cur_cpu.find('topology') if cur_cpu is not None else None
+                        cur_mode = cur_cpu.get('mode') if cur_cpu is not None else None
+                        os_elem = current_root.find('os')
+                        current_settings = (
+                            current_root.findtext('vcpu'), current_root.findtext('memory'), current_root.findtext('currentMemory'),
+                            'windows' if current_root.find('features/hyperv') is not None else 'linux',
+                            cur_mode, cur_cpu.findtext('model') if cur_mode == 'custom' else None,
+                            tuple(cur_topo.get(k) for k in ('sockets', 'cores', 'threads')) if cur_topo is not None else None,
+                            os_elem is not None and os_elem.find('boot') is not None)
+                        new_mode = new_cpu_mode if new_cpu_mode in ('host-passthrough', 'host-model') or (new_cpu_mode == 'custom' and new_cpu_model) else 'host-model'
+                        new_settings = (
+                            str(new_v), str(new_m*1024), str(new_m*1024),
+                            'windows' if new_os_type == 'windows' else 'linux',
+                            new_mode, new_cpu_model if new_mode == 'custom' else None,
+                            (str(new_sockets), str(new_cores), str(new_threads)),
+                            False)
+                        if new_settings == current_settings:
+                            note("No configuration changes to apply.")
+                        else:
+                            for tag, value, attrs in (('vcpu', new_v, {'placement': 'static'}),
+                                                      ('memory', new_m*1024, {'unit': 'KiB'}),
+                                                      ('currentMemory', new_m*1024, {'unit': 'KiB'})):
+                                elem = ET.Element(tag, attrs)
+                                elem.text = str(value)
+                                replace_xml_child(current_root, elem)
+                            
+                            # Update OS-specific features
+                            if new_os_type == 'windows':
+                                # Always use Hyper-V features for Windows
+                                features_replacement = '''<features>
     <acpi/>
     <apic/>
     <hyperv>
@@ -4405,41 +4962,43 @@ class Handler(BaseHTTPRequestHandler):
         <hidden state='on'/>
     </kvm>
 </features>'''
-                            msg += f"<div class='inline-note'>Enabled Hyper-V enlightenments for Windows.</div>"
-                        else:
-                            # Linux - basic features only
-                            features_replacement = '''<features>
+                                note("Enabled Hyper-V enlightenments for Windows.")
+                            else:
+                                # Linux - basic features only
+                                features_replacement = '''<features>
     <acpi/>
     <apic/>
 </features>'''
-                        
-                        xml_cfg = re.sub(r'<features>.*?</features>', features_replacement, xml_cfg, flags=re.DOTALL)
-                        
-                        # Update CPU configuration with topology
-                        cpu_replacement = ""
-                        if new_cpu_mode == 'host-passthrough':
-                            cpu_replacement = f"<cpu mode='host-passthrough' check='none' migratable='on'><topology sockets='{new_sockets}' cores='{new_cores}' threads='{new_threads}'/></cpu>"
-                        elif new_cpu_mode == 'host-model':
-                            cpu_replacement = f"<cpu mode='host-model' check='none'><topology sockets='{new_sockets}' cores='{new_cores}' threads='{new_threads}'/></cpu>"
-                        elif new_cpu_mode == 'custom' and new_cpu_model:
-                            cpu_replacement = f"<cpu mode='custom' match='exact' check='none'><model fallback='allow'>{html.escape(new_cpu_model)}</model><topology sockets='{new_sockets}' cores='{new_cores}' threads='{new_threads}'/></cpu>"
-                        else:
-                            cpu_replacement = f"<cpu mode='host-model' check='none'><topology sockets='{new_sockets}' cores='{new_cores}' threads='{new_threads}'/></cpu>"
-                        
-                        xml_cfg = re.sub(r'<cpu.*?</cpu>', cpu_replacement, xml_cfg, flags=re.DOTALL)
-                        if '<cpu' not in xml_cfg:
-                            # Insert CPU config after </os>
-                            xml_cfg = xml_cfg.replace('</os>', f'</os>{cpu_replacement}')
-                        
-                        # Remove all OS boot elements since we use per-device boot elements
-                        xml_cfg = re.sub(r'<boot dev=[^>]*/?>', '', xml_cfg)
-                        
-                        # Apply the updated XML configuration
-                        lv.conn.defineXML(xml_cfg)
-                        
-                        # Create a clean display name for the message (remove custom: prefix if present)
-                        display_cpu_mode = new_cpu_mode[7:] if new_cpu_mode.startswith('custom:') else new_cpu_mode
-                        msg += f"<div class='inline-note'>Config updated for {new_os_type} OS type, {display_cpu_mode} CPU mode, and boot order ({new_boot_order.replace(',', ', ')}). VM restart required for changes to take effect.</div>"
+                            
+                            replace_xml_child(current_root, ET.fromstring(features_replacement))
+                            
+                            # Update CPU configuration with topology
+                            cpu_replacement = ""
+                            if new_cpu_mode == 'host-passthrough':
+                                cpu_replacement = f"<cpu mode='host-passthrough' check='none' migratable='on'><topology sockets='{new_sockets}' cores='{new_cores}' threads='{new_threads}'/></cpu>"
+                            elif new_cpu_mode == 'host-model':
+                                cpu_replacement = f"<cpu mode='host-model' check='none'><topology sockets='{new_sockets}' cores='{new_cores}' threads='{new_threads}'/></cpu>"
+                            elif new_cpu_mode == 'custom' and new_cpu_model:
+                                cpu_replacement = f"<cpu mode='custom' match='exact' check='none'><model fallback='allow'>{html.escape(new_cpu_model)}</model><topology sockets='{new_sockets}' cores='{new_cores}' threads='{new_threads}'/></cpu>"
+                            else:
+                                cpu_replacement = f"<cpu mode='host-model' check='none'><topology sockets='{new_sockets}' cores='{new_cores}' threads='{new_threads}'/></cpu>"
+                            
+                            # Replaces an existing <cpu>, otherwise goes in after <os>
+                            replace_xml_child(current_root, ET.fromstring(cpu_replacement))
+                            
+                            # Remove all OS boot elements since we use per-device boot elements
+                            os_elem = current_root.find('os')
+                            if os_elem is not None:
+                                for boot in os_elem.findall('boot'):
+                                    os_elem.remove(boot)
+                            
+                            # Apply the updated XML configuration
+                            lv.conn.defineXML(ET.tostring(current_root, encoding='unicode'))
+                            inactive_xml_cache.clear()
+                            
+                            # Create a clean display name for the message (remove custom: prefix if present)
+                            display_cpu_mode = new_cpu_mode[7:] if new_cpu_mode.startswith('custom:') else new_cpu_mode
+                            note(f"Config updated for {new_os_type} OS type, {display_cpu_mode} CPU mode, and boot order ({new_boot_order.replace(',', ', ')}). VM restart required for changes to take effect.")
                 if 'create_volume' in form: 
                     pool = lv.get_pool(form.get('pool', [''])[0])
                     vol_name = form.get('vol_name', [''])[0]
@@ -4448,7 +5007,7 @@ class Handler(BaseHTTPRequestHandler):
                     cap = size_gb * 1024 * 1024 * 1024
                     vol_xml = f"<volume><name>{vol_name}</name><capacity unit='bytes'>{cap}</capacity><target><format type='{fmt}'/></target></volume>"
                     pool.createXML(vol_xml, 0)
-                    msg += "<div class='inline-note'>Volume created.</div>"
+                    note("Volume created.")
                 if 'attach_disk' in form: 
                     # Check if this is creating a new disk or attaching existing
                     disk_size_gb = form.get('disk_size_gb', [''])[0]
@@ -4466,26 +5025,23 @@ class Handler(BaseHTTPRequestHandler):
                             vol = pool.storageVolLookupByName(vol_name)
                             path = vol.path()
                             
-                            dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                            existing = re.findall(r"<target dev='(vd.)'", dom_xml)
+                            root = inactive_tree()
+                            existing = [t.get('dev') for t in root.findall('.//devices/disk/target') if (t.get('dev') or '').startswith('vd')]
                             tgt = lv.next_disk_target(existing)
                             
                             # Detect disk format
                             disk_format = 'qcow2' if vol_name.endswith('.qcow2') else 'raw'
-                            disk_xml = f"<disk type='file' device='disk'><driver name='qemu' type='{disk_format}'/><source file='{path}'/><target dev='{tgt}' bus='{bus_type}'/></disk>"
+                            disk_xml = file_disk_xml(path, tgt, bus_type, disk_format)
                             
                             # Use appropriate flags based on VM state
-                            state, _ = d.state()
-                            if state == libvirt.VIR_DOMAIN_RUNNING:
-                                flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_LIVE',0) | getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
-                            else:
-                                flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
+                            flags = DEVICE_FLAGS_RUNNING if domain_running() else DEVICE_FLAGS_STOPPED
                             
                             d.attachDeviceFlags(disk_xml, flags)
-                            msg += f"<div class='inline-note'>Attached existing disk: {html.escape(vol_name)}</div>"
+                            inactive_xml_cache.clear()
+                            note(f"Attached existing disk: {vol_name}")
                             
                         except Exception as e:
-                            msg += f"<div class='inline-note error'>Failed to attach existing disk: {html.escape(str(e))}</div>"
+                            note(f"Failed to attach existing disk: {e}", 'error')
                             
                     elif disk_size_gb:
                         # Create new disk
@@ -4496,10 +5052,8 @@ class Handler(BaseHTTPRequestHandler):
                                 
                             # Determine VM directory from existing disk paths
                             vm_dir = None
-                            dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                            import xml.etree.ElementTree as ET
-                            root = ET.fromstring(dom_xml)
-                            for disk in root.findall('.//devices/disk'):
+                            root = inactive_tree()
+                            for disk in domain_disks(root):
                                 src = disk.find('source')
                                 if src is not None and 'file' in src.attrib:
                                     disk_file = src.get('file')
@@ -4512,7 +5066,6 @@ class Handler(BaseHTTPRequestHandler):
                                 pools = lv.list_pools()
                                 if pools:
                                     pool = pools[0]
-                                    import xml.etree.ElementTree as ET
                                     proot = ET.fromstring(pool.XMLDesc(0))
                                     pool_path = proot.findtext('.//target/path') or '/var/lib/libvirt/images'
                                     vm_dir = os.path.join(pool_path, name)
@@ -4521,7 +5074,6 @@ class Handler(BaseHTTPRequestHandler):
                                     vm_dir = '/var/lib/libvirt/images'
                             
                             # Generate unique disk name
-                            import time
                             disk_name = f"disk-{int(time.time())}.qcow2"
                             disk_path = os.path.join(vm_dir, disk_name)
                             
@@ -4530,9 +5082,8 @@ class Handler(BaseHTTPRequestHandler):
                                 template_file = template_disk.split(':', 1)[1]
                                 template_path = os.path.join(TEMPLATES_DIR, template_file)
                                 if os.path.exists(template_path):
-                                    # Copy template and resize
-                                    import subprocess
-                                    cmd = ['cp', '--reflink=always', template_path, disk_path]
+                                    # Copy template and resize; reflink where the filesystem can, plain copy otherwise
+                                    cmd = ['cp', '--reflink=auto', template_path, disk_path]
                                     subprocess.run(cmd, check=True, capture_output=True, timeout=30)
                                     # Always resize to match requested size (unless 0 = keep template size)
                                     if size_gb > 0:
@@ -4548,7 +5099,6 @@ class Handler(BaseHTTPRequestHandler):
                                     pool_name = parts[1]
                                     image_file = parts[2]
                                     pool = lv.get_pool(pool_name)
-                                    import xml.etree.ElementTree as ET
                                     pool_xml = pool.XMLDesc()
                                     pool_root = ET.fromstring(pool_xml)
                                     pool_path = pool_root.findtext('.//target/path')
@@ -4556,7 +5106,6 @@ class Handler(BaseHTTPRequestHandler):
                                         image_path = os.path.join(pool_path, 'images', image_file)
                                         if os.path.exists(image_path):
                                             # Copy the image using reflink (same as VM creation)
-                                            import subprocess
                                             try:
                                                 cmd = ['sudo', 'cp', '--reflink=always', image_path, disk_path]
                                                 subprocess.run(cmd, check=True, capture_output=True, timeout=30)
@@ -4564,7 +5113,7 @@ class Handler(BaseHTTPRequestHandler):
                                             except subprocess.CalledProcessError:
                                                 # Fallback to regular copy if reflinks not supported
                                                 logger.info(f"Reflink not supported, using regular copy for {image_file}")
-                                                shutil.copy2(image_path, disk_path)
+                                                fast_copy(image_path, disk_path)
                                             attach_immediately = True
                                         else:
                                             raise FileNotFoundError(f"Image not found: {image_path}")
@@ -4575,12 +5124,9 @@ class Handler(BaseHTTPRequestHandler):
                             elif size_gb > 50:  # For large disks, create asynchronously
                                 def create_disk_async():
                                     try:
-                                        import subprocess
-                                        cmd = ['qemu-img', 'create', '-f', 'qcow2', disk_path, f'{size_gb}G']
-                                        subprocess.run(cmd, check=True, capture_output=True)
+                                        qemu_img_create(disk_path, size_gb, preallocate_metadata=True)
                                         # Set ownership to user running the script
                                         try:
-                                            import pwd
                                             uid = os.getuid()
                                             user_info = pwd.getpwuid(uid)
                                             subprocess.run(['chown', f"{user_info.pw_name}:{user_info.pw_name}", disk_path], check=False)
@@ -4590,324 +5136,256 @@ class Handler(BaseHTTPRequestHandler):
                                     except Exception as e:
                                         logger.error(f"Failed to create disk {disk_path}: {e}")
                                 
-                                import threading
-                                threading.Thread(target=create_disk_async, daemon=True).start()
-                                msg += f"<div class='inline-note'>Creating {size_gb}GB disk in background: {disk_name}</div>"
+                                DISK_CREATE_POOL.submit(create_disk_async)
+                                note(f"Creating {size_gb}GB disk in background: {disk_name}")
                                 attach_immediately = False
                             else:
                                 # Create smaller disks synchronously for immediate attachment
-                                import subprocess
-                                cmd = ['qemu-img', 'create', '-f', 'qcow2', disk_path, f'{size_gb}G']
-                                result = subprocess.run(cmd, check=True, capture_output=True, timeout=30)
+                                qemu_img_create(disk_path, size_gb, timeout=10)
                                 attach_immediately = True
                             
                             # Attach the disk immediately for sync operations
                             if attach_immediately:
                                 # Set ownership to user running the script
                                 try:
-                                    import pwd
                                     uid = os.getuid()
                                     user_info = pwd.getpwuid(uid)
                                     subprocess.run(['chown', f"{user_info.pw_name}:{user_info.pw_name}", disk_path], check=False)
                                 except Exception as e:
                                     logger.warning(f'Failed to chown {disk_path}: {e}')
                                 
-                                dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                                existing = re.findall(r"<target dev='(vd.)'" , dom_xml)
+                                # root is still the inactive XML parsed above for the VM directory
+                                existing = [t.get('dev') for t in root.findall('.//devices/disk/target') if (t.get('dev') or '').startswith('vd')]
                                 tgt = lv.next_disk_target(existing)
-                                disk_xml = f"<disk type='file' device='disk'><driver name='qemu' type='qcow2'/><source file='{disk_path}'/><target dev='{tgt}' bus='{bus_type}'/></disk>"
+                                disk_xml = file_disk_xml(disk_path, tgt, bus_type)
                                 
                                 # Use appropriate flags based on VM state
-                                state, _ = d.state()
-                                if state == libvirt.VIR_DOMAIN_RUNNING:
-                                    flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_LIVE',0) | getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
-                                else:
-                                    flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
+                                flags = DEVICE_FLAGS_RUNNING if domain_running() else DEVICE_FLAGS_STOPPED
                                 
                                 d.attachDeviceFlags(disk_xml, flags)
+                                inactive_xml_cache.clear()
                                 if template_disk.startswith('template:'):
                                     template_msg = f" from template {template_disk.split(':', 1)[1]}"
                                 elif template_disk.startswith('image:'):
                                     template_msg = f" cloned from image {template_disk.split(':', 2)[2]}"
                                 else:
                                     template_msg = ""
-                                msg += f"<div class='inline-note'>Created and attached {size_gb}GB disk{template_msg}: {disk_name}</div>"
+                                note(f"Created and attached {size_gb}GB disk{template_msg}: {disk_name}")
                                 
                         except ValueError as e:
-                            msg += f"<div class='inline-note error'>Invalid disk size: {html.escape(str(e))}</div>"
+                            note(f"Invalid disk size: {e}", 'error')
                         except subprocess.TimeoutExpired:
-                            msg += f"<div class='inline-note error'>Disk creation timed out. Try a smaller size or wait for background creation.</div>"
+                            note("Disk creation timed out. Try a smaller size or wait for background creation.", 'error')
                         except Exception as e:
-                            msg += f"<div class='inline-note error'>Failed to create disk: {html.escape(str(e))}</div>"
+                            note(f"Failed to create disk: {e}", 'error')
                     else:
-                        msg += f"<div class='inline-note error'>Please specify disk size or select an existing image.</div>"
+                        note("Please specify disk size or select an existing image.", 'error')
                     
                 # Handle CD/DVD attachment
                 if 'attach_cdrom' in form:
                     try:
                         iso_path = form.get('cdrom_iso', [''])[0].strip()
                         if not iso_path:
-                            msg += "<div class='inline-note error'>Please select an ISO image to attach.</div>"
+                            note("Please select an ISO image to attach.", 'error')
                         else:
                             # Check if this is a pool::iso format
                             if '::' in iso_path:
                                 pool_name, iso_name = iso_path.split('::', 1)
                                 if not pool_name or not iso_name:
-                                    msg += "<div class='inline-note error'>Invalid ISO selection format. Please select a valid ISO image.</div>"
-                                    return self.page_dashboard(lv, msg=msg)
+                                    note("Invalid ISO selection format. Please select a valid ISO image.", 'error')
+                                    return self.page_dashboard(lv, msg=''.join(notes))
                                     
                                 pool = lv.get_pool(pool_name)
                                 if pool and pool.isActive():
                                     # Get the pool's path
                                     try:
                                         pool_xml = pool.XMLDesc()
-                                        import xml.etree.ElementTree as ET
                                         pool_root = ET.fromstring(pool_xml)
                                         pool_path = pool_root.findtext('.//target/path')
                                         if pool_path:
                                             # Construct full path to ISO
                                             iso_path = os.path.join(pool_path, 'images', iso_name)
                                             if not os.path.exists(iso_path):
-                                                msg += f"<div class='inline-note error'>ISO file not found: {html.escape(iso_path)}</div>"
-                                                return self.page_dashboard(lv, msg=msg)
+                                                note(f"ISO file not found: {iso_path}", 'error')
+                                                return self.page_dashboard(lv, msg=''.join(notes))
                                         else:
-                                            msg += f"<div class='inline-note error'>Could not determine path for pool {html.escape(pool_name)}</div>"
-                                            return self.page_dashboard(lv, msg=msg)
+                                            note(f"Could not determine path for pool {pool_name}", 'error')
+                                            return self.page_dashboard(lv, msg=''.join(notes))
                                     except Exception as e:
-                                        msg += f"<div class='inline-note error'>Error accessing pool {html.escape(pool_name)}: {html.escape(str(e))}</div>"
-                                        return self.page_dashboard(lv, msg=msg)
+                                        note(f"Error accessing pool {pool_name}: {e}", 'error')
+                                        return self.page_dashboard(lv, msg=''.join(notes))
                                 else:
-                                    msg += f"<div class='inline-note error'>Storage pool not found or inactive: {html.escape(pool_name)}</div>"
-                                    return self.page_dashboard(lv, msg=msg)
+                                    note(f"Storage pool not found or inactive: {pool_name}", 'error')
+                                    return self.page_dashboard(lv, msg=''.join(notes))
                             
                             # Verify the ISO file exists if it's a direct path
                             elif not os.path.isfile(iso_path):
-                                msg += f"<div class='inline-note error'>ISO file not found: {html.escape(iso_path)}</div>"
-                                return self.page_dashboard(lv, msg=msg)
+                                note(f"ISO file not found: {iso_path}", 'error')
+                                return self.page_dashboard(lv, msg=''.join(notes))
                             
                             # Find next available CD-ROM target
-                            dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                            import xml.etree.ElementTree as ET
-                            root = ET.fromstring(dom_xml)
+                            root = inactive_tree()
                             
                             # Get existing CD-ROM targets
                             existing_cdroms = set()
-                            for disk in root.findall('.//devices/disk'):
-                                if disk.get('device') == 'cdrom':
-                                    target = disk.find('target')
-                                    if target is not None and 'dev' in target.attrib:
-                                        existing_cdroms.add(target.get('dev'))
+                            for disk in domain_disks(root, device='cdrom'):
+                                target = disk.find('target')
+                                if target is not None and 'dev' in target.attrib:
+                                    existing_cdroms.add(target.get('dev'))
                             
                             # Find next available target (hda, hdb, etc.)
-                            cdrom_letters = 'abcdefghijklmnopqrstuvwxyz'
-                            tgt = None
-                            for letter in cdrom_letters:
-                                candidate = f'hd{letter}'
-                                if candidate not in existing_cdroms:
-                                    tgt = candidate
-                                    break
+                            tgt = next((t for t in CDROM_TARGETS if t not in existing_cdroms), None)
                             
                             if tgt:
-                                # Escape the ISO path for XML
-                                safe_iso_path = html.escape(iso_path)
-                                cdrom_xml = f"""<disk type='file' device='cdrom'>
-                                    <driver name='qemu' type='raw'/>
-                                    <source file='{safe_iso_path}'/>
-                                    <target dev='{tgt}' bus='ide'/>
-                                    <readonly/>
-                                </disk>"""
+                                cdrom_xml = file_disk_xml(iso_path, tgt, 'ide', 'raw', device='cdrom')
                                 
                                 # Use appropriate flags based on VM state
-                                state, _ = d.state()
-                                if state == libvirt.VIR_DOMAIN_RUNNING:
-                                    flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_LIVE',0) | getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
-                                else:
-                                    flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
+                                flags = DEVICE_FLAGS_RUNNING if domain_running() else DEVICE_FLAGS_STOPPED
                                 
                                 try:
                                     d.attachDeviceFlags(cdrom_xml, flags)
-                                    msg += f"<div class='inline-note success'>✅ CD/DVD attached successfully as {tgt}.</div>"
+                                    inactive_xml_cache.clear()
+                                    note(f"✅ CD/DVD attached successfully as {tgt}.", 'success')
                                     logger.info(f"Attached ISO {iso_path} to VM {name} as {tgt}")
                                 except libvirt.libvirtError as e:
                                     error_msg = str(e)
                                     if 'already in use by domain' in error_msg.lower():
-                                        msg += "<div class='inline-note error'>This ISO is already attached to the VM.</div>"
+                                        note("This ISO is already attached to the VM.", 'error')
                                     else:
-                                        msg += f"<div class='inline-note error'>Failed to attach CD/DVD: {html.escape(error_msg)}</div>"
+                                        note(f"Failed to attach CD/DVD: {error_msg}", 'error')
                                         logger.error(f"Failed to attach ISO {iso_path} to VM {name}: {error_msg}")
                             else:
-                                msg += "<div class='inline-note error'>No available CD-ROM targets. Maximum number of CD/DVD drives reached.</div>"
+                                note("No available CD-ROM targets. Maximum number of CD/DVD drives reached.", 'error')
                     except Exception as e:
                         error_msg = str(e)
-                        msg += f"<div class='inline-note error'>Failed to process CD/DVD attachment: {html.escape(error_msg)}</div>"
+                        note(f"Failed to process CD/DVD attachment: {error_msg}", 'error')
                         logger.error(f"Error in CD/DVD attachment: {error_msg}", exc_info=True)
                 
                 # Handle CD/DVD eject
                 if 'eject_cdrom' in form:
                     tgt = form.get('cdrom_target', [''])[0].strip()
                     if not tgt:
-                        msg += "<div class='inline-note error'>No CD/DVD target specified for ejection.</div>"
+                        note("No CD/DVD target specified for ejection.", 'error')
                     else:
                         try:
-                            dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                            import xml.etree.ElementTree as ET
-                            root = ET.fromstring(dom_xml)
-                            disk_found = False
-                            
-                            for disk in root.findall('.//devices/disk'):
-                                if disk.get('device') == 'cdrom':
-                                    t = disk.find('target')
-                                    if t is not None and t.get('dev') == tgt:
-                                        disk_found = True
-                                        # Check if there's actually media to eject
-                                        source = disk.find('source')
-                                        if source is None or 'file' not in source.attrib:
-                                            msg += f"<div class='inline-note warning'>No media found in {tgt} to eject.</div>"
-                                            break
-                                            
-                                        # Create empty CD-ROM XML (eject)
-                                        ejected_xml = f"""<disk type='file' device='cdrom'>
-                                            <driver name='qemu' type='raw'/>
-                                            <target dev='{tgt}' bus='ide'/>
-                                            <readonly/>
-                                        </disk>"""
+                            disk = inactive_disk(tgt, device='cdrom')
+                            # Check if there's actually media to eject
+                            source = disk.find('source') if disk is not None else None
+                            if disk is None:
+                                note(f"CD/DVD device {tgt} not found.", 'error')
+                            elif source is None or 'file' not in source.attrib:
+                                note(f"No media found in {tgt} to eject.", 'warning')
+                            else:
+                                # Eject: the same drive with its <source> removed (on a copy; the tree is shared)
+                                ejected = copy.copy(disk)
+                                ejected.remove(ejected.find('source'))
+                                ejected_xml = ET.tostring(ejected, encoding='unicode')
                                         
-                                        # Use appropriate flags based on VM state
-                                        state, _ = d.state()
-                                        if state == libvirt.VIR_DOMAIN_RUNNING:
-                                            flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_LIVE',0) | getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
-                                        else:
-                                            flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
+                                # Use appropriate flags based on VM state
+                                flags = DEVICE_FLAGS_RUNNING if domain_running() else DEVICE_FLAGS_STOPPED
                                         
-                                        try:
-                                            d.updateDeviceFlags(ejected_xml, flags)
-                                            msg += f"<div class='inline-note success'>✅ CD/DVD ejected from {tgt}.</div>"
-                                            logger.info(f"Ejected CD/DVD from {tgt} on VM {name}")
-                                        except libvirt.libvirtError as e:
-                                            error_msg = str(e)
-                                            if 'not found' in error_msg.lower():
-                                                msg += f"<div class='inline-note error'>CD/DVD device {tgt} not found.</div>"
-                                            else:
-                                                msg += f"<div class='inline-note error'>Failed to eject CD/DVD: {html.escape(error_msg)}</div>"
-                                                logger.error(f"Failed to eject CD/DVD from {tgt} on VM {name}: {error_msg}")
-                                        break
-                            
-                            if not disk_found:
-                                msg += f"<div class='inline-note error'>CD/DVD device {tgt} not found.</div>"
+                                try:
+                                    d.updateDeviceFlags(ejected_xml, flags)
+                                    inactive_xml_cache.clear()
+                                    note(f"✅ CD/DVD ejected from {tgt}.", 'success')
+                                    logger.info(f"Ejected CD/DVD from {tgt} on VM {name}")
+                                except libvirt.libvirtError as e:
+                                    error_msg = str(e)
+                                    if 'not found' in error_msg.lower():
+                                        note(f"CD/DVD device {tgt} not found.", 'error')
+                                    else:
+                                        note(f"Failed to eject CD/DVD: {error_msg}", 'error')
+                                        logger.error(f"Failed to eject CD/DVD from {tgt} on VM {name}: {error_msg}")
                                 
                         except Exception as e:
                             error_msg = str(e)
-                            msg += f"<div class='inline-note error'>Failed to eject CD/DVD: {html.escape(error_msg)}</div>"
+                            note(f"Failed to eject CD/DVD: {error_msg}", 'error')
                             logger.error(f"Error ejecting CD/DVD from VM {name}: {error_msg}", exc_info=True)
                 
                 # Handle CD/DVD detach (remove drive completely)
                 if 'detach_cdrom' in form:
                     tgt = form.get('cdrom_target', [''])[0].strip()
                     if not tgt:
-                        msg += "<div class='inline-note error'>No CD/DVD target specified for removal.</div>"
+                        note("No CD/DVD target specified for removal.", 'error')
                     else:
                         try:
-                            dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                            import xml.etree.ElementTree as ET
-                            root = ET.fromstring(dom_xml)
-                            disk_found = False
-                            
-                            for disk in root.findall('.//devices/disk'):
-                                if disk.get('device') == 'cdrom':
-                                    t = disk.find('target')
-                                    if t is not None and t.get('dev') == tgt:
-                                        disk_found = True
-                                        # Use appropriate flags based on VM state
-                                        state, _ = d.state()
-                                        if state == libvirt.VIR_DOMAIN_RUNNING:
-                                            flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_LIVE',0) | getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
-                                        else:
-                                            flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
+                            disk = inactive_disk(tgt, device='cdrom')
+                            if disk is None:
+                                note(f"CD/DVD device {tgt} not found.", 'error')
+                            else:
+                                # Use appropriate flags based on VM state
+                                flags = DEVICE_FLAGS_RUNNING if domain_running() else DEVICE_FLAGS_STOPPED
                                         
-                                        try:
-                                            disk_xml = ET.tostring(disk, encoding='unicode')
-                                            d.detachDeviceFlags(disk_xml, flags)
-                                            msg += f"<div class='inline-note success'>✅ CD/DVD drive {tgt} removed successfully.</div>"
-                                            logger.info(f"Removed CD/DVD drive {tgt} from VM {name}")
-                                        except libvirt.libvirtError as e:
-                                            error_msg = str(e)
-                                            if 'not found' in error_msg.lower():
-                                                msg += f"<div class='inline-note error'>CD/DVD device {tgt} not found.</div>"
-                                            else:
-                                                msg += f"<div class='inline-note error'>Failed to remove CD/DVD drive: {html.escape(error_msg)}</div>"
-                                                logger.error(f"Failed to remove CD/DVD drive {tgt} from VM {name}: {error_msg}")
-                                        break
-                            
-                            if not disk_found:
-                                msg += f"<div class='inline-note error'>CD/DVD device {tgt} not found.</div>"
+                                try:
+                                    d.detachDeviceFlags(detach_disk_xml(disk), flags)
+                                    inactive_xml_cache.clear()
+                                    note(f"✅ CD/DVD drive {tgt} removed successfully.", 'success')
+                                    logger.info(f"Removed CD/DVD drive {tgt} from VM {name}")
+                                except libvirt.libvirtError as e:
+                                    error_msg = str(e)
+                                    if 'not found' in error_msg.lower():
+                                        note(f"CD/DVD device {tgt} not found.", 'error')
+                                    else:
+                                        note(f"Failed to remove CD/DVD drive: {error_msg}", 'error')
+                                        logger.error(f"Failed to remove CD/DVD drive {tgt} from VM {name}: {error_msg}")
                                 
                         except Exception as e:
                             error_msg = str(e)
-                            msg += f"<div class='inline-note error'>Failed to remove CD/DVD drive: {html.escape(error_msg)}</div>"
+                            note(f"Failed to remove CD/DVD drive: {error_msg}", 'error')
                             logger.error(f"Error removing CD/DVD drive from VM {name}: {error_msg}", exc_info=True)
                 if 'detach_disk' in form: 
-                    if d.isActive():
-                        msg += "<div class='inline-note error'>Cannot delete disk while VM is running. Stop the VM first.</div>"
+                    if domain_active():
+                        note("Cannot delete disk while VM is running. Stop the VM first.", 'error')
                     else:
                         tgt = form.get('target', [''])[0]
-                        dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                        import xml.etree.ElementTree as ET
-                        root = ET.fromstring(dom_xml)
                         disk_path = None
-                        for disk in root.findall('.//devices/disk'):
-                            t = disk.find('target')
-                            if t is not None and t.get('dev') == tgt:
-                                # Get disk file path before detaching
-                                src = disk.find('source')
-                                if src is not None and 'file' in src.attrib:
-                                    disk_path = src.get('file')
+                        disk = inactive_disk(tgt)
+                        if disk is not None:
+                            # Get disk file path before detaching
+                            src = disk.find('source')
+                            if src is not None and 'file' in src.attrib:
+                                disk_path = src.get('file')
                                 
-                                # Use appropriate flags based on VM state
-                                state, _ = d.state()
-                                if state == libvirt.VIR_DOMAIN_RUNNING:
-                                    flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_LIVE',0) | getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
-                                else:
-                                    flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
-                                d.detachDeviceFlags(ET.tostring(disk, encoding='unicode'), flags)
+                            # Use appropriate flags based on VM state
+                            flags = DEVICE_FLAGS_RUNNING if domain_running() else DEVICE_FLAGS_STOPPED
+                            d.detachDeviceFlags(detach_disk_xml(disk), flags)
+                            inactive_xml_cache.clear()
                                 
-                                # Delete the disk file
-                                if disk_path and os.path.exists(disk_path):
-                                    try:
-                                        os.remove(disk_path)
-                                        msg += f"<div class='inline-note'>Disk {html.escape(tgt)} detached and file deleted.</div>"
-                                    except Exception as e:
-                                        msg += f"<div class='inline-note'>Disk {html.escape(tgt)} detached but failed to delete file: {html.escape(str(e))}</div>"
-                                else:
-                                    msg += f"<div class='inline-note'>Disk {html.escape(tgt)} detached.</div>"
-                                break
+                            # Delete the disk file
+                            if disk_path and os.path.exists(disk_path):
+                                try:
+                                    os.remove(disk_path)
+                                    note(f"Disk {tgt} detached and file deleted.")
+                                except Exception as e:
+                                    note(f"Disk {tgt} detached but failed to delete file: {e}")
+                            else:
+                                note(f"Disk {tgt} detached.")
                 if 'resize_disk' in form:
                     tgt = form.get('disk_target', [''])[0]
                     new_size_gb = parse_int(form.get('new_size_gb', ['0'])[0], 0)
                     if tgt and new_size_gb>0:
-                        dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                        import xml.etree.ElementTree as ET
-                        root = ET.fromstring(dom_xml)
-                        for disk in root.findall('.//devices/disk'):
-                            t = disk.find('target'); src = disk.find('source')
-                            if t is not None and t.get('dev') == tgt and src is not None and 'file' in src.attrib:
-                                path = src.get('file')
+                        disk = inactive_disk(tgt)
+                        src = disk.find('source') if disk is not None else None
+                        if src is not None and 'file' in src.attrib:
+                            path = src.get('file')
+                            # Virtual capacity via libvirt: the image may not be readable by us, and for qcow2
+                            # the file size is the allocation, not the disk size
+                            try:
+                                cur_sz = d.blockInfo(tgt)[0]
+                            except libvirt.libvirtError:
+                                cur_sz = 0
+                            new_bytes = new_size_gb * 1024 * 1024 * 1024
+                            if new_bytes > cur_sz:
                                 try:
-                                    cur_sz = os.path.getsize(path)
-                                except Exception:
-                                    cur_sz = 0
-                                new_bytes = new_size_gb * 1024 * 1024 * 1024
-                                if new_bytes > cur_sz:
-                                    try:
-                                        if d.isActive() and hasattr(d,'blockResize'):
-                                            d.blockResize(tgt, new_bytes, 0)
-                                        else:
-                                            subprocess.check_call(['sudo', 'qemu-img','resize',path,str(new_bytes)])
-                                        msg += f"<div class='inline-note'>Disk {html.escape(tgt)} grew to {new_size_gb} GB.</div>"
-                                    except Exception as e:
-                                        msg += f"<div class='inline-note'>Resize failed: {html.escape(str(e))}</div>"
-                                else:
-                                    msg += "<div class='inline-note'>New size must be larger.</div>"
-                                break
+                                    if domain_active() and hasattr(d,'blockResize'):
+                                        d.blockResize(tgt, new_bytes, 0)
+                                    else:
+                                        subprocess.check_call(['sudo', 'qemu-img','resize',path,str(new_bytes)])
+                                    note(f"Disk {tgt} grew to {new_size_gb} GB.")
+                                except Exception as e:
+                                    note(f"Resize failed: {e}")
+                            else:
+                                note("New size must be larger.")
                 if 'migrate_disk' in form:
                     # Live disk migration between pools
                     tgt = form.get('disk_target', [''])[0]
@@ -4915,23 +5393,17 @@ class Handler(BaseHTTPRequestHandler):
                     if tgt and target_pool_name:
                         try:
                             # Get disk path from VM XML
-                            dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                            import xml.etree.ElementTree as ET
-                            root = ET.fromstring(dom_xml)
                             source_path = None
                             disk_format = 'qcow2'
                             
-                            for disk in root.findall('.//devices/disk'):
-                                t = disk.find('target')
-                                if t is not None and t.get('dev') == tgt:
-                                    src = disk.find('source')
-                                    if src is not None:
-                                        source_path = src.get('file')
-                                        # Detect format
-                                        driver = disk.find('driver')
-                                        if driver is not None:
-                                            disk_format = driver.get('type', 'qcow2')
-                                    break
+                            disk = inactive_disk(tgt)
+                            src = disk.find('source') if disk is not None else None
+                            if src is not None:
+                                source_path = src.get('file')
+                                # Detect format
+                                driver = disk.find('driver')
+                                if driver is not None:
+                                    disk_format = driver.get('type', 'qcow2')
                             
                             if source_path:
                                 # Get target pool with proper XML parsing
@@ -4956,146 +5428,121 @@ class Handler(BaseHTTPRequestHandler):
                                 target_path = os.path.join(target_vm_dir, f"{base_name}.qcow2")
                                 
                                 # Perform live block copy migration
-                                if d.isActive():
+                                if domain_active():
                                     # Start background blockcopy process using virsh command
-                                    import threading
-                                    import subprocess
-                                    import uuid
                                     
                                     # Generate unique job ID for tracking
                                     job_id = str(uuid.uuid4())
                                     
                                     # Store migration status globally for progress tracking
-                                    if not hasattr(self, 'migration_jobs'):
-                                        self.migration_jobs = {}
-                                    
-                                    self.migration_jobs[job_id] = {
+                                    job = {
                                         'status': 'starting',
                                         'progress': 0,
                                         'vm_name': vm_name,
                                         'disk_target': tgt,
                                         'source_path': source_path,
                                         'target_path': target_path,
-                                        'error': None
+                                        'error': None,
+                                        'finished_at': None
                                     }
+                                    self.add_migration_job(job_id, job)
                                     
                                     def run_blockcopy():
+                                        started = pivoted = False
                                         try:
-                                            # Run virsh blockcopy command with progress monitoring
-                                            cmd = [
-                                                'virsh', 'blockcopy', vm_name, tgt,
-                                                '--dest', target_path,
-                                                '--format', 'qcow2',
-                                                '--transient-job', '--pivot', '--verbose'
-                                            ]
+                                            # Copy through libvirt's block job API; the destination gets qcow2 whatever the source format
+                                            dest = ET.Element('disk', type='file')
+                                            ET.SubElement(dest, 'driver', type='qcow2')
+                                            ET.SubElement(dest, 'source', file=target_path)
+                                            d.blockCopy(tgt, ET.tostring(dest, encoding='unicode'), flags=VIR_DOMAIN_BLOCK_COPY_TRANSIENT_JOB)
+                                            started = True
+                                            job['status'] = 'copying'
                                             
-                                            process = subprocess.Popen(
-                                                cmd, 
-                                                stdout=subprocess.PIPE, 
-                                                stderr=subprocess.STDOUT,
-                                                text=True,
-                                                bufsize=1,
-                                                universal_newlines=True
-                                            )
-                                            
-                                            # Monitor progress
+                                            # Poll the job's native counters until the mirror is in sync, then pivot onto it;
+                                            # the interval doubles (up to BLOCKCOPY_POLL_MAX) while the copy makes no progress
+                                            delay = BLOCKCOPY_POLL_MIN
+                                            last_cur = None
                                             while True:
-                                                output = process.stdout.readline()
-                                                if output == '' and process.poll() is not None:
-                                                    break
-                                                if output:
-                                                    output = output.strip()
-                                                    # Parse progress from virsh output
-                                                    if 'Block copy: [' in output and '%]' in output:
-                                                        try:
-                                                            # Extract percentage from output like "Block copy: [ 45%]"
-                                                            start = output.find('[') + 1
-                                                            end = output.find('%]')
-                                                            if start > 0 and end > start:
-                                                                progress = int(output[start:end].strip())
-                                                                self.migration_jobs[job_id]['progress'] = progress
-                                                                self.migration_jobs[job_id]['status'] = 'copying'
-                                                        except ValueError:
-                                                            pass
-                                                    elif 'successfully pivoted' in output.lower():
-                                                        self.migration_jobs[job_id]['status'] = 'pivoted'
-                                                        self.migration_jobs[job_id]['progress'] = 100
+                                                info = d.blockJobInfo(tgt, 0)
+                                                if not info:
+                                                    raise RuntimeError('Block copy job ended before it could be pivoted')
+                                                delay = BLOCKCOPY_POLL_MIN if info['cur'] != last_cur else min(delay * 2, BLOCKCOPY_POLL_MAX)
+                                                last_cur = info['cur']
+                                                if info['end']:
+                                                    job['progress'] = info['cur'] * 100 // info['end']
+                                                # cur == end == 0 is an empty disk: already in sync
+                                                if info['cur'] == info['end']:
+                                                    try:
+                                                        d.blockJobAbort(tgt, VIR_DOMAIN_BLOCK_JOB_ABORT_PIVOT)
+                                                        pivoted = True
+                                                        break
+                                                    except libvirt.libvirtError as e:
+                                                        # In sync but not yet flagged ready; try again next round
+                                                        if e.get_error_code() != VIR_ERR_BLOCK_COPY_ACTIVE:
+                                                            raise
+                                                        delay = BLOCKCOPY_POLL_MIN
+                                                time.sleep(delay)
+                                            job['status'] = 'pivoted'
+                                            job['progress'] = 100
                                             
-                                            # Check final result
-                                            return_code = process.poll()
-                                            if return_code == 0:
-                                                # Success - delete old file
-                                                try:
-                                                    old_source_dir = os.path.dirname(source_path)
-                                                    os.remove(source_path)
-                                                    # Only remove directory if it's empty (no other disk files)
-                                                    if old_source_dir != os.path.dirname(target_path):
-                                                        try:
-                                                            # Check if directory is completely empty
-                                                            if not os.listdir(old_source_dir):
-                                                                os.rmdir(old_source_dir)
-                                                            # Note: We don't remove if there are other files (like other VM disks)
-                                                        except Exception:
-                                                            pass  # Directory removal is not critical
-                                                    self.migration_jobs[job_id]['status'] = 'completed'
-                                                except Exception as e:
-                                                    self.migration_jobs[job_id]['status'] = 'completed_with_warnings'
-                                                    self.migration_jobs[job_id]['error'] = f"Could not remove old disk file: {str(e)}"
-                                            else:
-                                                self.migration_jobs[job_id]['status'] = 'failed'
-                                                self.migration_jobs[job_id]['error'] = f"blockcopy failed with return code {return_code}"
+                                            # Success - delete old file
+                                            try:
+                                                old_source_dir = os.path.dirname(source_path)
+                                                os.remove(source_path)
+                                                # Only remove directory if it's empty (no other disk files)
+                                                if old_source_dir != os.path.dirname(target_path):
+                                                    try:
+                                                        # Check if directory is completely empty
+                                                        if dir_is_empty(old_source_dir):
+                                                            os.rmdir(old_source_dir)
+                                                        # Note: We don't remove if there are other files (like other VM disks)
+                                                    except Exception:
+                                                        pass  # Directory removal is not critical
+                                                job['status'] = 'completed'
+                                            except Exception as e:
+                                                job['status'] = 'completed_with_warnings'
+                                                job['error'] = f"Could not remove old disk file: {str(e)}"
                                                 
                                         except Exception as e:
-                                            self.migration_jobs[job_id]['status'] = 'failed'
-                                            self.migration_jobs[job_id]['error'] = str(e)
+                                            job['status'] = 'failed'
+                                            job['error'] = str(e)
+                                        finally:
+                                            if started and not pivoted:
+                                                # Cancel the mirror so the guest stops writing to both images and the
+                                                # disk is free for new block jobs, then drop the partial copy
+                                                try:
+                                                    d.blockJobAbort(tgt, 0)
+                                                except Exception as e:
+                                                    logger.warning(f"Could not abort block copy of {tgt} on {vm_name}: {e}")
+                                                try:
+                                                    os.remove(target_path)
+                                                except OSError:
+                                                    pass
+                                            job['finished_at'] = time.monotonic()
                                     
-                                    # Start migration in background thread
-                                    migration_thread = threading.Thread(target=run_blockcopy)
-                                    migration_thread.daemon = True
-                                    migration_thread.start()
+                                    BLOCKCOPY_POOL.submit(run_blockcopy)
                                     
                                     # Don't add any message - the status will show under the disk
                                 else:
-                                    # Offline migration - copy file and update XML
-                                    subprocess.check_call(['sudo', 'cp', source_path, target_path])
-                                    
-                                    # Update VM XML to point to new location
-                                    for disk in root.findall('.//devices/disk'):
-                                        t = disk.find('target')
-                                        if t is not None and t.get('dev') == tgt:
-                                            src = disk.find('source')
-                                            if src is not None:
-                                                src.set('file', target_path)
-                                            break
-                                    
-                                    # Properly format the XML for defineXML
-                                    # Ensure proper XML declaration and formatting
-                                    import xml.dom.minidom
-                                    
-                                    # Convert ElementTree to string then parse with minidom for proper formatting
-                                    rough_xml = ET.tostring(root, encoding='unicode')
+                                    # Offline migration - copy file and update XML. target_vm_dir was created
+                                    # by us above, so the in-kernel copy normally needs no sudo. Both paths keep
+                                    # the image's holes, so a thin disk stays thin in the target pool.
+                                    if os.access(source_path, os.R_OK) and os.access(target_vm_dir, os.W_OK):
+                                        fast_copy(source_path, target_path)
+                                    else:
+                                        subprocess.check_call(['sudo', 'cp', '--sparse=always', source_path, target_path])
                                     
-                                    # Validate the rough XML first
-                                    if not rough_xml or not rough_xml.strip():
-                                        raise ValueError("Generated XML is empty")
+                                    # Update VM XML to point to new location (on our own copy of the tree)
+                                    root = ET.fromstring(inactive_xml())
+                                    for disk in domain_disks(root, target=tgt):
+                                        src = disk.find('source')
+                                        if src is not None:
+                                            src.set('file', target_path)
+                                        break
                                     
-                                    # Parse and format with minidom
-                                    try:
-                                        dom = xml.dom.minidom.parseString(rough_xml)
-                                        new_xml = dom.toxml()
-                                        
-                                        # Validate XML before defining
-                                        ET.fromstring(new_xml)  # Test parse
-                                        lv.conn.defineXML(new_xml)
-                                    except Exception as format_error:
-                                        # Fallback to simpler formatting
-                                        new_xml = rough_xml
-                                        if not new_xml.startswith('<?xml'):
-                                            new_xml = '<?xml version="1.0" encoding="UTF-8"?>\n' + new_xml
-                                        
-                                        # Test parse the fallback XML
-                                        ET.fromstring(new_xml)  # This will raise if XML is invalid
-                                        lv.conn.defineXML(new_xml)
+                                    new_xml = ET.tostring(root, encoding='unicode')
+                                    lv.conn.defineXML(new_xml)
+                                    inactive_xml_cache.clear()
                                     
                                     # Remove old file after successful offline migration
                                     try:
@@ -5105,122 +5552,111 @@ class Handler(BaseHTTPRequestHandler):
                                         if old_source_dir != os.path.dirname(target_path):
                                             try:
                                                 # Check if directory is completely empty
-                                                if not os.listdir(old_source_dir):
+                                                if dir_is_empty(old_source_dir):
                                                     os.rmdir(old_source_dir)
                                                 # Note: We don't remove if there are other files (like other VM disks)
                                             except Exception:
                                                 pass  # Directory removal is not critical
                                     except Exception as e:
-                                        msg += f"<div class='inline-note'>Warning: Could not remove old disk file: {html.escape(str(e))}</div>"
+                                        note(f"Warning: Could not remove old disk file: {e}")
                                     
-                                    msg += f"<div class='inline-note'>Disk {html.escape(tgt)} migrated successfully to pool '{html.escape(target_pool_name)}' at {html.escape(target_path)}</div>"
+                                    note(f"Disk {tgt} migrated successfully to pool '{target_pool_name}' at {target_path}")
                             else:
-                                msg += "<div class='inline-note error'>Could not find disk path in VM configuration.</div>"
+                                note("Could not find disk path in VM configuration.", 'error')
                         except Exception as e:
                             # Provide more detailed error information
                             error_msg = str(e)
                             if "Start tag expected" in error_msg:
                                 error_msg += " (This usually indicates an XML parsing issue during disk migration)"
-                            msg += f"<div class='inline-note error'>Disk migration failed: {html.escape(error_msg)}</div>"
+                            note(f"Disk migration failed: {error_msg}", 'error')
                 if 'change_disk_bus' in form:
-                    if d.isActive():
-                        msg += "<div class='inline-note error'>Cannot change disk bus while VM is running. Stop the VM first.</div>"
+                    if domain_active():
+                        note("Cannot change disk bus while VM is running. Stop the VM first.", 'error')
                     else:
                         tgt = form.get('disk_target', [''])[0]
                         new_bus = form.get('new_bus', ['virtio'])[0]
                         if tgt and new_bus in ['virtio', 'scsi', 'sata']:
-                            dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                            import xml.etree.ElementTree as ET
+                            dom_xml = inactive_xml()
                             root = ET.fromstring(dom_xml)
-                            for disk in root.findall('.//devices/disk'):
+                            for disk in domain_disks(root, target=tgt):
                                 t = disk.find('target')
-                                if t is not None and t.get('dev') == tgt:
-                                    # Update the bus attribute
-                                    t.set('bus', new_bus)
-                                    # Update device name prefix based on bus
-                                    prefix_map = {'virtio': 'vd', 'scsi': 'sd', 'sata': 'hd'}
-                                    new_prefix = prefix_map.get(new_bus, 'vd')
-                                    if len(tgt) >= 3:
-                                        new_dev = new_prefix + tgt[2:]  # Keep the letter part
-                                        t.set('dev', new_dev)
+                                # Update the bus attribute
+                                t.set('bus', new_bus)
+                                # Update device name prefix based on bus
+                                new_prefix = DISK_TARGET_PREFIX.get(new_bus, 'vd')
+                                if len(tgt) >= 3:
+                                    new_dev = new_prefix + tgt[2:]  # Keep the letter part
+                                    t.set('dev', new_dev)
                                     
-                                    # Remove any existing address element to avoid conflicts
-                                    address_elem = disk.find('address')
-                                    if address_elem is not None:
-                                        disk.remove(address_elem)
+                                # Remove any existing address element to avoid conflicts
+                                address_elem = disk.find('address')
+                                if address_elem is not None:
+                                    disk.remove(address_elem)
                                     
-                                    # Add SCSI controller if switching to SCSI and it doesn't exist
-                                    if new_bus == 'scsi':
-                                        devices = root.find('.//devices')
-                                        scsi_exists = devices.find(".//controller[@type='scsi']") is not None
-                                        if not scsi_exists:
-                                            scsi_controller = ET.SubElement(devices, 'controller')
-                                            scsi_controller.set('type', 'scsi')
-                                            scsi_controller.set('index', '0')
-                                            scsi_controller.set('model', 'virtio-scsi')
+                                # Add SCSI controller if switching to SCSI and it doesn't exist
+                                if new_bus == 'scsi':
+                                    devices = root.find('.//devices')
+                                    scsi_exists = devices.find(".//controller[@type='scsi']") is not None
+                                    if not scsi_exists:
+                                        scsi_controller = ET.SubElement(devices, 'controller')
+                                        scsi_controller.set('type', 'scsi')
+                                        scsi_controller.set('index', '0')
+                                        scsi_controller.set('model', 'virtio-scsi')
                                     
-                                    # Redefine the domain with the new XML
-                                    new_xml = ET.tostring(root, encoding='unicode')
-                                    d.undefine()
+                                # Redefine the domain with the new XML; defineXML replaces the existing definition in place
+                                new_xml = ET.tostring(root, encoding='unicode')
+                                try:
                                     lv.conn.defineXML(new_xml)
-                                    msg += f"<div class='inline-note'>Disk {html.escape(tgt)} bus changed to {html.escape(new_bus)}.</div>"
-                                    break
-                # DEBUG: Log all form parameters
-                print(f"DEBUG: All form parameters: {dict(form)}")
+                                except libvirt.libvirtError as e:
+                                    note(f"Failed to change bus of disk {tgt}: {e}", 'error')
+                                else:
+                                    inactive_xml_cache.clear()
+                                    note(f"Disk {tgt} bus changed to {new_bus}.")
+                                break
+                logger.debug("All form parameters: %r", form)
                 
                 if 'set_boot_device' in form:
                     boot_device = form.get('boot_device', [''])[0]
                     if boot_device:
                         try:
                             # Check if VM is running
-                            state, _ = d.state()
-                            if state == libvirt.VIR_DOMAIN_RUNNING:
-                                msg += "<div class='inline-note error'>Cannot change boot device while VM is running. Please shut down the VM first.</div>"
+                            if domain_running():
+                                note("Cannot change boot device while VM is running. Please shut down the VM first.", 'error')
                             else:
                                 # Get XML configuration for stopped domain
-                                dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                                import xml.etree.ElementTree as ET
+                                dom_xml = inactive_xml()
                                 root = ET.fromstring(dom_xml)
                                 
                                 # Remove any OS-level boot elements that might interfere
-                                os_elem = root.find('.//os')
+                                os_elem = root.find('os')
                                 if os_elem is not None:
                                     for boot_elem in os_elem.findall('boot'):
                                         os_elem.remove(boot_elem)
                                 
-                                # Remove boot order from all device elements first
-                                for device in root.findall('.//devices/*'):
+                                # One pass over the devices: drop every boot order and give the selected disk order 1
+                                device_found = False
+                                for device in root.findall('devices/*'):
                                     boot_elem = device.find('boot')
                                     if boot_elem is not None:
                                         device.remove(boot_elem)
-                                
-                                # Find the selected device and add boot order
-                                device_found = False
-                                # Check disks first
-                                for disk in root.findall('.//devices/disk'):
-                                    target = disk.find('target')
-                                    if target is not None and target.get('dev') == boot_device:
-                                        boot_elem = ET.SubElement(disk, 'boot')
-                                        boot_elem.set('order', '1')
-                                        device_found = True
-                                        break
+                                    if not device_found and device.tag == 'disk':
+                                        target = device.find('target')
+                                        if target is not None and target.get('dev') == boot_device:
+                                            ET.SubElement(device, 'boot', order='1')
+                                            device_found = True
                                 
                                 if device_found:
                                     # Convert back to XML string
                                     new_xml = ET.tostring(root, encoding='unicode')
                                     
-                                    # Redefine the domain
-                                    try:
-                                        d.undefine()
-                                    except:
-                                        pass
-                                    
+                                    # Redefine the domain; defineXML replaces the existing definition in place
                                     lv.conn.defineXML(new_xml)
-                                    msg += f"<div class='inline-note success'>Boot device set to {html.escape(boot_device)}.</div>"
+                                    inactive_xml_cache.clear()
+                                    note(f"Boot device set to {boot_device}.", 'success')
                                 else:
-                                    msg += f"<div class='inline-note error'>Device {html.escape(boot_device)} not found.</div>"
+                                    note(f"Device {boot_device} not found.", 'error')
                         except Exception as e:
-                            msg += f"<div class='inline-note error'>Failed to set boot device: {html.escape(str(e))}</div>"
+                            note(f"Failed to set boot device: {e}", 'error')
                 
                 # Handle PCI device attachment
                 if 'attach_pci' in form:
@@ -5228,9 +5664,8 @@ class Handler(BaseHTTPRequestHandler):
                     if pci_addr:
                         try:
                             # Only allow PCI attachment on stopped domains
-                            state, _ = d.state()
-                            if state == libvirt.VIR_DOMAIN_RUNNING:
-                                msg += f"<div class='inline-note error'>Cannot attach PCI device to running VM. Please stop the VM first.</div>"
+                            if domain_running():
+                                note("Cannot attach PCI device to running VM. Please stop the VM first.", 'error')
                             else:
                                 # Handle both short format (01:00.0) and full format (0000:01:00.0)
                                 if ':' in pci_addr and pci_addr.count(':') == 1:
@@ -5243,9 +5678,10 @@ class Handler(BaseHTTPRequestHandler):
                                 host_xml = f"<hostdev mode='subsystem' type='pci' managed='yes'><source><address domain='0x{dd}' bus='0x{bb}' slot='0x{slot}' function='0x{func}'/></source></hostdev>"
                                 
                                 d.attachDeviceFlags(host_xml, libvirt.VIR_DOMAIN_AFFECT_CONFIG)
-                                msg += f"<div class='inline-note'>PCI device {html.escape(pci_addr)} attached successfully.</div>"
+                                inactive_xml_cache.clear()
+                                note(f"PCI device {pci_addr} attached successfully.")
                         except Exception as e:
-                            msg += f"<div class='inline-note error'>Failed to attach PCI device: {html.escape(str(e))}</div>"
+                            note(f"Failed to attach PCI device: {e}", 'error')
                 
                 # Handle PCI device detachment
                 if 'detach_pci' in form:
@@ -5253,13 +5689,10 @@ class Handler(BaseHTTPRequestHandler):
                     if pci_addr:
                         try:
                             # Only allow PCI detachment on stopped domains
-                            state, _ = d.state()
-                            if state == libvirt.VIR_DOMAIN_RUNNING:
-                                msg += f"<div class='inline-note error'>Cannot detach PCI device from running VM. Please stop the VM first.</div>"
+                            if domain_running():
+                                note("Cannot detach PCI device from running VM. Please stop the VM first.", 'error')
                             else:
-                                dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                                import xml.etree.ElementTree as ET
-                                root = ET.fromstring(dom_xml)
+                                root = inactive_tree()
                                 
                                 for hostdev in root.findall('.//devices/hostdev'):
                                     addr_elem = hostdev.find('source/address')
@@ -5272,22 +5705,21 @@ class Handler(BaseHTTPRequestHandler):
                                         
                                         if addr_str == f"0000:{pci_addr}" or addr_str[5:] == pci_addr:
                                             d.detachDeviceFlags(ET.tostring(hostdev, encoding='unicode'), libvirt.VIR_DOMAIN_AFFECT_CONFIG)
-                                            msg += f"<div class='inline-note'>PCI device {html.escape(pci_addr)} detached successfully.</div>"
+                                            inactive_xml_cache.clear()
+                                            note(f"PCI device {pci_addr} detached successfully.")
                                             break
                         except Exception as e:
-                            msg += f"<div class='inline-note error'>Failed to detach PCI device: {html.escape(str(e))}</div>"
+                            note(f"Failed to detach PCI device: {e}", 'error')
                 
                 # Handle graphics device management
                 if 'add_graphics' in form:
                     gfx_type = form.get('graphics_type', ['vnc'])[0]
                     try:
-                        state, _ = d.state()
-                        if state == libvirt.VIR_DOMAIN_RUNNING:
-                            msg += f"<div class='inline-note error'>Cannot modify graphics while VM is running. Please stop the VM first.</div>"
+                        if domain_running():
+                            note("Cannot modify graphics while VM is running. Please stop the VM first.", 'error')
                         else:
                             # Get current XML and modify it
-                            dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                            import xml.etree.ElementTree as ET
+                            dom_xml = inactive_xml()
                             root = ET.fromstring(dom_xml)
                             devices = root.find('.//devices')
                             
@@ -5298,7 +5730,8 @@ class Handler(BaseHTTPRequestHandler):
                                 # Use attachDeviceFlags with CONFIG flag for persistent changes
                                 try:
                                     d.attachDeviceFlags(graphics_xml, libvirt.VIR_DOMAIN_AFFECT_CONFIG)
-                                    msg += f"<div class='inline-note'>{gfx_type.upper()} graphics adapter added successfully.</div>"
+                                    inactive_xml_cache.clear()
+                                    note(f"{gfx_type.upper()} graphics adapter added successfully.")
                                 except Exception:
                                     # Fallback: modify XML and redefine (avoiding NVRAM issues)
                                     new_graphics = ET.Element('graphics')
@@ -5308,25 +5741,20 @@ class Handler(BaseHTTPRequestHandler):
                                     devices.append(new_graphics)
                                     
                                     new_xml = ET.tostring(root, encoding='unicode')
-                                    # Try to preserve NVRAM by using VIR_DOMAIN_UNDEFINE_NVRAM flag
-                                    try:
-                                        d.undefineFlags(libvirt.VIR_DOMAIN_UNDEFINE_NVRAM)
-                                    except:
-                                        d.undefine()
+                                    # defineXML replaces the existing definition in place, keeping NVRAM and managed save
                                     lv.conn.defineXML(new_xml)
-                                    msg += f"<div class='inline-note'>{gfx_type.upper()} graphics adapter added successfully.</div>"
+                                    inactive_xml_cache.clear()
+                                    note(f"{gfx_type.upper()} graphics adapter added successfully.")
                     except Exception as e:
-                        msg += f"<div class='inline-note error'>Failed to add graphics adapter: {html.escape(str(e))}</div>"
+                        note(f"Failed to add graphics adapter: {e}", 'error')
                 
                 if 'remove_graphics' in form:
                     gfx_type = form.get('remove_graphics_type', [''])[0]
                     try:
-                        state, _ = d.state()
-                        if state == libvirt.VIR_DOMAIN_RUNNING:
-                            msg += f"<div class='inline-note error'>Cannot remove graphics while VM is running. Please stop the VM first.</div>"
+                        if domain_running():
+                            note("Cannot remove graphics while VM is running. Please stop the VM first.", 'error')
                         else:
-                            dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                            import xml.etree.ElementTree as ET
+                            dom_xml = inactive_xml()
                             root = ET.fromstring(dom_xml)
                             devices = root.find('.//devices')
                             
@@ -5339,7 +5767,8 @@ class Handler(BaseHTTPRequestHandler):
                                         # Use detachDeviceFlags with CONFIG flag for persistent changes
                                         try:
                                             d.detachDeviceFlags(graphics_xml, libvirt.VIR_DOMAIN_AFFECT_CONFIG)
-                                            msg += f"<div class='inline-note'>{gfx_type.upper()} graphics adapter removed successfully.</div>"
+                                            inactive_xml_cache.clear()
+                                            note(f"{gfx_type.upper()} graphics adapter removed successfully.")
                                             break
                                         except Exception:
                                             # Fallback: modify XML without undefining to avoid NVRAM issues
@@ -5347,34 +5776,30 @@ class Handler(BaseHTTPRequestHandler):
                                             new_xml = ET.tostring(root, encoding='unicode')
                                             
                                             # Use virsh define directly to update config without touching NVRAM
-                                            import tempfile
-                                            import subprocess
                                             with tempfile.NamedTemporaryFile(mode='w', suffix='.xml', delete=False) as f:
                                                 f.write(new_xml)
                                                 temp_xml = f.name
                                             
                                             try:
-                                                subprocess.run(['virsh', 'define', temp_xml], check=True, capture_output=True)
-                                                msg += f"<div class='inline-note'>{gfx_type.upper()} graphics adapter removed successfully.</div>"
-                                            except subprocess.CalledProcessError:
-                                                msg += f"<div class='inline-note error'>Failed to update domain configuration.</div>"
+                                                subprocess.run(['virsh', 'define', temp_xml], check=True, capture_output=True, timeout=VIRSH_TIMEOUT, close_fds=False)
+                                                note(f"{gfx_type.upper()} graphics adapter removed successfully.")
+                                            except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+                                                note("Failed to update domain configuration.", 'error')
                                             finally:
                                                 os.unlink(temp_xml)
                                             break
                     except Exception as e:
-                        msg += f"<div class='inline-note error'>Failed to remove graphics adapter: {html.escape(str(e))}</div>"
+                        note(f"Failed to remove graphics adapter: {e}", 'error')
                 
                 if 'add_video' in form:
                     video_type = form.get('video_type', ['qxl'])[0]
                     video_vram = form.get('video_vram', ['16384'])[0]
                     try:
-                        state, _ = d.state()
-                        if state == libvirt.VIR_DOMAIN_RUNNING:
-                            msg += f"<div class='inline-note error'>Cannot modify video while VM is running. Please stop the VM first.</div>"
+                        if domain_running():
+                            note("Cannot modify video while VM is running. Please stop the VM first.", 'error')
                         else:
                             # Get current XML and modify it
-                            dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                            import xml.etree.ElementTree as ET
+                            dom_xml = inactive_xml()
                             root = ET.fromstring(dom_xml)
                             devices = root.find('.//devices')
                             
@@ -5385,7 +5810,8 @@ class Handler(BaseHTTPRequestHandler):
                                 # Use attachDeviceFlags with CONFIG flag for persistent changes
                                 try:
                                     d.attachDeviceFlags(video_xml, libvirt.VIR_DOMAIN_AFFECT_CONFIG)
-                                    msg += f"<div class='inline-note'>{video_type.upper()} video adapter added successfully.</div>"
+                                    inactive_xml_cache.clear()
+                                    note(f"{video_type.upper()} video adapter added successfully.")
                                 except Exception:
                                     # Fallback: use virsh define to avoid NVRAM issues
                                     new_video = ET.Element('video')
@@ -5396,31 +5822,27 @@ class Handler(BaseHTTPRequestHandler):
                                     
                                     new_xml = ET.tostring(root, encoding='unicode')
                                     
-                                    import tempfile
-                                    import subprocess
                                     with tempfile.NamedTemporaryFile(mode='w', suffix='.xml', delete=False) as f:
                                         f.write(new_xml)
                                         temp_xml = f.name
                                     
                                     try:
-                                        subprocess.run(['virsh', 'define', temp_xml], check=True, capture_output=True)
-                                        msg += f"<div class='inline-note'>{video_type.upper()} video adapter added successfully.</div>"
-                                    except subprocess.CalledProcessError:
-                                        msg += f"<div class='inline-note error'>Failed to update domain configuration.</div>"
+                                        subprocess.run(['virsh', 'define', temp_xml], check=True, capture_output=True, timeout=VIRSH_TIMEOUT, close_fds=False)
+                                        note(f"{video_type.upper()} video adapter added successfully.")
+                                    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+                                        note("Failed to update domain configuration.", 'error')
                                     finally:
                                         os.unlink(temp_xml)
                     except Exception as e:
-                        msg += f"<div class='inline-note error'>Failed to add video adapter: {html.escape(str(e))}</div>"
+                        note(f"Failed to add video adapter: {e}", 'error')
                 
                 if 'remove_video' in form:
                     video_type = form.get('remove_video_type', [''])[0]
                     try:
-                        state, _ = d.state()
-                        if state == libvirt.VIR_DOMAIN_RUNNING:
-                            msg += f"<div class='inline-note error'>Cannot remove video while VM is running. Please stop the VM first.</div>"
+                        if domain_running():
+                            note("Cannot remove video while VM is running. Please stop the VM first.", 'error')
                         else:
-                            dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                            import xml.etree.ElementTree as ET
+                            dom_xml = inactive_xml()
                             root = ET.fromstring(dom_xml)
                             devices = root.find('.//devices')
                             
@@ -5434,29 +5856,28 @@ class Handler(BaseHTTPRequestHandler):
                                         # Use detachDeviceFlags with CONFIG flag for persistent changes
                                         try:
                                             d.detachDeviceFlags(video_xml, libvirt.VIR_DOMAIN_AFFECT_CONFIG)
-                                            msg += f"<div class='inline-note'>{video_type.upper()} video adapter removed successfully.</div>"
+                                            inactive_xml_cache.clear()
+                                            note(f"{video_type.upper()} video adapter removed successfully.")
                                             break
                                         except Exception:
                                             # Fallback: use virsh define to avoid NVRAM issues
                                             devices.remove(video)
                                             new_xml = ET.tostring(root, encoding='unicode')
                                             
-                                            import tempfile
-                                            import subprocess
                                             with tempfile.NamedTemporaryFile(mode='w', suffix='.xml', delete=False) as f:
                                                 f.write(new_xml)
                                                 temp_xml = f.name
                                             
                                             try:
-                                                subprocess.run(['virsh', 'define', temp_xml], check=True, capture_output=True)
-                                                msg += f"<div class='inline-note'>{video_type.upper()} video adapter removed successfully.</div>"
-                                            except subprocess.CalledProcessError:
-                                                msg += f"<div class='inline-note error'>Failed to update domain configuration.</div>"
+                                                subprocess.run(['virsh', 'define', temp_xml], check=True, capture_output=True, timeout=VIRSH_TIMEOUT, close_fds=False)
+                                                note(f"{video_type.upper()} video adapter removed successfully.")
+                                            except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+                                                note("Failed to update domain configuration.", 'error')
                                             finally:
                                                 os.unlink(temp_xml)
                                             break
                     except Exception as e:
-                        msg += f"<div class='inline-note error'>Failed to remove video adapter: {html.escape(str(e))}</div>"
+                        note(f"Failed to remove video adapter: {e}", 'error')
                 
                 if 'add_nic' in form: 
                     ntype = form.get('nic_type', ['bridge'])[0]
@@ -5482,43 +5903,34 @@ class Handler(BaseHTTPRequestHandler):
                     
                     # Use appropriate flags based on VM state
                     try:
-                        state, _ = d.state()
-                        if state == libvirt.VIR_DOMAIN_RUNNING:
-                            # VM is running - apply to both live and config
-                            flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_LIVE',0) | getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
-                        else:
-                            # VM is stopped - apply only to config
-                            flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
+                        flags = DEVICE_FLAGS_RUNNING if domain_running() else DEVICE_FLAGS_STOPPED
                         d.attachDeviceFlags(nic_xml, flags)
-                        msg += "<div class='inline-note'>NIC added successfully.</div>"
+                        inactive_xml_cache.clear()
+                        note("NIC added successfully.")
                     except Exception as e:
-                        msg += f"<div class='inline-note error'>Failed to add NIC: {html.escape(str(e))}</div>"
+                        note(f"Failed to add NIC: {e}", 'error')
                 if 'detach_nic' in form: 
                     tgt = form.get('nic_target', [''])[0]
                     nic_xml = form.get('nic_xml', [''])[0]
                     try:
                         # Use appropriate flags based on VM state
-                        state, _ = d.state()
-                        if state == libvirt.VIR_DOMAIN_RUNNING:
-                            flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_LIVE',0) | getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
-                        else:
-                            flags = getattr(libvirt,'VIR_DOMAIN_AFFECT_CONFIG',0)
+                        flags = DEVICE_FLAGS_RUNNING if domain_running() else DEVICE_FLAGS_STOPPED
                         
                         # If we have the XML directly, use it
                         if nic_xml:
                             d.detachDeviceFlags(nic_xml, flags)
-                            msg += f"<div class='inline-note'>NIC {html.escape(tgt)} detached successfully.</div>"
+                            inactive_xml_cache.clear()
+                            note(f"NIC {tgt} detached successfully.")
                         else:
                             # Fallback: search for the interface by target device
-                            dom_xml = d.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-                            import xml.etree.ElementTree as ET
-                            root = ET.fromstring(dom_xml)
+                            root = inactive_tree()
                             found = False
                             for iface in root.findall('.//devices/interface'):
                                 t = iface.find('target')
                                 if t is not None and t.get('dev') == tgt:
                                     d.detachDeviceFlags(ET.tostring(iface, encoding='unicode'), flags)
-                                    msg += f"<div class='inline-note'>NIC {html.escape(tgt)} detached successfully.</div>"
+                                    inactive_xml_cache.clear()
+                                    note(f"NIC {tgt} detached successfully.")
                                     found = True
                                     break
                             
@@ -5530,15 +5942,16 @@ class Handler(BaseHTTPRequestHandler):
                                     expected_id = f"if-{mac_addr[-8:]}" if mac_addr != f"auto-{i}" else f"if-{i}"
                                     if expected_id == tgt:
                                         d.detachDeviceFlags(ET.tostring(iface, encoding='unicode'), flags)
-                                        msg += f"<div class='inline-note'>NIC {html.escape(tgt)} detached successfully.</div>"
+                                        inactive_xml_cache.clear()
+                                        note(f"NIC {tgt} detached successfully.")
                                         found = True
                                         break
                             
                             if not found:
-                                msg += f"<div class='inline-note error'>Could not find NIC {html.escape(tgt)} to remove.</div>"
+                                note(f"Could not find NIC {tgt} to remove.", 'error')
                                 
                     except Exception as e:
-                        msg += f"<div class='inline-note error'>Failed to detach NIC: {html.escape(str(e))}</div>"
+                        note(f"Failed to detach NIC: {e}", 'error')
                 
                 # Handle snapshot operations
                 if 'create_snapshot' in form:
@@ -5549,15 +5962,15 @@ class Handler(BaseHTTPRequestHandler):
                         if snap_name:
                             # Simple virsh command execution
                             cmd = ['virsh', 'snapshot-create-as', domain_name, snap_name, '--disk-only', '--atomic']
-                            result = subprocess.run(cmd, capture_output=True, text=True)
+                            result = subprocess.run(cmd, capture_output=True, text=True, timeout=VIRSH_TIMEOUT, close_fds=False)
                             
                             if result.returncode == 0:
-                                msg += f"<div class='inline-note'>Snapshot '{html.escape(snap_name)}' created successfully.</div>"
+                                note(f"Snapshot '{snap_name}' created successfully.")
                             else:
-                                msg += f"<div class='inline-note error'>Snapshot creation failed: {html.escape(result.stderr)}</div>"
+                                note(f"Snapshot creation failed: {result.stderr}", 'error')
                         
                     except Exception as e:
-                        msg += f"<div class='inline-note error'>Failed to create snapshot: {html.escape(str(e))}</div>"
+                        note(f"Failed to create snapshot: {e}", 'error')
                 
                 if 'restore_snapshot' in form:
                     try:
@@ -5569,15 +5982,15 @@ class Handler(BaseHTTPRequestHandler):
                                 d.destroy()
                             
                             cmd = ['virsh', 'snapshot-revert', name, snap_name]
-                            result = subprocess.run(cmd, capture_output=True, text=True)
+                            result = subprocess.run(cmd, capture_output=True, text=True, timeout=VIRSH_TIMEOUT, close_fds=False)
                             
                             if result.returncode == 0:
-                                msg += f"<div class='inline-note'>Snapshot '{html.escape(snap_name)}' restored successfully.</div>"
+                                note(f"Snapshot '{snap_name}' restored successfully.")
                             else:
-                                msg += f"<div class='inline-note error'>Snapshot restore failed: {html.escape(result.stderr)}</div>"
+                                note(f"Snapshot restore failed: {result.stderr}", 'error')
                         
                     except Exception as e:
-                        msg += f"<div class='inline-note error'>Failed to restore snapshot: {html.escape(str(e))}</div>"
+                        note(f"Failed to restore snapshot: {e}", 'error')
                 
                 if 'delete_snapshot' in form:
                     try:
@@ -5585,21 +5998,22 @@ class Handler(BaseHTTPRequestHandler):
                         
                         if snap_name:
                             cmd = ['virsh', 'snapshot-delete', name, snap_name]
-                            result = subprocess.run(cmd, capture_output=True, text=True)
+                            result = subprocess.run(cmd, capture_output=True, text=True, timeout=VIRSH_TIMEOUT, close_fds=False)
                             
                             if result.returncode == 0:
-                                msg += f"<div class='inline-note'>Snapshot '{html.escape(snap_name)}' deleted successfully.</div>"
+                                SNAPSHOT_CTIME_CACHE.pop((d.UUIDString(), snap_name), None)
+                                note(f"Snapshot '{snap_name}' deleted successfully.")
                             else:
-                                msg += f"<div class='inline-note error'>Snapshot deletion failed: {html.escape(result.stderr)}</div>"
+                                note(f"Snapshot deletion failed: {result.stderr}", 'error')
                         
                     except Exception as e:
-                        msg += f"<div class='inline-note error'>Failed to delete snapshot: {html.escape(str(e))}</div>"
+                        note(f"Failed to delete snapshot: {e}", 'error')
                         
             except Exception as e:
-                msg += f"<div class='inline-note'>{html.escape(str(e))}</div>"
+                note(str(e))
         # Info gathering
         state, _ = d.state()
-        status = 'running' if state == libvirt.VIR_DOMAIN_RUNNING else 'shutoff'
+        status = 'running' if state == VIR_DOMAIN_RUNNING else 'shutoff'
         
         # Define console HTML early so it can be used in layout
         if status == 'running':
@@ -5724,7 +6138,6 @@ class Handler(BaseHTTPRequestHandler):
         auto = d.autostart()
         vm_uuid = d.UUIDString()
         xml = d.XMLDesc(0)
-        import xml.etree.ElementTree as ET
         root = ET.fromstring(xml)
         # Safe extraction of vcpu and memory values without requiring a running domain
         try:
@@ -5831,7 +6244,7 @@ class Handler(BaseHTTPRequestHandler):
         cdroms = []
         boot_device = None  # Track which device has boot order='1'
         
-        for disk in root.findall('.//devices/disk'):
+        for disk in domain_disks(root):
             tgt = disk.find('target'); src = disk.find('source'); boot = disk.find('boot')
             device_type = disk.get('device', 'disk')
             is_boot_device = boot is not None and boot.get('order') == '1'
@@ -6011,7 +6424,7 @@ class Handler(BaseHTTPRequestHandler):
         # Disks list + resize form
         disk_items=[]
         for dev, path, bus, is_boot in disks:
-            used_space, allocated_space = self.get_disk_usage(path)
+            used_space, allocated_space = self.get_disk_usage(path, lv)
             used_fmt = f"{used_space:.1f}" if used_space > 0 else '-'
             allocated_fmt = f"{allocated_space:.1f}" if allocated_space > 0 else '-'
             
@@ -6041,7 +6454,7 @@ class Handler(BaseHTTPRequestHandler):
         
         # Add disk items with professional layout
         for dev, path, bus, is_boot in disks:
-            used_space, allocated_space = self.get_disk_usage(path)
+            used_space, allocated_space = self.get_disk_usage(path, lv)
             used_fmt = f"{used_space:.1f}" if used_space > 0 else '-'
             allocated_fmt = f"{allocated_space:.1f}" if allocated_space > 0 else '-'
             current_bus = bus if bus else 'virtio'
@@ -6635,7 +7048,6 @@ class Handler(BaseHTTPRequestHandler):
         template_options = ""
         
         # Add imported images from pool images/ subdirectories (same logic as Images page)
-        import xml.etree.ElementTree as ET
         logger.info(f"Scanning for imported images in {len(lv.list_pools())} pools")
         for p in lv.list_pools():
             try:
@@ -6993,7 +7405,7 @@ class Handler(BaseHTTPRequestHandler):
         content = sections
         
         # Create layout with embedded console for running VMs  
-        main_content = f"<div style='margin-bottom: 24px;'>{msg}{''.join(content)}</div>"
+        main_content = f"<div style='margin-bottom: 24px;'>{''.join(notes)}{''.join(content)}</div>"
 
         # Add JavaScript for console functionality
         console_js = f"""
@@ -7419,7 +7831,6 @@ class Handler(BaseHTTPRequestHandler):
             try:
                 name=form.get('name',[''])[0]; mem=parse_int(form.get('memory_mb',['2048'])[0],2048); vcpus=parse_int(form.get('vcpus',['2'])[0],2); disk_gb=parse_int(form.get('disk_gb',['20'])[0],20); add_disk_gb=parse_int(form.get('extra_disk_gb',['0'])[0],0); clone_src=form.get('clone_src',[''])[0].strip(); pool=lv.get_pool(form.get('pool',[''])[0]); bridge=form.get('bridge',['virbr0'])[0]; nic_model=form.get('nic_model',['virtio'])[0]; os_type=form.get('os_type',['linux'])[0]; boot_order=form.get('boot_order',['hd,cdrom,network'])[0]
                 # Determine pool path
-                import xml.etree.ElementTree as ET
                 pxml=pool.XMLDesc(0); proot=ET.fromstring(pxml); pool_path=proot.findtext('.//target/path') or '/var/lib/libvirt/images'
                 base_name=f"{name}.qcow2"; base_path=os.path.join(pool_path, base_name)
                 if clone_src:
@@ -7472,7 +7883,6 @@ class Handler(BaseHTTPRequestHandler):
         try:
             if selected_pool:
                 p=lv.get_pool(selected_pool)
-                import xml.etree.ElementTree as ET
                 pxml=p.XMLDesc(0); proot=ET.fromstring(pxml); pool_path=proot.findtext('.//target/path') or ''
                 idir=os.path.join(pool_path,'images')
                 if os.path.isdir(idir):
@@ -7500,7 +7910,6 @@ class Handler(BaseHTTPRequestHandler):
         imported=[]
         for p in lv.list_pools():
             try:
-                import xml.etree.ElementTree as ET
                 proot=ET.fromstring(p.XMLDesc(0))
                 pool_path=proot.findtext('.//target/path') or ''
                 idir=os.path.join(pool_path,'images')
@@ -7765,14 +8174,12 @@ class Handler(BaseHTTPRequestHandler):
             pid = qs['progress_check'][0]
             if pid in PROGRESS:
                 data = PROGRESS[pid]
-                import json
                 self.send_response(200)
                 self.send_header('Content-Type', 'application/json')
                 self.end_headers()
                 self.wfile.write(json.dumps(data).encode())
                 return
             else:
-                import json
                 self.send_response(200)
                 self.send_header('Content-Type', 'application/json')
                 self.end_headers()
@@ -7786,7 +8193,6 @@ class Handler(BaseHTTPRequestHandler):
                 img=form.get('image',[''])[0]
                 if not pool_name or not img: raise RuntimeError('Missing image')
                 p=lv.get_pool(pool_name)
-                import xml.etree.ElementTree as ET
                 proot=ET.fromstring(p.XMLDesc(0))
                 pool_path=proot.findtext('.//target/path') or ''
                 path=os.path.join(pool_path,'images',img)
@@ -7847,7 +8253,6 @@ class Handler(BaseHTTPRequestHandler):
         
         for p in lv.list_pools():
             try:
-                import xml.etree.ElementTree as ET
                 pxml = p.XMLDesc(0)
                 proot = ET.fromstring(pxml)
                 pool_path = proot.findtext('.//target/path') or ''
@@ -8263,8 +8668,7 @@ class Handler(BaseHTTPRequestHandler):
                         raise RuntimeError('Select devices')
                     
                     # Create async BTRFS RAID creation
-                    import uuid as uuid_mod
-                    btrfs_pid = str(uuid_mod.uuid4())[:8]
+                    btrfs_pid = str(uuid.uuid4())[:8]
                     PROGRESS[btrfs_pid] = {'status':'starting','pct':0,'msg':'Preparing BTRFS RAID creation','ts':time.time()}
                     
                     def create_btrfs_async():
@@ -8291,7 +8695,6 @@ class Handler(BaseHTTPRequestHandler):
                             PROGRESS[btrfs_pid]['pct'] = 90
                             PROGRESS[btrfs_pid]['msg'] = 'Setting ownership'
                             try:
-                                import pwd
                                 uid = os.getuid()
                                 user_info = pwd.getpwuid(uid)
                                 subprocess.check_call(['sudo','chown','-R',f"{user_info.pw_name}:{user_info.pw_name}",mnt])
@@ -8301,10 +8704,9 @@ class Handler(BaseHTTPRequestHandler):
                             PROGRESS[btrfs_pid]['pct'] = 95
                             PROGRESS[btrfs_pid]['msg'] = 'Updating fstab'
                             try:
-                                uuid=subprocess.check_output(['blkid','-s','UUID','-o','value',devs[0]],text=True).strip()
-                                if uuid:
-                                    with open('/etc/fstab','a') as f:
-                                        f.write(f"UUID={uuid} {mnt} btrfs noatime,ssd,discard,compress=zstd 0 0\n")
+                                fs_uuid=subprocess.check_output(['blkid','-s','UUID','-o','value',devs[0]],text=True).strip()
+                                if fs_uuid:
+                                    fstab_append(f"UUID={fs_uuid} {mnt} btrfs noatime,ssd,discard,compress=zstd 0 0\n")
                             except Exception:
                                 pass
                             
@@ -8327,8 +8729,7 @@ class Handler(BaseHTTPRequestHandler):
                     mdpath=f"/dev/{name}"
                     
                     # Create async RAID creation
-                    import uuid as uuid_mod
-                    raid_pid = str(uuid_mod.uuid4())[:8]
+                    raid_pid = str(uuid.uuid4())[:8]
                     PROGRESS[raid_pid] = {'status':'starting','pct':0,'msg':'Preparing RAID creation','ts':time.time()}
                     
                     def create_raid_async():
@@ -8353,7 +8754,6 @@ class Handler(BaseHTTPRequestHandler):
                             PROGRESS[raid_pid]['pct'] = 80
                             PROGRESS[raid_pid]['msg'] = 'Setting ownership'
                             try:
-                                import pwd
                                 uid = os.getuid()
                                 user_info = pwd.getpwuid(uid)
                                 subprocess.check_call(['sudo','chown','-R',f"{user_info.pw_name}:{user_info.pw_name}",mnt])
@@ -8363,10 +8763,9 @@ class Handler(BaseHTTPRequestHandler):
                             PROGRESS[raid_pid]['pct'] = 90
                             PROGRESS[raid_pid]['msg'] = 'Updating fstab'
                             try:
-                                uuid=subprocess.check_output(['sudo','blkid','-s','UUID','-o','value',mdpath],text=True).strip()
-                                if uuid:
-                                    with open('/etc/fstab','a') as f:
-                                        f.write(f"UUID={uuid} {mnt} xfs noatime,discard 0 0\n")
+                                fs_uuid=subprocess.check_output(['sudo','blkid','-s','UUID','-o','value',mdpath],text=True).strip()
+                                if fs_uuid:
+                                    fstab_append(f"UUID={fs_uuid} {mnt} xfs noatime,discard 0 0\n")
                             except Exception:
                                 pass
                             
@@ -8528,7 +8927,6 @@ class Handler(BaseHTTPRequestHandler):
                 actions = ""
                 
                 # URL encode the parameters properly
-                import urllib.parse
                 raid_name_encoded = urllib.parse.quote(raid['name'])
                 mount_point_encoded = urllib.parse.quote(raid['mount_point'] or '')
                 # Escape single quotes for JavaScript
@@ -8684,7 +9082,6 @@ class Handler(BaseHTTPRequestHandler):
                         dev = parts[0]
                         mounted_devices.add(dev)
                         # Also add the base device for partitions
-                        import re
                         base_match = re.match(r'(/dev/[a-z]+)', dev)
                         if base_match:
                             mounted_devices.add(base_match.group(1))
@@ -8718,7 +9115,6 @@ class Handler(BaseHTTPRequestHandler):
                             if part.startswith('/dev/'):
                                 raid_devices.add(part)
                                 # Also add base device for partitions
-                                import re
                                 base_match = re.match(r'(/dev/[a-z]+)', part)
                                 if base_match:
                                     raid_devices.add(base_match.group(1))
@@ -8727,9 +9123,8 @@ class Handler(BaseHTTPRequestHandler):
             pass
         
         try:
-            import json as _json
             out = subprocess.check_output(['sudo', 'lsblk','-J','-b','-o','NAME,SIZE,MODEL,SERIAL,TYPE,TRAN,MOUNTPOINT'], text=True)
-            data=_json.loads(out)
+            data=json.loads(out)
             for b in data.get('blockdevices',[]):
                 if b.get('type')!='disk': continue
                 device_path = '/dev/' + b.get('name')
@@ -8773,7 +9168,6 @@ class Handler(BaseHTTPRequestHandler):
         try:
             # Get QEMU capabilities from libvirt
             caps_xml = self.conn.getCapabilities()
-            import xml.etree.ElementTree as ET
             caps_root = ET.fromstring(caps_xml)
             
             # Check for KVM support
@@ -9002,7 +9396,7 @@ class Handler(BaseHTTPRequestHandler):
                         out=subprocess.check_output(['sudo', 'blkid','-s','UUID','-o','value',dev], text=True).strip()
                         if out:
                             entry=f"UUID={out} {mnt} btrfs {mount_opts} 0 0\n"
-                            with open('/etc/fstab','a') as f: f.write(entry)
+                            fstab_append(entry)
                     except Exception as e2:
                         msg+=f"<div class='inline-note'>fstab UUID lookup failed: {html.escape(str(e2))}</div>"
                 msg+=f"<div class='inline-note'>Subvolume {html.escape(sub)} created & mounted.</div>"
@@ -9085,7 +9479,6 @@ class Handler(BaseHTTPRequestHandler):
                     # Get QEMU process PID for this VM
                     vm_pid = None
                     try:
-                        import subprocess
                         # Find QEMU process for this VM
                         result = subprocess.run(['pgrep', '-f', f'qemu.*{d.name()}'], 
                                               capture_output=True, text=True, timeout=2)
@@ -9135,7 +9528,6 @@ class Handler(BaseHTTPRequestHandler):
         total_write_bytes = 0  # Filesystem write (Actual DISK WRITE)
         
         try:
-            import os
             # Iterate through all process directories in /proc
             for pid_dir in os.listdir('/proc'):
                 if not pid_dir.isdigit():
@@ -9312,7 +9704,6 @@ class Handler(BaseHTTPRequestHandler):
                 return
                 
             xml = d.XMLDesc(0)
-            import xml.etree.ElementTree as ET
             root = ET.fromstring(xml)
             graphics = root.find('.//devices/graphics[@type="vnc"]')
             
@@ -9360,8 +9751,6 @@ class Handler(BaseHTTPRequestHandler):
             logger.info(f"WebSocket key: {websocket_key}")
                 
             # Generate WebSocket accept key
-            import base64
-            import hashlib
             magic_string = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
             accept_key = base64.b64encode(
                 hashlib.sha1((websocket_key + magic_string).encode()).digest()
@@ -9397,7 +9786,6 @@ class Handler(BaseHTTPRequestHandler):
             
         except Exception as e:
             logger.error(f"WebSocket VNC error: {e}")
-            import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
             try:
                 self._send('Internal Server Error', 500)
@@ -9421,7 +9809,6 @@ class Handler(BaseHTTPRequestHandler):
             client_socket.settimeout(0.1)
             
             # Data relay loop with proper WebSocket frame handling
-            import select
             running = True
             
             logger.info(f"Starting VNC proxy loop for {domain_name}")
@@ -9495,7 +9882,6 @@ class Handler(BaseHTTPRequestHandler):
                     
         except Exception as e:
             logger.error(f"VNC proxy setup error for {domain_name}: {e}")
-            import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
         finally:
             if vnc_socket:
@@ -9526,7 +9912,6 @@ class Handler(BaseHTTPRequestHandler):
             client_socket.settimeout(0.1)
             
             # Use select for efficient I/O
-            import select
             running = True
             
             while running:
@@ -9875,7 +10260,6 @@ class Handler(BaseHTTPRequestHandler):
                         
                     # If no data was received in this loop, small sleep to avoid busy waiting
                     if not data_received:
-                        import time
                         time.sleep(0.01)  # 10ms sleep
                         
                 except KeyboardInterrupt:
@@ -9887,7 +10271,6 @@ class Handler(BaseHTTPRequestHandler):
                     
         except Exception as e:
             logger.error(f"VNC proxy setup error: {e}")
-            import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
         finally:
             if vnc_socket: